@@ -5,30 +5,30 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-import json
 import logging
+import os
 
+from check_added_plugin_files.src.packages import blob_digests
+from check_added_plugin_files.src.packages import PackagePolicy
+from check_added_plugin_files.src.packages import stale_sources
+from check_added_plugin_files.src.packages import validate_packages
+from check_added_plugin_files.src.rules import PluginFinder
+from check_added_plugin_files.src.rules import RuleSet
+from utils.git_index import GitIndexError
+from utils.git_index import GitRepository
+from utils.lfs import is_lfs_pointer
+from utils.lfs import LfsClassifier
+from utils.metrics import record_run
+from utils.metrics import RunMetrics
 from utils.util import added_files
-from utils.util import CalledProcessError
-from utils.util import cmd_output
+from utils.util import git_root
+from utils.util import index_entries
+from utils.util import repository_root
+from utils.util import staged_files
 
 logging.basicConfig()
 logger = logging.getLogger("check_added_plugin_files")
 
-CHECK_FILES = {
-    "_CHANGELOG.md": 0,
-    ".tar": 0,
-    ".pyc": 0
-}
-
-ERROR_DETAILS = {
-    "_CHANGELOG.md": "\n [ X ] CHANGELOG.md file is missing. Please generate required file to commit changes.",
-    ".tar": "\n [ X ] Plug-in package file is missing. Please generate plug-in package(.tar) to commit changes.",
-    ".package": "\n [ X ] Plug-in package file is missing. Please generate plug-in package(.package) to commit changes."
-}
-
-NOT_ALLOWED_FILES = [".pyc"]
-
 
 def warning(msg):
     print("\033[93m{}\033[0m".format(msg))
@@ -42,53 +42,189 @@ def info(msg):
     print("\033[94m{}\033[0m".format(msg))
 
 
-def lfs_files():
-    try:
-        # Introduced in git-lfs 2.2.0, first working in 2.2.1
-        lfs_ret = cmd_output('git', 'lfs', 'status', '--json')
-    except CalledProcessError:  # pragma: no cover (with git-lfs)
-        lfs_ret = '{"files":{}}'
-
-    return set(json.loads(lfs_ret)['files'])
-
-
-def check_added_plugin_files(file_names):
-    file_names = (added_files() & set(file_names)) - lfs_files()
+def lfs_files(file_names, check_pointers=False):
+    """The files among file_names, relative to the repository, that git-lfs tracks.
 
+    With check_pointers, a tracked file only counts when its staged blob is
+    an LFS pointer, which it isn't when git-lfs wasn't installed to clean it.
+    """
     if not file_names:
-        return 0
+        return set()
+    try:
+        repository = GitRepository()
+    except GitIndexError:
+        repository = None
+    try:
+        if repository is not None:
+            classifier = LfsClassifier(repository.root, repository.git_dir)
+        else:
+            classifier = LfsClassifier(git_root())
+        tracked = classifier.tracked(file_names)
+        if check_pointers and tracked and repository is not None:
+            try:
+                object_ids = dict((entry.path, entry.object_id)
+                                  for entry in repository.index_entries() if entry.stage == 0)
+                tracked = set(file_name for file_name in tracked if file_name in object_ids and
+                              is_lfs_pointer(repository.read_object(object_ids[file_name])[1]))
+            except GitIndexError as exp:
+                logger.debug("Not checking LFS pointers: %s", exp)
+        return tracked
+    finally:
+        if repository is not None:
+            repository.close()
+
 
+def check_rules(rule_set, file_names):
     return_value = 0
-    for file_name in file_names:
-        for check_file, count in CHECK_FILES.iteritems():
-            if file_name.endswith(check_file):
-                CHECK_FILES[check_file] = count + 1
-                logger.debug("Found %s file" % file_name)
-                continue
-
-    for check_file_name, total_count in CHECK_FILES.iteritems():
-
-        if total_count == 0:
-            if check_file_name not in NOT_ALLOWED_FILES:
-                print(ERROR_DETAILS[check_file_name])
-                return_value += 1
-        elif total_count > 1:
-            if check_file_name in NOT_ALLOWED_FILES:
+    for rule, total_count in zip(rule_set.rules, rule_set.count(file_names)):
+        if total_count < rule.minimum:
+            print(rule.message)
+            return_value += 1
+        elif rule.maximum is not None and total_count > rule.maximum:
+            if rule.maximum == 0 and total_count > 1:
                 warning("More than one *{} files are present. "
-                        "Please delete all files with specified extension".format(check_file_name))
+                        "Please delete all files with specified extension".format(rule.name))
+            elif rule.maximum == 0:
+                error("Please delete all *{} files".format(rule.name))
             else:
-                error("More than one *{} files are present. Please delete extra files.".format(check_file_name))
+                error("More than {} *{} files are present. Please delete extra files.".format(
+                    "one" if rule.maximum == 1 else rule.maximum, rule.name))
             return_value += 1
         else:
-            if check_file_name in NOT_ALLOWED_FILES:
-                error("Please delete all *{} files".format(check_file_name))
+            logger.debug("Checked %s files" % rule.name)
+    return return_value
+
+
+def check_packages(policy, file_names, jobs, checked=None):
+    """Validate the packages among file_names, reporting their problems.
+
+    When a checked dict is given, each package is mapped there to its
+    problems and member digests, so later checks don't read it again.
+    """
+    package_files = sorted(file_name for file_name in file_names if policy.applies_to(file_name))
+    digests = {}
+    return_value = 0
+    for package_file, problems in zip(package_files,
+                                      validate_packages(package_files, policy, jobs, digests)):
+        for problem in problems:
+            error("Invalid package {}: {}".format(package_file, problem))
+        if problems:
+            return_value += 1
+        if checked is not None:
+            checked[package_file] = (problems, digests.get(package_file, {}))
+    return return_value
+
+
+def check_stale_packages(rule_set, jobs=4, checked=None):
+    """Report packages whose members differ from the staged sources of their plugin.
+
+    The staged *.py files of each plugin are looked up in every package
+    the index holds for that plugin, by their path below the plugin root.
+    Packages already in the checked dict of check_packages aren't read
+    again. Invalid packages may have been given up on halfway, so they are
+    reported as such instead of being compared. Without plugins in the
+    rules, nothing tells which package a source belongs to, so nothing is
+    checked.
+    """
+    if not rule_set.per_plugin:
+        warning("Skipping the stale package check, the rules define no plugin_markers or plugin_dirs")
+        return 0
+    policy = PackagePolicy(rule_set.package)
+    checked = dict(checked or {})
+    reported = set(checked)
+    sources = set(path for path in staged_files() if path.endswith(".py"))
+    if not sources:
+        return 0
+    object_ids = dict((repo_path, object_id)
+                      for _, object_id, repo_path in index_entries().values())
+    packages = set(path for path in object_ids if policy.applies_to(path))
+    packages -= lfs_files(packages)
+    finder = PluginFinder(repository_root(), rule_set.plugin_markers, rule_set.plugin_dirs,
+                          object_ids)
+    source_groups = finder.group(sources)
+    package_groups = finder.group(packages)
+    source_groups.pop(None, None)
+    package_groups = dict((plugin_root, plugin_packages)
+                          for plugin_root, plugin_packages in package_groups.items()
+                          if plugin_root in source_groups)
+    if not package_groups:
+        return 0
+
+    unchecked = sorted(path for plugin_packages in package_groups.values()
+                       for path in plugin_packages if path not in checked)
+    member_digests = {}
+    for package, problems in zip(unchecked,
+                                 validate_packages(unchecked, policy, jobs, member_digests)):
+        checked[package] = (problems, member_digests.get(package, {}))
+    source_digests = blob_digests(object_ids[path] for plugin_root in package_groups
+                                  for path in source_groups[plugin_root])
+    return_value = 0
+    for plugin_root in sorted(package_groups):
+        valid_packages = {}
+        for package in sorted(package_groups[plugin_root]):
+            problems, digests = checked[package]
+            if not problems:
+                valid_packages[package] = digests
+            elif package not in reported:
+                for problem in problems:
+                    error("Invalid package {}: {}".format(package, problem))
                 return_value += 1
-            else:
-                logger.debug("Checked %s file" % len(check_file_name))
+        if not valid_packages:
+            continue
+        prefix = plugin_root + "/" if plugin_root else ""
+        sources = dict((path[len(prefix):], source_digests.get(object_ids[path]))
+                       for path in source_groups[plugin_root])
+        stale, missing = stale_sources(sources, valid_packages)
+        for package, path, member in stale:
+            error("Stale package {}: {} differs from the staged {}{}".format(
+                package, member, prefix, path))
+        for path in missing:
+            error("{}{} is missing from {}".format(prefix, path, ", ".join(sorted(valid_packages))))
+        return_value += len(set(package for package, _, _ in stale)) + bool(missing)
+    return return_value
+
+
+def check_added_plugin_files(file_names, check_pointers=False, rule_set=None, jobs=4,
+                             checked=None):
+    file_names = added_files() & set(file_names)
+    file_names -= lfs_files(file_names, check_pointers)
 
+    if not file_names:
+        return 0
+
+    if rule_set is None:
+        rule_set = RuleSet.load()
+    return_value = 0
+    if rule_set.package is not None:
+        return_value += check_packages(PackagePolicy(rule_set.package), file_names, jobs,
+                                       checked)
+    if not rule_set.per_plugin:
+        return return_value + check_rules(rule_set, file_names)
+
+    finder = PluginFinder(repository_root(), rule_set.plugin_markers, rule_set.plugin_dirs,
+                          file_names)
+    groups = finder.group(file_names)
+    outside = groups.pop(None, [])
+    if outside:
+        logger.debug("%d added files are outside of every plugin" % len(outside))
+    for plugin_root in sorted(groups):
+        plugin_files = groups[plugin_root]
+        info("Checking plugin {} ({} added files)".format(plugin_root or ".", len(plugin_files)))
+        plugin_value = check_rules(rule_set, plugin_files)
+        if not plugin_value:
+            info("  OK")
+        return_value += plugin_value
     return return_value
 
 
+def check_positive(value):
+    int_value = int(value)
+    if int_value <= 0:
+        raise argparse.ArgumentTypeError(
+            "%s is an invalid positive int value" % value)
+    return int_value
+
+
 def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -103,7 +239,47 @@ def main(argv=None):
         help="set verbosity level",
         default=0
     )
+    parser.add_argument(
+        "--rules",
+        dest="rules",
+        help="JSON file of the suffix rules added files are checked against, "
+             "instead of the default rules.",
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        dest="jobs",
+        type=check_positive,
+        help="Number of added packages to validate in parallel. [default: %(default)s]",
+        default=4
+    )
+    parser.add_argument(
+        "--check-stale-packages",
+        dest="check_stale",
+        action="store_true",
+        help="Fail when a staged package doesn't hold the staged *.py files of its plugin. "
+             "Needs plugin_markers or plugin_dirs in the rules.",
+        default=False
+    )
+    parser.add_argument(
+        "--check-lfs-pointers",
+        dest="check_pointers",
+        action="store_true",
+        help="Only skip files tracked by git-lfs when their staged content is an LFS pointer.",
+        default=False
+    )
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        help="Append the duration and counts of this run to a metrics file. "
+             "[default: $HOOK_METRICS]",
+        default=os.environ.get("HOOK_METRICS")
+    )
     args = parser.parse_args(argv)
+    metrics = RunMetrics("check_added_plugin_files")
+    try:
+        rule_set = RuleSet.load(args.rules)
+    except (IOError, OSError, ValueError, KeyError, TypeError) as exp:
+        parser.error("Invalid rules %s: %r" % (args.rules, exp))
     verbose = args.verbose
     file_names = args.filenames
     if isinstance(verbose, int):
@@ -114,14 +290,24 @@ def main(argv=None):
             logger.setLevel(logging.INFO)
 
     logger.debug("Checking %s files" % len(file_names))
+    metrics.count("files_scanned", len(file_names))
     if file_names:
-        return_value = check_added_plugin_files(file_names)
+        metrics.begin("check")
+        checked = {}
+        return_value = check_added_plugin_files(file_names, args.check_pointers, rule_set,
+                                                args.jobs, checked)
+        if args.check_stale:
+            metrics.begin("stale")
+            return_value += check_stale_packages(rule_set, args.jobs, checked)
+        metrics.count("failures", return_value)
         info("Please verify modified files and add files by running "
              "`git add .` to approve modified files.")
     else:
         logger.debug("No files available for checks.")
         return_value = 0
 
+    if args.metrics:
+        record_run(args.metrics, metrics)
     return return_value
 
 
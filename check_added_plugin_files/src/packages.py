@@ -0,0 +1,266 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import fnmatch
+import hashlib
+import logging
+import posixpath
+import tarfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+from utils.cat_file import CatFile
+from utils.cat_file import CatFileError
+
+logger = logging.getLogger("check_added_plugin_files")
+
+CHUNK_SIZE = 64 * 1024
+
+DEFAULT_POLICY = {
+    "suffixes": [".tar", ".package"],
+    "required_members": ["*manifest*", "*_CHANGELOG.md"],
+    "max_members": 10000,
+    "max_member_size": 256 * 1024 ** 2,
+    "max_size": 512 * 1024 ** 2,
+    "single_root": False,
+    "checksums_member": None,
+}
+
+
+class PackagePolicy(object):
+    """What a valid plugin package looks like, from the "package" section of the rules."""
+
+    def __init__(self, config=None):
+        settings = dict(DEFAULT_POLICY)
+        settings.update(config or {})
+        self.suffixes = tuple(settings["suffixes"])
+        self.required_members = list(settings["required_members"])
+        self.max_members = settings["max_members"]
+        self.max_member_size = settings["max_member_size"]
+        self.max_size = settings["max_size"]
+        self.single_root = settings["single_root"]
+        self.checksums_member = settings["checksums_member"]
+
+    def applies_to(self, path):
+        return path.endswith(self.suffixes)
+
+
+def member_problem(member):
+    """Why a member can't be in a package, or None."""
+    name = member.name
+    parts = name.split("/")
+    if name.startswith("/") or ".." in parts:
+        return "%s points outside of the package" % name
+    if member.isdev() or member.isfifo():
+        return "%s is a special file" % name
+    if member.issym() or member.islnk():
+        target = member.linkname
+        if member.issym():
+            target = posixpath.join(posixpath.dirname(name), target)
+        target = posixpath.normpath(target)
+        if member.linkname.startswith("/") or target == ".." or target.startswith("../"):
+            return "%s links outside of the package" % name
+    return None
+
+
+def parse_checksums(data):
+    """Map member names to the sha256 listed for them, as sha256sum writes them."""
+    checksums = {}
+    for line in data.decode('utf-8').splitlines():
+        digest, _, name = line.strip().partition(" ")
+        if digest:
+            checksums[name.lstrip(" *")] = digest.lower()
+    return checksums
+
+
+def validate_stream(stream, policy):
+    """Read a package from a stream once, returning its problems and member digests.
+
+    Members are hashed as they go by, and nothing is extracted, so memory
+    use doesn't depend on the size of the package.
+    """
+    problems = []
+    digests = {}
+    checksums = None
+    roots = set()
+    total_size = 0
+    count = 0
+    try:
+        with tarfile.open(fileobj=stream, mode='r|*') as archive:
+            for member in archive:
+                count += 1
+                if count > policy.max_members:
+                    problems.append("more than %d members" % policy.max_members)
+                    break
+                problem = member_problem(member)
+                if problem:
+                    problems.append(problem)
+                    continue
+                name = posixpath.normpath(member.name)
+                roots.add(name.split("/")[0])
+                if not member.isfile():
+                    continue
+                if member.size > policy.max_member_size:
+                    problems.append("%s is larger than %d bytes" % (name, policy.max_member_size))
+                    break
+                total_size += member.size
+                if total_size > policy.max_size:
+                    problems.append("members add up to more than %d bytes" % policy.max_size)
+                    break
+                digest = hashlib.sha256()
+                content = archive.extractfile(member)
+                keep = policy.checksums_member is not None and \
+                    fnmatch.fnmatch(name, policy.checksums_member)
+                kept = []
+                chunk = content.read(CHUNK_SIZE)
+                while chunk:
+                    digest.update(chunk)
+                    if keep:
+                        kept.append(chunk)
+                    chunk = content.read(CHUNK_SIZE)
+                digests[name] = digest.hexdigest()
+                if keep:
+                    checksums = parse_checksums(b"".join(kept))
+    except (tarfile.TarError, EOFError, IOError, OSError, ValueError) as exp:
+        problems.append("not a readable tar archive (%s)" % exp)
+        return problems, digests
+    if problems:
+        return problems, digests
+    if policy.single_root and len(roots) > 1:
+        problems.append("members are spread over %d top level entries" % len(roots))
+    for pattern in policy.required_members:
+        if not any(fnmatch.fnmatch(name, pattern) for name in digests):
+            problems.append("no member matches %s" % pattern)
+    if policy.checksums_member is not None and checksums is None:
+        problems.append("no checksums in %s" % policy.checksums_member)
+    for name, expected in sorted((checksums or {}).items()):
+        if digests.get(posixpath.normpath(name)) != expected:
+            problems.append("%s doesn't match its checksum" % name)
+    return problems, digests
+
+
+def validate_staged_package(path, policy, member_digests=None, cat_file=None):
+    """Stream the staged blob of path, relative to the repository, through the checks.
+
+    The sha256 of each member is stored in member_digests[path] when a dict
+    is given.
+    """
+    if cat_file is None:
+        with CatFile() as cat_file:
+            return validate_staged_package(path, policy, member_digests, cat_file)
+    problems = None
+    try:
+        for _, object_info, stream in cat_file.contents([":" + path]):
+            if object_info is not None:
+                problems, digests = validate_stream(stream, policy)
+    except CatFileError as exp:
+        return ["could not read the staged file: %s" % exp]
+    if problems is None:
+        return ["could not read the staged file: %s is not in the index" % path]
+    for name, digest in sorted(digests.items()):
+        logger.debug("%s: %s %s", path, digest, name)
+    if member_digests is not None:
+        member_digests[path] = digests
+    return problems
+
+
+def validate_packages(paths, policy, jobs=4, digests=None):
+    """Validate staged packages in parallel, returning their problems in the order of paths.
+
+    Each worker reads the packages through its own git cat-file process.
+    """
+    if not paths:
+        return []
+    workers = threading.local()
+    cat_files = []
+
+    def validate(path):
+        if not hasattr(workers, "cat_file"):
+            workers.cat_file = CatFile()
+            cat_files.append(workers.cat_file)
+        return validate_staged_package(path, policy, digests, workers.cat_file)
+
+    pool = ThreadPool(min(jobs, len(paths)))
+    try:
+        return pool.map(validate, paths)
+    finally:
+        pool.close()
+        pool.join()
+        for cat_file in cat_files:
+            cat_file.close()
+
+
+def blob_digests(object_ids):
+    """Map each object id to the sha256 of the blob, read through one git cat-file --batch.
+
+    Blobs are hashed in chunks as git writes them, never held whole.
+    Object ids git can't find are left out.
+    """
+    digests = {}
+    with CatFile() as cat_file:
+        for object_id, object_info, stream in cat_file.contents(sorted(set(object_ids))):
+            if object_info is None or object_info.type != "blob":
+                logger.debug("%s is not a blob", object_id)
+                continue
+            digest = hashlib.sha256()
+            chunk = stream.read(CHUNK_SIZE)
+            while chunk:
+                digest.update(chunk)
+                chunk = stream.read(CHUNK_SIZE)
+            digests[object_id] = digest.hexdigest()
+    return digests
+
+
+def member_for(relative_path, members):
+    """The member of a package holding the file at relative_path in its plugin.
+
+    Packages usually put the sources under a top directory of their own,
+    so the member sharing the most trailing path components wins; None
+    when there is none, or when two members tie.
+    """
+    parts = relative_path.split("/")
+    best = None
+    best_length = 0
+    for member in members:
+        member_parts = member.split("/")
+        if member_parts[-1] != parts[-1]:
+            continue
+        length = 1
+        while length < min(len(parts), len(member_parts)) and \
+                parts[-length - 1] == member_parts[-length - 1]:
+            length += 1
+        if length > best_length:
+            best, best_length = member, length
+        elif length == best_length:
+            best = None
+    return best
+
+
+def stale_sources(sources, packages):
+    """Compare staged sources to the members packaged for them.
+
+    sources maps paths relative to the plugin to the sha256 of their
+    staged content, packages maps each package to its member digests.
+    Return the (package, path, member) of every member that differs from
+    its source and the paths no package holds.
+    """
+    stale = []
+    missing = []
+    by_basename = {}
+    for package, digests in packages.items():
+        for member in digests:
+            by_basename.setdefault((package, member.rpartition("/")[2]), []).append(member)
+    for path, digest in sorted(sources.items()):
+        found = False
+        for package, digests in sorted(packages.items()):
+            member = member_for(path, by_basename.get((package, path.rpartition("/")[2]), ()))
+            if member is None:
+                continue
+            found = True
+            if digests[member] != digest:
+                stale.append((package, path, member))
+        if not found:
+            missing.append(path)
+    return stale, missing
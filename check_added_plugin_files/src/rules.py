@@ -0,0 +1,135 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+from collections import namedtuple
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_rules.json")
+
+# trie key holding the rules whose suffix ends at a node
+MATCHES = None
+
+# how many added files may end with one of the suffixes; maximum None is unbounded
+Rule = namedtuple('Rule', 'name suffixes minimum maximum message')
+
+
+def make_rule(config):
+    suffixes = config.get("suffixes") or [config["suffix"]]
+    if not all(suffixes):
+        raise ValueError("Empty suffix in rule %r" % config)
+    minimum = config.get("min", 0)
+    maximum = config.get("max")
+    if maximum is not None and maximum < minimum:
+        raise ValueError("Rule %r allows no count" % config)
+    name = config.get("name", " or *".join(suffixes))
+    message = config.get("message")
+    if message is None:
+        message = "\n [ X ] *%s file is missing. Please add it to commit changes." % name
+    return Rule(name, tuple(suffixes), minimum, maximum, message)
+
+
+class RuleSet(object):
+    """Rules on the suffixes of added files, compiled into a trie of reversed suffixes.
+
+    Classifying a path walks its characters from the end once, whatever the
+    number of rules. A rule set isn't changed by checking paths, so one can
+    be shared by threads.
+    """
+
+    def __init__(self, rules, plugin_markers=(), plugin_dirs=(), package=None):
+        self.rules = list(rules)
+        # settings of the package validation, or None to skip it
+        self.package = package
+        self.plugin_markers = tuple(plugin_markers)
+        self.plugin_dirs = tuple(plugin_dirs)
+        self.trie = {}
+        for index, rule in enumerate(self.rules):
+            for suffix in rule.suffixes:
+                node = self.trie
+                for char in reversed(suffix):
+                    node = node.setdefault(char, {})
+                node.setdefault(MATCHES, []).append(index)
+
+    @classmethod
+    def load(cls, rules_path=None):
+        with io.open(rules_path or DEFAULT_RULES_PATH, encoding='utf-8') as rules_file:
+            config = json.load(rules_file)
+        return cls((make_rule(rule) for rule in config["rules"]),
+                   config.get("plugin_markers", ()), config.get("plugin_dirs", ()),
+                   config.get("package"))
+
+    def classify(self, path):
+        """Return the indexes of the rules path matches."""
+        matches = set()
+        node = self.trie
+        for char in reversed(path):
+            node = node.get(char)
+            if node is None:
+                break
+            matches.update(node.get(MATCHES, ()))
+        return matches
+
+    @property
+    def per_plugin(self):
+        return bool(self.plugin_markers or self.plugin_dirs)
+
+    def count(self, paths):
+        counts = [0] * len(self.rules)
+        for path in paths:
+            for index in self.classify(path):
+                counts[index] += 1
+        return counts
+
+
+class PluginFinder(object):
+    """Finds the plugin each path belongs to.
+
+    A plugin root is a directory listed in plugin_dirs or holding one of
+    the marker files, in the working tree or among the staged paths; a path
+    belongs to the nearest root above it. The answer for every directory
+    walked through is remembered, so each directory is looked at once
+    however many paths and plugins there are.
+    """
+
+    def __init__(self, root, markers=(), plugin_dirs=(), staged_paths=()):
+        self.root = root
+        self.markers = tuple(markers)
+        self.roots = dict((plugin_dir.strip("/"), plugin_dir.strip("/"))
+                          for plugin_dir in plugin_dirs)
+        self.staged_markers = set(path for path in staged_paths
+                                  if path.rpartition("/")[2] in self.markers)
+
+    def is_marked(self, directory):
+        for marker in self.markers:
+            marker_path = directory + "/" + marker if directory else marker
+            if marker_path in self.staged_markers or \
+                    os.path.exists(os.path.join(self.root, marker_path)):
+                return True
+        return False
+
+    def plugin_root(self, directory):
+        """The root of the plugin holding directory, or None outside of every plugin."""
+        walked = []
+        while directory not in self.roots:
+            if self.is_marked(directory):
+                self.roots[directory] = directory
+                break
+            walked.append(directory)
+            if not directory:
+                break
+            directory = directory.rpartition("/")[0]
+        plugin_root = self.roots.get(directory)
+        for walked_directory in walked:
+            self.roots[walked_directory] = plugin_root
+        return plugin_root
+
+    def group(self, paths):
+        """Map each plugin root to its paths, paths outside of every plugin to None."""
+        groups = {}
+        for path in paths:
+            groups.setdefault(self.plugin_root(path.rpartition("/")[0]), []).append(path)
+        return groups
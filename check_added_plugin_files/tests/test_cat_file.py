@@ -0,0 +1,82 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import pytest
+
+from utils import util
+from utils.cat_file import CatFile
+from utils.cat_file import CatFileError
+from utils.util import blob_id
+from utils.util import cmd_output
+
+BIG = b"0123456789abcdef" * 40000
+
+
+def stage_files(temp_git_dir, count):
+    paths = ["f/%03d.py" % number for number in range(count)]
+    for path in paths:
+        temp_git_dir.join(path).write(path, ensure=True)
+    temp_git_dir.join("big.bin").write_binary(BIG)
+    cmd_output('git', 'add', '.')
+    return paths
+
+
+def test_info_pipelines_many_names(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        paths = stage_files(temp_git_dir, 300)
+        process_count = util.process_count
+        with CatFile(window=16) as cat_file:
+            answers = list(cat_file.info(":" + path for path in paths + ["missing.py"]))
+            assert list(cat_file.info([":big.bin"]))[0][1].size == len(BIG)
+        assert util.process_count - process_count == 1
+        assert [name for name, _ in answers] == [":" + path for path in paths + ["missing.py"]]
+        assert answers[-1][1] is None
+        for path, (_, object_info) in zip(paths, answers):
+            assert object_info == (blob_id(path.encode('ascii')), "blob", len(path))
+
+
+def test_contents_skips_what_is_not_read(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        paths = stage_files(temp_git_dir, 10)
+        with CatFile(window=4) as cat_file:
+            names = [":big.bin", ":missing.py"] + [":" + path for path in paths]
+            contents = []
+            for name, object_info, stream in cat_file.contents(names):
+                if name == ":big.bin":
+                    assert stream.read(10) == BIG[:10]
+                    continue
+                contents.append(None if stream is None else stream.read())
+            assert contents == [None] + [path.encode('ascii') for path in paths]
+            assert cat_file.read(":big.bin") == BIG
+
+            # leaving the iterator early doesn't mix up the answers of the next one
+            for _ in cat_file.contents(":" + path for path in paths):
+                break
+            assert cat_file.read(":" + paths[-1]) == paths[-1].encode('ascii')
+            assert cat_file.read(":missing.py") is None
+
+
+def test_contents_restarts_git_rather_than_skip_much(temp_git_dir, monkeypatch):
+    monkeypatch.setattr("utils.cat_file.DRAIN_LIMIT", 1024)
+    with temp_git_dir.as_cwd():
+        paths = stage_files(temp_git_dir, 10)
+        process_count = util.process_count
+        with CatFile(window=4) as reader:
+            names = [":" + path for path in paths[:5]] + [":big.bin"] + \
+                [":" + path for path in paths[5:]]
+            contents = []
+            for name, object_info, stream in reader.contents(names):
+                contents.append(stream.read(10))
+            assert contents == [path.encode('ascii') for path in paths[:5]] + [BIG[:10]] + \
+                [path.encode('ascii') for path in paths[5:]]
+            assert reader.read(":big.bin") == BIG
+        # the big blob was left mostly unread, so git was started again
+        assert util.process_count - process_count == 2
+
+
+def test_rejects_newlines(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        with CatFile() as cat_file:
+            with pytest.raises(CatFileError):
+                list(cat_file.info(["a\nb"]))
@@ -2,16 +2,47 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import hashlib
+import io
+import json
 import subprocess
+import tarfile
 
 import pytest
 
 from check_added_plugin_files.src.check_added_plugin_files import check_added_plugin_files
 from check_added_plugin_files.src.check_added_plugin_files import main
+from check_added_plugin_files.src.packages import member_for
+from check_added_plugin_files.src.packages import PackagePolicy
+from check_added_plugin_files.src.packages import validate_packages
+from check_added_plugin_files.src.packages import validate_staged_package
+from check_added_plugin_files.src.rules import DEFAULT_RULES_PATH
 from utils.util import cmd_output
 
 REQUIRED_FILES = ["TEST_CHANGELOG.md", "TEST.tar", "TEST.png", "TEST.package"]
 NOT_ALLOWED_FILES = ["TEST.pyc"]
+PACKAGE_MEMBERS = {"test/manifest.json": b"{}", "test/TEST_CHANGELOG.md": b"# 1.0.0",
+                   "test/test.py": b"print('hello world')"}
+
+
+def write_package(path, members=None, **settings):
+    """Write a tar package of the members, a map of names to contents."""
+    with tarfile.open(str(path), 'w') as archive:
+        for name, data in sorted((members or PACKAGE_MEMBERS).items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            for key, value in settings.items():
+                setattr(info, key, value)
+            archive.addfile(info, io.BytesIO(data))
+
+
+def add_files(temp_git_dir, file_names):
+    for test_file in file_names:
+        if test_file.endswith((".tar", ".package")):
+            write_package(temp_git_dir.join(test_file))
+        else:
+            temp_git_dir.join(test_file).write("print('hello world')")
+        cmd_output('git', 'add', test_file)
 
 
 def test_nothing_added(temp_git_dir):
@@ -21,9 +52,7 @@ def test_nothing_added(temp_git_dir):
 
 def test_adding_something(temp_git_dir):
     with temp_git_dir.as_cwd():
-        for test_file in REQUIRED_FILES:
-            temp_git_dir.join(test_file).write("print('hello world')")
-            cmd_output('git', 'add', test_file)
+        add_files(temp_git_dir, REQUIRED_FILES)
 
         assert check_added_plugin_files(REQUIRED_FILES) == 0
 
@@ -31,9 +60,7 @@ def test_adding_something(temp_git_dir):
 def test_adding_not_allowed(temp_git_dir):
     with temp_git_dir.as_cwd():
         all_files = REQUIRED_FILES + NOT_ALLOWED_FILES
-        for test_file in all_files:
-            temp_git_dir.join(test_file).write("print('hello world')")
-            cmd_output('git', 'add', test_file)
+        add_files(temp_git_dir, all_files)
 
         assert check_added_plugin_files(all_files) >= 1
 
@@ -51,13 +78,32 @@ def test_integration(temp_git_dir):
     with temp_git_dir.as_cwd():
         assert main(argv=[]) == 0
 
-        with temp_git_dir.as_cwd():
-            for test_file in REQUIRED_FILES:
-                temp_git_dir.join(test_file).write("print('hello world')")
-                cmd_output('git', 'add', test_file)
+        add_files(temp_git_dir, REQUIRED_FILES)
 
         # Should not fail with default
-        assert main(argv=REQUIRED_FILES) == 3
+        assert main(argv=REQUIRED_FILES) == 0
+        # nor when run again in the same process
+        assert main(argv=REQUIRED_FILES) == 0
+
+
+def test_rules_file(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("rules.json").write(json.dumps({"rules": [
+            {"suffix": ".tar", "min": 1, "max": 1},
+            {"name": "screenshot", "suffixes": [".png", ".jpg"], "min": 1},
+            {"suffix": "_plugin.tar", "max": 0},
+            {"suffix": ".whl", "max": 0},
+        ]}))
+        for test_file in ["a_plugin.tar", "one.png", "two.jpg", "x.whl", "y.whl"]:
+            temp_git_dir.join(test_file).write("print('hello world')")
+            cmd_output('git', 'add', test_file)
+
+        assert main(["--rules", "rules.json", "a_plugin.tar", "one.png", "two.jpg",
+                     "x.whl", "y.whl"]) == 2
+        output = capsys.readouterr().out
+        assert "Please delete all *_plugin.tar files" in output
+        assert "More than one *.whl files are present" in output
+        assert "screenshot" not in output
 
 
 def has_gitlfs():
@@ -93,3 +139,177 @@ def test_moves_with_gitlfs(temp_git_dir):  # pragma: no cover
         # Now move it and make sure the hook still succeeds
         cmd_output('git', 'mv', 'a.tar', 'b.tar')
         assert main(('b.tar',)) == 0
+
+
+def test_rules_per_plugin(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("rules.json").write(json.dumps({
+            "plugin_markers": ["plugin.json"],
+            "rules": [{"suffix": "_CHANGELOG.md", "min": 1, "max": 1},
+                      {"suffix": ".tar", "min": 1, "max": 1}],
+        }))
+        added = ["plugins/a/plugin.json", "plugins/a/A_CHANGELOG.md", "plugins/a/dist/a.tar",
+                 "plugins/b/B_CHANGELOG.md", "plugins/b/src/b.py", "README.tar"]
+        temp_git_dir.join("plugins/b/plugin.json").write("{}", ensure=True)
+        for test_file in added:
+            temp_git_dir.join(test_file).write("print('hello world')", ensure=True)
+            cmd_output('git', 'add', test_file)
+
+        assert main(["--rules", "rules.json"] + added) == 1
+        output = capsys.readouterr().out
+        assert "Checking plugin plugins/a (3 added files)\033[0m\n\033[94m  OK" in output
+        assert "Checking plugin plugins/b (2 added files)\033[0m\n\n [ X ] *.tar file is missing" \
+            in output
+
+
+def test_package_problems(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        write_package(temp_git_dir.join("valid.package"))
+        write_package(temp_git_dir.join("escape.tar"),
+                      dict(PACKAGE_MEMBERS, **{"../evil.py": b"import os"}))
+        write_package(temp_git_dir.join("no_changelog.tar"), {"test/manifest.json": b"{}"})
+        temp_git_dir.join("broken.package").write("print('hello world')")
+        for test_file in ["valid.package", "escape.tar", "no_changelog.tar", "broken.package"]:
+            cmd_output('git', 'add', test_file)
+
+        problems = validate_packages(["valid.package", "escape.tar", "no_changelog.tar",
+                                      "broken.package"], PackagePolicy(), jobs=2)
+        assert problems[0] == []
+        assert problems[1] == ["../evil.py points outside of the package"]
+        assert problems[2] == ["no member matches *_CHANGELOG.md"]
+        assert problems[3][0].startswith("not a readable tar archive")
+
+        assert main(["--rules", DEFAULT_RULES_PATH, "-j", "2", "valid.package", "escape.tar",
+                     "no_changelog.tar", "broken.package"]) >= 3
+        output = capsys.readouterr().out
+        assert "Invalid package escape.tar: ../evil.py points outside" in output
+        assert "valid.package" not in output
+
+
+def test_jobs_must_be_positive(capsys):
+    with pytest.raises(SystemExit):
+        main(["-j", "0", "TEST.tar"])
+    assert "0 is an invalid positive int value" in capsys.readouterr().err
+
+
+def test_package_limits(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        members = dict(PACKAGE_MEMBERS, **{"test/data.bin": b"x" * 1000})
+        write_package(temp_git_dir.join("a.tar"), members)
+        write_package(temp_git_dir.join("b.tar"),
+                      dict(PACKAGE_MEMBERS, **{"test/link": b""}),
+                      type=tarfile.SYMTYPE, linkname="../../etc/passwd")
+        cmd_output('git', 'add', 'a.tar', 'b.tar')
+
+        policy = PackagePolicy({"max_member_size": 999})
+        assert validate_packages(["a.tar"], policy) == [
+            ["test/data.bin is larger than 999 bytes"]]
+        policy = PackagePolicy({"max_members": 3})
+        assert validate_packages(["a.tar"], policy) == [["more than 3 members"]]
+        policy = PackagePolicy({"single_root": True, "checksums_member": "*SHA256SUMS"})
+        assert validate_packages(["a.tar"], policy) == [["no checksums in *SHA256SUMS"]]
+        assert validate_packages(["missing.tar"], policy)[0][0].startswith(
+            "could not read the staged file")
+        assert validate_packages(["b.tar"], PackagePolicy())[0][0].endswith(
+            "links outside of the package")
+
+
+def test_package_checksums(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        digest = hashlib.sha256(b"# 1.0.0").hexdigest()
+        sums = "%s  test/TEST_CHANGELOG.md\n%s *test/test.py\n" % (digest, "0" * 64)
+        write_package(temp_git_dir.join("a.tar"),
+                      dict(PACKAGE_MEMBERS, **{"test/SHA256SUMS": sums.encode('ascii')}))
+        cmd_output('git', 'add', 'a.tar')
+
+        policy = PackagePolicy({"checksums_member": "*/SHA256SUMS", "single_root": True})
+        assert validate_packages(["a.tar"], policy) == [
+            ["test/test.py doesn't match its checksum"]]
+
+
+def test_member_for():
+    members = ["pkg/src/a.py", "pkg/tests/a.py", "pkg/b.py"]
+    assert member_for("src/a.py", members) == "pkg/src/a.py"
+    assert member_for("b.py", members) == "pkg/b.py"
+    assert member_for("lib/b.py", members) == "pkg/b.py"
+    assert member_for("a.py", members) is None
+    assert member_for("c.py", members) is None
+
+
+def test_stale_packages(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("rules.json").write(json.dumps({
+            "plugin_markers": ["plugin.json"], "rules": [], "package": {}}))
+        sources = {"src/a.py": b"a = 1\n", "src/b.py": b"b = 1\n"}
+        temp_git_dir.join("plugins/p/plugin.json").write("{}", ensure=True)
+        for path, data in sources.items():
+            temp_git_dir.join("plugins/p", path).write_binary(data, ensure=True)
+        members = dict(("p/" + path, data) for path, data in sources.items())
+        members.update(PACKAGE_MEMBERS)
+        temp_git_dir.join("plugins/p/dist").ensure(dir=True)
+        write_package(temp_git_dir.join("plugins/p/dist/p.tar"), members)
+        cmd_output('git', 'add', '.')
+        assert main(["--rules", "rules.json", "--check-stale-packages", "plugins/p/src/a.py"]) == 0
+
+        cmd_output('git', '-c', 'user.name=test', '-c', 'user.email=test@test',
+                   'commit', '--no-gpg-sign', '-m', 'plugin')
+        temp_git_dir.join("plugins/p/src/a.py").write("a = 2\n")
+        temp_git_dir.join("plugins/p/src/c.py").write("c = 1\n")
+        temp_git_dir.join("plugins/q/plugin.json").write("{}", ensure=True)
+        temp_git_dir.join("plugins/q/q.py").write("q = 1\n")
+        cmd_output('git', 'add', '.')
+        assert main(["--rules", "rules.json", "plugins/p/src/a.py"]) == 0
+        assert main(["--rules", "rules.json", "--check-stale-packages", "plugins/p/src/a.py"]) == 2
+        output = capsys.readouterr().out
+        assert "Stale package plugins/p/dist/p.tar: p/src/a.py differs from the staged " \
+               "plugins/p/src/a.py" in output
+        assert "plugins/p/src/c.py is missing from plugins/p/dist/p.tar" in output
+        assert "src/b.py" not in output
+        assert "q.py" not in output
+
+
+def test_stale_check_needs_plugins(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("rules.json").write(json.dumps({"rules": [], "package": {}}))
+        # every package holds an __init__.py, that of the other plugin differs
+        members = {"p/__init__.py": b"p = 1\n", "q/__init__.py": b"q = 1\n"}
+        for plugin in ("p", "q"):
+            temp_git_dir.join(plugin, "__init__.py").write("%s = 1\n" % plugin, ensure=True)
+            write_package(temp_git_dir.join(plugin, "%s.tar" % plugin), members)
+        cmd_output('git', 'add', '.')
+
+        assert main(["--rules", "rules.json", "--check-stale-packages", "p/__init__.py"]) == 0
+        output = capsys.readouterr().out
+        assert "Stale package" not in output
+        assert "Skipping the stale package check" in output
+
+
+def test_stale_check_reuses_added_packages(temp_git_dir, capsys, monkeypatch):
+    validated = []
+
+    def counting_validate(path, *args):
+        validated.append(path)
+        return validate_staged_package(path, *args)
+
+    monkeypatch.setattr("check_added_plugin_files.src.packages.validate_staged_package",
+                        counting_validate)
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("rules.json").write(json.dumps({
+            "plugin_markers": ["plugin.json"], "rules": [], "package": {"max_members": 2}}))
+        temp_git_dir.join("plugins/p/plugin.json").write("{}", ensure=True)
+        temp_git_dir.join("plugins/p/src/a.py").write("a = 1\n", ensure=True)
+        temp_git_dir.join("plugins/p/dist").ensure(dir=True)
+        write_package(temp_git_dir.join("plugins/p/dist/p.tar"))
+        cmd_output('git', 'add', '.')
+        assert main(["--rules", "rules.json", "--check-stale-packages",
+                     "plugins/p/dist/p.tar", "plugins/p/src/a.py"]) == 1
+        assert validated == ["plugins/p/dist/p.tar"]
+        output = capsys.readouterr().out
+        assert output.count("Invalid package plugins/p/dist/p.tar") == 1
+        assert "is missing from" not in output
+
+        # a package that wasn't added is validated by the stale check itself
+        assert main(["--rules", "rules.json", "--check-stale-packages", "plugins/p/src/a.py"]) == 1
+        output = capsys.readouterr().out
+        assert output.count("Invalid package plugins/p/dist/p.tar") == 1
+        assert "is missing from" not in output
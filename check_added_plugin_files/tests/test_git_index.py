@@ -0,0 +1,166 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import binascii
+import hashlib
+import struct
+import zlib
+
+import pytest
+
+from utils.git_index import GitIndexError
+from utils.git_index import GitRepository
+from utils.util import added_files
+from utils.util import blob_id
+from utils.util import cmd_output
+from utils.util import index_entries
+from utils.util import ls_files_entries
+from utils.util import repository_root
+
+
+def git_changes():
+    output = cmd_output('git', 'diff', '--staged', '--no-renames', '--name-status')
+    return sorted((tuple(line.split('\t')) for line in output.splitlines()),
+                  key=lambda change: change[1])
+
+
+def make_history(temp_git_dir):
+    cmd_output('git', 'config', 'user.email', 'hooks@example.com')
+    cmd_output('git', 'config', 'user.name', 'hooks')
+    for path in ("a/1.py", "a/b/2.py", "a/b/c/3.py", "d/4.py", "f/g/6.py", "top.md"):
+        temp_git_dir.join(path).write(path, ensure=True)
+    cmd_output('git', 'add', '.')
+    cmd_output('git', 'commit', '-m', 'first')
+
+
+def stage_changes(temp_git_dir):
+    temp_git_dir.join("a/b/2.py").write("changed")
+    temp_git_dir.join("a/b/new.tar").write("new")
+    temp_git_dir.join("e/5.py").write("new", ensure=True)
+    cmd_output('git', 'add', 'a', 'e')
+    cmd_output('git', 'rm', '-q', '--cached', 'd/4.py', 'top.md')
+    temp_git_dir.join("intent.py").write("later")
+    cmd_output('git', 'add', '--intent-to-add', 'intent.py')
+
+
+@pytest.mark.parametrize('setup', (
+    ['--index-version', '2'],
+    ['--index-version', '3'],
+    ['--index-version', '4'],
+))
+def test_staged_changes_match_git(temp_git_dir, setup):
+    with temp_git_dir.as_cwd():
+        make_history(temp_git_dir)
+        cmd_output('git', 'repack', '-adq')
+        cmd_output('git', 'update-index', *setup)
+        assert GitRepository().staged_changes() == git_changes() == []
+
+        stage_changes(temp_git_dir)
+        temp_git_dir.join("a/1.py").write("split")
+        cmd_output('git', 'add', 'a/1.py')
+        assert GitRepository().staged_changes() == git_changes()
+        assert added_files() == {"a/b/new.tar", "e/5.py"}
+        assert index_entries("a", "top.md") == ls_files_entries("a", "top.md")
+
+
+def test_unborn_branch(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("f.py").write("new")
+        cmd_output('git', 'add', 'f.py')
+        assert GitRepository().staged_changes() == [("A", "f.py")]
+
+
+def test_split_index_falls_back_to_git(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        make_history(temp_git_dir)
+        cmd_output('git', 'update-index', '--split-index')
+        stage_changes(temp_git_dir)
+        with pytest.raises(GitIndexError):
+            GitRepository().staged_changes()
+        assert added_files() == {"a/b/new.tar", "e/5.py"}
+        assert index_entries("a", "top.md") == ls_files_entries("a", "top.md")
+
+
+def size_varint(value):
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append(0x80 | (value & 0x7f))
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def write_delta_chain(temp_git_dir, depth):
+    """Write a pack holding a blob and a chain of depth deltas each adding a byte to it."""
+    pack = [b"PACK", struct.pack(">II", 2, depth + 1)]
+    offsets = []
+    position = 12
+    content = b"base"
+
+    def object_header(pack_type, size):
+        header = bytearray([(pack_type << 4) | (size & 0x0f)])
+        size >>= 4
+        while size:
+            header[-1] |= 0x80
+            header.append(size & 0x7f)
+            size >>= 7
+        return bytes(header)
+
+    for number in range(depth + 1):
+        if number:
+            # copy the whole base, then insert one byte
+            delta = (size_varint(len(content)) + size_varint(len(content) + 1) +
+                     bytes(bytearray([0xb0, len(content) & 0xff, len(content) >> 8, 1, 0x21])))
+            distance = position - offsets[-1]
+            chunk = object_header(6, len(delta))
+            varint = bytearray([distance & 0x7f])
+            distance >>= 7
+            while distance:
+                distance -= 1
+                varint.insert(0, 0x80 | (distance & 0x7f))
+                distance >>= 7
+            chunk += bytes(varint) + zlib.compress(delta)
+            content += b"!"
+        else:
+            chunk = object_header(3, len(content)) + zlib.compress(content)
+        offsets.append(position)
+        pack.append(chunk)
+        position += len(chunk)
+    pack = b"".join(pack)
+    pack += hashlib.sha1(pack).digest()
+    object_id = blob_id(content)
+    raw_id = binascii.unhexlify(object_id)
+    # an index listing only the tip of the chain is enough for the reader
+    fanout = [0] * 256
+    for byte in range(bytearray(raw_id)[0], 256):
+        fanout[byte] = 1
+    index = (b"\377tOc" + struct.pack(">I", 2) + struct.pack(">256I", *fanout) + raw_id +
+             struct.pack(">II", 0, offsets[-1]))
+    pack_dir = temp_git_dir.join(".git", "objects", "pack")
+    pack_dir.join("pack-chain.pack").write_binary(pack, ensure=True)
+    pack_dir.join("pack-chain.idx").write_binary(index)
+    return object_id, content
+
+
+def test_deep_delta_chains(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        object_id, content = write_delta_chain(temp_git_dir, 3000)
+        with GitRepository() as repository:
+            assert repository.read_object(object_id) == (b"blob", content)
+            assert repository.packs
+        assert repository.packs is None
+
+        pack_path = temp_git_dir.join(".git", "objects", "pack", "pack-chain.pack")
+        pack_path.write_binary(pack_path.read_binary()[:-200])
+        with pytest.raises(GitIndexError):
+            GitRepository().read_object(object_id)
+
+
+def test_repository_root(temp_git_dir, monkeypatch):
+    with temp_git_dir.join("a", "b").ensure(dir=True).as_cwd():
+        assert repository_root() == temp_git_dir.realpath().strpath
+        # outside of what the reader supports, git is asked
+        monkeypatch.setenv("GIT_DIR", temp_git_dir.join(".git").strpath)
+        monkeypatch.setenv("GIT_WORK_TREE", temp_git_dir.strpath)
+        assert repository_root() == temp_git_dir.realpath().strpath
@@ -0,0 +1,58 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from check_added_plugin_files.src.check_added_plugin_files import lfs_files
+from utils.lfs import LfsClassifier
+from utils.util import cmd_output
+
+ATTRIBUTES = """
+# packages and images
+*.tar filter=lfs diff=lfs merge=lfs -text
+[attr]big filter=lfs -text
+*.png big
+docs/**/*.pdf filter=lfs
+/top.bin filter=lfs
+build/ filter=lfs
+"with space.zip" filter=lfs
+*.[ch]sv filter=lfs
+"""
+
+NESTED_ATTRIBUTES = """
+keep.tar -filter
+*.iso filter=lfs
+sub/*.dat filter=lfs
+"""
+
+PATHS = [
+    "a.tar", "plugins/x/a.tar", "plugins/x/keep.tar", "keep.tar", "image.png",
+    "docs/a/b/c.pdf", "docs/c.pdf", "other/docs/c.pdf", "top.bin", "dir/top.bin",
+    "build/out.tar.gz", "with space.zip", "data.csv", "data.hsv", "data.tsv",
+    "plugins/x/disk.iso", "disk.iso", "plugins/x/sub/a.dat", "plugins/x/sub/deeper/a.dat",
+]
+
+
+def test_classifier_matches_check_attr(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join(".gitattributes").write(ATTRIBUTES)
+        temp_git_dir.join("plugins", "x", ".gitattributes").write(NESTED_ATTRIBUTES, ensure=True)
+        temp_git_dir.join(".git", "info", "attributes").write("data.csv filter=lfs\n", ensure=True)
+        output = cmd_output('git', 'check-attr', '--stdin', 'filter',
+                            input="".join(path + "\n" for path in PATHS))
+        expected = set(line.rsplit(": filter: ", 1)[0] for line in output.splitlines()
+                       if line.endswith(": filter: lfs"))
+
+        assert LfsClassifier(temp_git_dir.strpath).tracked(PATHS) == expected
+        assert "plugins/x/a.tar" in expected and "plugins/x/keep.tar" not in expected
+
+
+def test_lfs_pointers_are_checked(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join(".gitattributes").write("*.tar filter=lfs\n")
+        temp_git_dir.join("pointer.tar").write(
+            "version https://git-lfs.github.com/spec/v1\noid sha256:00\nsize 10\n")
+        temp_git_dir.join("plain.tar").write("not cleaned by git-lfs")
+        cmd_output('git', 'add', '.gitattributes', 'pointer.tar', 'plain.tar')
+
+        assert lfs_files({"pointer.tar", "plain.tar"}) == {"pointer.tar", "plain.tar"}
+        assert lfs_files({"pointer.tar", "plain.tar"}, check_pointers=True) == {"pointer.tar"}
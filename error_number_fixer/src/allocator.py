@@ -0,0 +1,171 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+from utils.file_lock import FileLock
+
+logger = logging.getLogger("error_number_fixer")
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_LEASE_SECONDS = 600
+
+
+def process_alive(pid):
+    if not hasattr(os, 'kill'):  # pragma: no cover
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as exp:
+        return exp.errno == errno.EPERM
+    return True
+
+
+class NumberAllocator(object):
+    """Hands out error number ranges from a state file shared by concurrent runs.
+
+    Every series has its own pool: the next unused number, ranges returned by
+    finished leases, and the live leases. A lease whose process died (or whose
+    expiry passed, for processes on other hosts) is dropped without returning
+    its ranges, since any of those numbers may already be in a file.
+    """
+
+    def __init__(self, state_path, batch_size=DEFAULT_BATCH_SIZE,
+                 lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.state_path = os.path.abspath(state_path)
+        self.lock_path = self.state_path + ".lock"
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.host = socket.gethostname()
+
+    def load(self):
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return {"pools": {}}
+
+    def save(self, state):
+        temp_path = "%s.%d.tmp" % (self.state_path, os.getpid())
+        with open(temp_path, 'w') as state_file:
+            json.dump(state, state_file, sort_keys=True)
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, self.state_path)
+        else:  # pragma: no cover (python 2)
+            os.rename(temp_path, self.state_path)
+
+    def get_pool(self, state, error_series):
+        pool = state["pools"].setdefault(
+            str(error_series), {"next": error_series + 1, "free": [], "leases": {}})
+        now = time.time()
+        for lease_id, lease in list(pool["leases"].items()):
+            if lease["host"] == self.host:
+                expired = not process_alive(lease["pid"])
+            else:
+                expired = lease["expires"] < now
+            if expired:
+                logger.debug("Dropping expired lease %s of pid %s", lease_id, lease["pid"])
+                del pool["leases"][lease_id]
+        return pool
+
+    def take_range(self, pool, count):
+        if pool["free"]:
+            start, end = pool["free"].pop(0)
+            if end - start > count:
+                pool["free"].insert(0, [start + count, end])
+                end = start + count
+            return [start, end]
+        start = pool["next"]
+        pool["next"] = start + count
+        return [start, start + count]
+
+    def reserve(self, error_series, count=None):
+        lease = NumberLease(self, error_series, uuid.uuid4().hex)
+        lease.add_range(self.extend(lease, count))
+        return lease
+
+    def extend(self, lease, count=None):
+        with FileLock(self.lock_path):
+            state = self.load()
+            pool = self.get_pool(state, lease.error_series)
+            number_range = self.take_range(pool, count or self.batch_size)
+            entry = pool["leases"].setdefault(lease.lease_id, {
+                "host": self.host, "pid": os.getpid(), "ranges": []})
+            entry["ranges"].append(number_range)
+            entry["expires"] = time.time() + self.lease_seconds
+            self.save(state)
+        return number_range
+
+    def renew(self, lease):
+        with FileLock(self.lock_path):
+            state = self.load()
+            pool = self.get_pool(state, lease.error_series)
+            if lease.lease_id in pool["leases"]:
+                pool["leases"][lease.lease_id]["expires"] = time.time() + self.lease_seconds
+                self.save(state)
+
+    def release(self, lease, unused_ranges):
+        with FileLock(self.lock_path):
+            state = self.load()
+            pool = self.get_pool(state, lease.error_series)
+            pool["leases"].pop(lease.lease_id, None)
+            free = sorted(pool["free"] + [list(r) for r in unused_ranges if r[0] < r[1]])
+            pool["free"] = []
+            for number_range in free:
+                if pool["free"] and pool["free"][-1][1] == number_range[0]:
+                    pool["free"][-1][1] = number_range[1]
+                else:
+                    pool["free"].append(number_range)
+            self.save(state)
+
+
+class NumberLease(object):
+    """Iterator over the numbers reserved by one process for one series.
+
+    Numbers are taken locally from the reserved ranges; the shared state is
+    only locked again when the batch runs out or the lease needs renewing.
+    """
+
+    def __init__(self, allocator, error_series, lease_id):
+        self.allocator = allocator
+        self.error_series = error_series
+        self.lease_id = lease_id
+        self.ranges = []
+        self.renewed = time.time()
+        self.released = False
+
+    def add_range(self, number_range):
+        self.ranges.append(list(number_range))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.released:
+            raise ValueError("Lease %s was already released" % self.lease_id)
+        while self.ranges and self.ranges[0][0] >= self.ranges[0][1]:
+            self.ranges.pop(0)
+        if not self.ranges:
+            self.add_range(self.allocator.extend(self))
+            self.renewed = time.time()
+        elif time.time() - self.renewed > self.allocator.lease_seconds / 2:
+            self.allocator.renew(self)
+            self.renewed = time.time()
+        number = self.ranges[0][0]
+        self.ranges[0][0] += 1
+        return number
+
+    next = __next__
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.allocator.release(self, self.ranges)
@@ -0,0 +1,217 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import traceback
+
+from error_number_fixer.src.error_number_fixer import check_positive
+from error_number_fixer.src.error_number_fixer import collect_source_files
+from error_number_fixer.src.error_number_fixer import fix_file
+from error_number_fixer.src.error_number_fixer import get_error_number
+from error_number_fixer.src.error_number_fixer import get_file_size
+from error_number_fixer.src.error_number_fixer import report_failures
+from error_number_fixer.src.error_number_fixer import write_fixed_source
+from error_number_fixer.src.memory import MemoryBudget
+from error_number_fixer.src.memory import parse_size
+from error_number_fixer.src.progress import ProgressReporter
+from error_number_fixer.src.report import count_edits
+from error_number_fixer.src.report import FixReporter
+from error_number_fixer.src.report import OUTPUT_MODES
+from error_number_fixer.src.result_cache import DEFAULT_CACHE_SIZE
+from error_number_fixer.src.result_cache import ResultCache
+from error_number_fixer.src.scheduler import run_tasks
+from utils.metrics import record_run
+from utils.metrics import RunMetrics
+
+logger = logging.getLogger("error_number_fixer")
+
+
+class Repository(object):
+    """One entry of the batch configuration and what the run did to it."""
+
+    def __init__(self, path, error_series=None, input_paths=None):
+        self.path = path
+        self.error_series = error_series
+        self.input_paths = [os.path.normpath(os.path.join(path, input_path))
+                            for input_path in input_paths or ["."]]
+        self.files = 0
+        self.bytes = 0
+        self.changed = 0
+        self.edits = 0
+        self.failures = []
+
+    def as_dict(self):
+        return {
+            "path": self.path,
+            "files": self.files,
+            "bytes": self.bytes,
+            "changed": self.changed,
+            "edits": self.edits,
+            "failures": [{"file": source_file, "error": message.strip().splitlines()[-1]}
+                         for source_file, message in self.failures],
+        }
+
+
+def load_repositories(config_path):
+    """Read the batch configuration, a JSON list of repositories.
+
+    Each entry is a path, or an object with "path" and optionally
+    "error_series" and "paths" (directories inside the repository).
+    Relative paths are taken from the directory of the configuration.
+    """
+    with io.open(config_path, encoding='utf-8') as config_file:
+        config = json.load(config_file)
+    if isinstance(config, dict):
+        config = config["repositories"]
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+    repositories = []
+    for entry in config:
+        if not isinstance(entry, dict):
+            entry = {"path": entry}
+        error_series = entry.get("error_series")
+        if error_series is not None:
+            error_series = check_positive(error_series)
+        repositories.append(Repository(
+            os.path.normpath(os.path.join(base_dir, entry["path"])),
+            error_series, entry.get("paths")))
+    return repositories
+
+
+def print_report(repositories):
+    width = max([len("Repository")] + [len(repository.path) for repository in repositories])
+    print("\033[93m%-*s  %7s  %7s  %7s  %7s\033[0m"
+          % (width, "Repository", "files", "changed", "edits", "failed"))
+    for repository in repositories:
+        print("%-*s  %7d  %7d  %7d  %7d" % (width, repository.path, repository.files,
+                                            repository.changed, repository.edits,
+                                            len(repository.failures)))
+
+
+def main(argv=None):
+    """Fix many repositories in one run, sharing a single pool of workers."""
+    parser = argparse.ArgumentParser(description="FSO Plugin Error Number Fixer, batch mode")
+    parser.add_argument("config", help="JSON list of repositories to fix", metavar="config_file")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=check_positive,
+                        help="Number of files to fix in parallel. [default: %(default)s]",
+                        metavar="jobs", default=1)
+    parser.add_argument("--max-memory", dest="max_memory", type=parse_size,
+                        help="Peak memory budget for files being fixed (e.g. 512M, 2G).",
+                        metavar="size")
+    parser.add_argument("--timeout", dest="timeout", type=check_positive,
+                        help="Give up on a file after this many seconds.",
+                        metavar="seconds")
+    parser.add_argument("--cache-dir", dest="cache_dir",
+                        help="Directory of a result cache keyed by file content. "
+                             "[default: $ERROR_NUMBER_FIXER_CACHE]",
+                        metavar="cache_dir", default=os.environ.get("ERROR_NUMBER_FIXER_CACHE"))
+    parser.add_argument("--cache-size", dest="cache_size", type=parse_size,
+                        help="Size the result cache is pruned to. [default: 256M]",
+                        metavar="size", default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--output", dest="output", choices=OUTPUT_MODES,
+                        help="Per file output. [default: %(default)s]", default="summary")
+    parser.add_argument("--report", dest="report",
+                        help="Also write the per repository report as JSON to this file.",
+                        metavar="report_file")
+    parser.add_argument("--metrics", dest="metrics",
+                        help="Append the phase durations and counts of this run to a metrics "
+                             "file. [default: $HOOK_METRICS]",
+                        metavar="metrics_file", default=os.environ.get("HOOK_METRICS"))
+    parser.add_argument("--no-progress", dest="progress", action="store_false",
+                        help="Don't report throughput while running.", default=True)
+    parser.add_argument("--no-verify", dest="verify", action="store_false",
+                        help="Skip checking the token stream of each fixed file.", default=True)
+    parser.add_argument("-v", "--verbose", dest="verbose",
+                        action="count", help="set verbosity level",
+                        default=0)
+    args = parser.parse_args(argv)
+    logger.setLevel(logging.DEBUG if args.verbose > 0 else logging.INFO)
+    metrics = RunMetrics("error_number_fixer_batch")
+
+    try:
+        repositories = load_repositories(args.config)
+    except (IOError, OSError, ValueError, KeyError, argparse.ArgumentTypeError) as exp:
+        parser.error("Invalid configuration %s: %r" % (args.config, exp))
+    budget = MemoryBudget(args.max_memory) if args.max_memory else None
+    cache = ResultCache(args.cache_dir, args.cache_size) if args.cache_dir else None
+
+    metrics.begin("collect")
+    source_files = []
+    owners = []
+    tasks = []
+    for repository in repositories:
+        try:
+            repository_files, _ = collect_source_files(repository.input_paths)
+        except Exception:
+            repository.failures.append((repository.path, traceback.format_exc()))
+            continue
+        for source_file in repository_files:
+            source_files.append(source_file)
+            owners.append(repository)
+            tasks.append((source_file, get_error_number(source_file, repository.error_series),
+                          None, None, False, cache, args.verify))
+    sizes = [get_file_size(source_file) for source_file in source_files]
+    for repository, size in zip(owners, sizes):
+        repository.files += 1
+        repository.bytes += size
+
+    metrics.count("files_scanned", len(source_files))
+
+    metrics.begin("fix")
+    progress = None
+    stream = sys.stdout
+    if args.progress:
+        progress = ProgressReporter("Fixing", source_files, sizes).start()
+        stream = progress.wrap(stream)
+    reporter = FixReporter(args.output, stream=stream)
+    task_failures = []
+    try:
+        for index, (source, modified_code, regions, _, cached) in run_tasks(
+                fix_file, tasks, jobs=args.jobs, sizes=sizes, budget=budget,
+                failures=task_failures, timeout=args.timeout, progress=progress):
+            metrics.count("cache_hits", int(cached))
+            if modified_code == source.text:
+                continue
+            source_file = source_files[index]
+            reporter.report(source_file, source.text, modified_code, regions)
+            try:
+                write_fixed_source(source_file, source, modified_code, regions, None)
+            except Exception:
+                owners[index].failures.append((source_file, traceback.format_exc()))
+            else:
+                owners[index].changed += 1
+                owners[index].edits += count_edits(source.text, regions)
+    finally:
+        if progress is not None:
+            progress.close()
+        reporter.close()
+    for index, message in task_failures:
+        owners[index].failures.append((source_files[index], message))
+    metrics.begin("finish")
+    if cache is not None:
+        cache.prune()
+
+    print_report(repositories)
+    if args.report:
+        with io.open(args.report, 'w', encoding='utf-8') as report_file:
+            report_file.write(json.dumps([repository.as_dict() for repository in repositories],
+                                         indent=2, sort_keys=True))
+    failures = [failure for repository in repositories for failure in repository.failures]
+    metrics.count("files_changed", sum(repository.changed for repository in repositories))
+    metrics.count("failures", len(failures))
+    if args.metrics:
+        record_run(args.metrics, metrics)
+    if failures:
+        report_failures(failures)
+        return 3
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
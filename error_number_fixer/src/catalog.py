@@ -0,0 +1,93 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import logging
+import os
+import sys
+from collections import namedtuple
+
+from utils.file_lock import FileLock
+
+logger = logging.getLogger("error_number_fixer")
+
+# one numbered call; the file is implied by where the entry is stored
+CatalogEntry = namedtuple('CatalogEntry', 'number line kind message')
+
+CSV_FIELDS = ("number", "file", "line", "kind", "message")
+
+
+class ErrorCatalog(object):
+    """Error numbers and messages of every fixed file, kept in a JSON file.
+
+    Entries are stored per file, keyed by the path relative to the catalog.
+    A run only replaces the entries of the files it processed and drops
+    files that no longer exist, so after a commit touching a handful of
+    files the update costs little more than loading and saving the catalog.
+    """
+
+    def __init__(self, catalog_path):
+        self.catalog_path = os.path.abspath(catalog_path)
+        self.base_dir = os.path.dirname(self.catalog_path)
+        self.lock_path = self.catalog_path + ".lock"
+
+    def file_key(self, source_file):
+        return os.path.relpath(os.path.abspath(source_file), self.base_dir).replace(os.sep, "/")
+
+    def load(self):
+        try:
+            with io.open(self.catalog_path, encoding='utf-8') as catalog_file:
+                return json.load(catalog_file)
+        except (IOError, OSError, ValueError):
+            return {"files": {}}
+
+    def save(self, catalog):
+        temp_path = "%s.%d.tmp" % (self.catalog_path, os.getpid())
+        with io.open(temp_path, 'w', encoding='utf-8') as catalog_file:
+            catalog_file.write(json.dumps(catalog, sort_keys=True, ensure_ascii=False,
+                                          separators=(",", ":")))
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, self.catalog_path)
+        else:  # pragma: no cover (python 2)
+            os.rename(temp_path, self.catalog_path)
+
+    def update(self, file_entries):
+        """Replace the entries of the given files, returning the whole catalog."""
+        with FileLock(self.lock_path):
+            catalog = self.load()
+            files = catalog["files"]
+            changed = False
+            for source_file, entries in file_entries.items():
+                key = self.file_key(source_file)
+                rows = [list(entry) for entry in entries]
+                if files.get(key) != rows:
+                    files[key] = rows
+                    changed = True
+            for key in list(files):
+                if not os.path.exists(os.path.join(self.base_dir, key)):
+                    del files[key]
+                    changed = True
+            if changed:
+                self.save(catalog)
+        logger.debug("Catalog %s %s", self.catalog_path, "updated" if changed else "unchanged")
+        return catalog
+
+    def export_csv(self, catalog, csv_path):
+        rows = []
+        for key, entries in catalog["files"].items():
+            for number, line, kind, message in entries:
+                rows.append((number, key, line, kind, message))
+        rows.sort()
+        if sys.version_info[0] < 3:  # pragma: no cover (python 2 csv writes bytes)
+            csv_file = open(csv_path, 'wb')
+            rows = [[("%s" % value).encode('utf-8') for value in row] for row in rows]
+        else:
+            csv_file = io.open(csv_path, 'w', encoding='utf-8', newline='')
+        with csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(CSV_FIELDS)
+            writer.writerows(rows)
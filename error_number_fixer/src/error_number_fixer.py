@@ -1,11 +1,17 @@
 #!/bin/python
 # coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
 import argparse
-import difflib
+import ast
 import fnmatch
 import logging
+import multiprocessing.util
 import ntpath
 import os
+import re
 import shutil
 import sys
 import traceback
@@ -17,9 +23,41 @@ from lib2to3 import refactor
 from lib2to3.fixer_base import BaseFix
 from lib2to3.fixer_util import Comma
 from lib2to3.pgen2 import driver
+from lib2to3.pgen2 import token
+from lib2to3.pgen2.parse import ParseError
+from lib2to3.pgen2.tokenize import TokenError
 from lib2to3.pytree import Leaf
 from textwrap import dedent
 
+from error_number_fixer.src.allocator import NumberAllocator
+from error_number_fixer.src.catalog import CatalogEntry
+from error_number_fixer.src.catalog import ErrorCatalog
+from error_number_fixer.src.grammars import select_grammar
+from error_number_fixer.src.memory import format_size
+from error_number_fixer.src.memory import MemoryBudget
+from error_number_fixer.src.memory import parse_size
+from error_number_fixer.src.mirror import MirrorWriter
+from error_number_fixer.src.progress import ProgressReporter
+from error_number_fixer.src.regions import find_fragments
+from error_number_fixer.src.report import FixReporter
+from error_number_fixer.src.report import OUTPUT_MODES
+from error_number_fixer.src.result_cache import DEFAULT_CACHE_SIZE
+from error_number_fixer.src.result_cache import ResultCache
+from error_number_fixer.src.scheduler import run_tasks
+from error_number_fixer.src.source_io import apply_edits
+from error_number_fixer.src.source_io import Edit
+from error_number_fixer.src.source_io import read_source
+from error_number_fixer.src.source_io import splice
+from error_number_fixer.src.source_io import write_source
+from error_number_fixer.src.verify import verify_fix
+from utils.metrics import record_run
+from utils.metrics import RunMetrics
+from utils.util import blob_id
+from utils.util import hash_objects
+from utils.util import index_entries
+from utils.util import staged_hunks
+from utils.util import update_index
+
 logging.basicConfig()
 logger = logging.getLogger("error_number_fixer")
 
@@ -35,26 +73,100 @@ PATTERN = """
     rpar=')' > >
 """
 
+MARGIN_RE = re.compile(r"^([ \t]*)[^ \t\n]", re.MULTILINE)
+
+# files at the root of a plugin, the nearest one above a file decides its series
+PLUGIN_MARKERS = ("setup.py", "setup.cfg", "pyproject.toml", "plugin.json")
+
 
 class FixLoggerErrorNumber(BaseFix):
     BM_compatible = True
     keep_line_order = True
     order = "pre"
 
-    def __init__(self, options, fixer_log, error_series):
+    def __init__(self, options, fixer_log, error_series, changed_lines=None, numbers=None):
         self.PATTERN = PATTERN
         self.count = error_series
+        self.changed_lines = changed_lines
+        self.number_lease = numbers
+        self.used_numbers = set()
+        self.edits = []
+        self.catalog = {}
+        self.line_offset = 0
         super(FixLoggerErrorNumber, self).__init__(options, fixer_log)
 
+    def start_tree(self, tree, filename):
+        super(FixLoggerErrorNumber, self).start_tree(tree, filename)
+        if self.changed_lines is not None:
+            self.skip_used_numbers(tree)
+        if self.number_lease is not None:
+            # a leased number may already be in the file, those are skipped
+            self.used_numbers.update(number for _, number in self.numbered_calls(tree))
+
+    def in_changed_lines(self, node):
+        first_line = node.get_lineno() + self.line_offset
+        last_line = first_line + str(node)[len(node.prefix):].count("\n")
+        return any(start <= last_line and first_line <= end
+                   for start, end in self.changed_lines)
+
+    def numbered_calls(self, tree):
+        for node in tree.pre_order():
+            results = self.match(node)
+            if results and 'arg_2' in results:
+                error_no = results['arg_1']
+                if error_no.type == token.NUMBER and error_no.value.isdigit():
+                    yield node, int(error_no.value)
+
+    def skip_used_numbers(self, tree):
+        # numbered calls keep their numbers, new ones continue after them
+        for _, number in self.numbered_calls(tree):
+            self.count = max(self.count, number)
+
+    def add_to_catalog(self, node, results, number):
+        call, attr = [results[name] for name in ('call', 'attr')]
+        # repeated and alternative sub-patterns bind lists
+        call = call[0] if isinstance(call, list) else call
+        attr = attr[0] if isinstance(attr, list) else attr
+        kind = "%s.%s" % ("result" if call.value == "result" else "self.logger", attr.value)
+        message = message_text(results['arg_2' if 'arg_2' in results else 'arg_1'])
+        lpar = results['lpar']
+        # a node can be matched more than once, its position keeps one entry
+        self.catalog[(lpar.lineno + self.line_offset, lpar.column)] = CatalogEntry(
+            number, node.get_lineno() + self.line_offset, kind, message)
+
+    def catalog_entries(self):
+        return [self.catalog[position] for position in sorted(self.catalog)]
+
     def transform(self, node, results):
-        self.count += 1
+        if self.changed_lines is not None or self.number_lease is not None:
+            # only calls without a number get one, so editing a message keeps its number
+            error_no = results['arg_1']
+            if 'arg_2' in results and error_no.type == token.NUMBER and error_no.value.isdigit():
+                self.add_to_catalog(node, results, int(error_no.value))
+                return None
+            if self.changed_lines is not None and not self.in_changed_lines(node):
+                return None
+        if self.number_lease is not None:
+            self.count = next(self.number_lease)
+            while self.count in self.used_numbers:
+                self.count = next(self.number_lease)
+        else:
+            self.count += 1
+        self.add_to_catalog(node, results, self.count)
+        lpar = results['lpar']
         if 'arg_2' in results:
             logger.debug("found 2 [%s %s]" %
                          (results['arg_1'], results['arg_2']))
             error_no = results['arg_1']
+            end_line, end_column = node_end(error_no)
+            self.edits.append(Edit(lpar.lineno, lpar.column + 1,
+                                   end_line, end_column, str(self.count)))
             error_no.replace(Leaf(type=2, value=self.count))
         else:
             logger.debug("found 1 [%s]" % results['arg_1'])
+            first_leaf = next(results['arg_1'].leaves())
+            self.edits.append(Edit(lpar.lineno, lpar.column + 1,
+                                   first_leaf.lineno, first_leaf.column, "%d, " % self.count))
             siblings_list = results['arg_1'].parent.children
             siblings_list.insert(1, Leaf(type=2, value=self.count))
             siblings_list.insert(2, Comma())
@@ -62,38 +174,143 @@ class FixLoggerErrorNumber(BaseFix):
         return node
 
 
+def node_end(node):
+    last_leaf = node
+    while last_leaf.children:
+        last_leaf = last_leaf.children[-1]
+    value = str(last_leaf.value)
+    if "\n" in value:
+        return last_leaf.lineno + value.count("\n"), len(value.rsplit("\n", 1)[1])
+    return last_leaf.lineno, last_leaf.column + len(value)
+
+
+def message_text(node):
+    text = str(node).strip()
+    try:
+        message = ast.literal_eval(text)
+    except (SyntaxError, ValueError):
+        return text
+    return message if isinstance(message, (str, type(""))) else text
+
+
+def get_margin(source_code):
+    # the common indentation textwrap.dedent removes
+    indents = MARGIN_RE.findall(source_code)
+    return os.path.commonprefix(indents) if indents else ""
+
+
+class CountLoggerErrorNumber(FixLoggerErrorNumber):
+
+    def transform(self, node, results):
+        if self.changed_lines is None or self.in_changed_lines(node):
+            self.count += 1
+            # returning the node marks it as fixed, as a rewrite would
+            return node
+
+
 class CodeFixers(refactor.MultiprocessRefactoringTool):
+    fixer_class = FixLoggerErrorNumber
 
     def __init__(self, error_series, *args, **kwargs):
         self.error_series = int(error_series)
+        self.changed_lines = kwargs.pop('changed_lines', None)
+        self.numbers = kwargs.pop('numbers', None)
+        grammar = kwargs.pop('grammar', None)
         super(CodeFixers, self).__init__(*args, **kwargs)
+        if grammar is not None:
+            self.grammar = grammar
+            self.driver.grammar = grammar
 
     def get_fixers(self):
-        fixer = FixLoggerErrorNumber(
-            self.options, self.fixer_log, self.error_series)
-        return [fixer], []
+        self.fixer = self.fixer_class(
+            self.options, self.fixer_log, self.error_series, self.changed_lines, self.numbers)
+        return [self.fixer], []
+
+
+class CallCounter(CodeFixers):
+    fixer_class = CountLoggerErrorNumber
+
+
+def count_calls(source_code):
+    flags = dict(print_function=True)
+    call_counter = CallCounter(0, [], flags, grammar=select_grammar(source_code))
+    call_counter.refactor_string(dedent(source_code), 'script')
+    return call_counter.fixer.count
 
 
-def generate_fixed_code(source_code, error_series):
+def generate_fixed_code(source_code, error_series, changed_lines=None, numbers=None):
     flags = dict(print_function=True)
-    code_fixer = CodeFixers(error_series, [], flags)
+    code_fixer = CodeFixers(error_series, [], flags, changed_lines=changed_lines, numbers=numbers,
+                            grammar=select_grammar(source_code))
     refactored = code_fixer.refactor_string(dedent(source_code), 'script')
     return str(refactored)
 
 
+def generate_fixed_edits(source_code, error_series, changed_lines=None, numbers=None,
+                         catalog=None):
+    """Edits that number the calls in source_code, in source_code's own coordinates.
+
+    When a catalog list is given, the CatalogEntry of every numbered call is appended to it.
+    """
+    flags = dict(print_function=True)
+    code_fixer = CodeFixers(error_series, [], flags, changed_lines=changed_lines, numbers=numbers,
+                            grammar=select_grammar(source_code))
+    margin = get_margin(source_code)
+    code_fixer.refactor_string(dedent(source_code) if margin else source_code, 'script')
+    if catalog is not None:
+        catalog.extend(code_fixer.fixer.catalog_entries())
+    return [edit._replace(start_column=edit.start_column + len(margin),
+                          end_column=edit.end_column + len(margin))
+            for edit in code_fixer.fixer.edits]
+
+
+def generate_region_edits(source_code, error_series, changed_lines=None, numbers=None,
+                          catalog=None):
+    """Like generate_fixed_edits, but only parses the logical lines holding candidate calls.
+
+    Falls back to parsing the whole module when a fragment doesn't parse on its own.
+    """
+    flags = dict(print_function=True)
+    code_fixer = CodeFixers(error_series, [], flags, changed_lines=changed_lines, numbers=numbers,
+                            grammar=select_grammar(source_code))
+    fixer = code_fixer.fixer
+    try:
+        fragments = find_fragments(source_code)
+        trees = [code_fixer.driver.parse_string(fragment.text) for fragment in fragments]
+    except (ParseError, TokenError, IndentationError) as exp:
+        logger.debug("Parsing the whole module, a fragment failed: %s", exp)
+        return generate_fixed_edits(source_code, error_series, changed_lines, numbers, catalog)
+
+    if changed_lines is not None:
+        for fragment, tree in zip(fragments, trees):
+            fixer.line_offset = fragment.start_line - 1
+            fixer.skip_used_numbers(tree)
+    if numbers is not None:
+        # every fragment is looked at before any number is leased
+        for tree in trees:
+            fixer.used_numbers.update(number for _, number in fixer.numbered_calls(tree))
+
+    edits = []
+    for fragment, tree in zip(fragments, trees):
+        fixer.line_offset = fragment.start_line - 1
+        fixer.edits = []
+        code_fixer.refactor_tree(tree, 'fragment')
+        edits.extend(fragment.translate(edit) for edit in fixer.edits)
+    if catalog is not None:
+        catalog.extend(fixer.catalog_entries())
+    return edits
+
+
 def parse_code(file_path):
     parser_driver = driver.Driver(pygram.python_grammar, pytree.convert)
-    parse_tree = parser_driver.parse_file(
-        filename=file_path, encoding='ascii', debug=True)
+    parse_tree = parser_driver.parse_string(get_source_code(file_path), debug=True)
     source_code = str(parse_tree)
     return source_code
 
 
 def get_source_code(file_path):
     try:
-        with open(file_path, 'r') as source_file:
-            source_content = source_file.read()
-            return source_content
+        return read_source(file_path).text
     except Exception as exp:
         logger.error("Error in opening file")
         raise Exception(exp)
@@ -136,6 +353,236 @@ def get_full_file_name(file_path, append_suffix):
     return full_file_name
 
 
+def get_error_number(source_file, error_series):
+    if error_series:
+        return error_series
+    file_name = os.path.basename(source_file).rstrip('.py')
+    ascii_sum = sum(ord(char) - 64 for char in file_name)
+    if ascii_sum < 0:
+        ascii_sum = ascii_sum + 64
+    return int(str(ascii_sum)[:3].ljust(5, '0'))
+
+
+NUMBER_LEASES = {}
+
+
+def get_number_lease(allocator_path, error_number):
+    # one lease per process and series, released when the process exits
+    key = (allocator_path, error_number)
+    if key not in NUMBER_LEASES:
+        lease = NumberAllocator(allocator_path).reserve(error_number)
+        multiprocessing.util.Finalize(lease, lease.release, exitpriority=10)
+        NUMBER_LEASES[key] = lease
+    return NUMBER_LEASES[key]
+
+
+def lease_numbers(allocator_path, error_number):
+    # the block is only reserved once a call needs a number
+    for number in get_number_lease(allocator_path, error_number):
+        yield number
+
+
+def count_file(source_file, candidate_regions=False):
+    source_code = get_source_code(source_file)
+    if candidate_regions:
+        return len(generate_region_edits(source_code, 0))
+    return count_calls(source_code)
+
+
+def get_plugin_series(source_files, plugin_dirs, error_series, counts):
+    # each plugin numbers its files in path order, one contiguous block per file
+    next_numbers = {}
+    start_numbers = []
+    for source_file, plugin_dir, count in zip(source_files, plugin_dirs, counts):
+        if plugin_dir not in next_numbers:
+            next_numbers[plugin_dir] = get_error_number(plugin_dir, error_series)
+        start_numbers.append(next_numbers[plugin_dir])
+        next_numbers[plugin_dir] += count
+    return start_numbers
+
+
+def release_number_leases():
+    while NUMBER_LEASES:
+        NUMBER_LEASES.popitem()[1].release()
+
+
+def get_cache_key(cache, source, error_number, changed_lines, candidate_regions):
+    if changed_lines is not None:
+        changed_lines = sorted(changed_lines)
+    return cache.key(source.digest, PATTERN, error_number, changed_lines, candidate_regions)
+
+
+def fix_file(source_file, error_number, changed_lines=None, allocator_path=None,
+             candidate_regions=False, cache=None, verify=True):
+    # leased numbers depend on the shared allocator state, so those results are never cached
+    if allocator_path:
+        cache = None
+    source = read_source(source_file, 'sha256' if cache is not None else None)
+    cache_key = None
+    if cache is not None:
+        cache_key = get_cache_key(cache, source, error_number, changed_lines, candidate_regions)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Cache hit for %s", source_file)
+            regions, catalog = cached
+            return source, splice(source.text, regions), regions, catalog, True
+    numbers = None
+    if allocator_path:
+        numbers = lease_numbers(allocator_path, error_number)
+    catalog = []
+    if candidate_regions:
+        edits = generate_region_edits(source.text, error_number, changed_lines, numbers, catalog)
+    else:
+        edits = generate_fixed_edits(source.text, error_number, changed_lines, numbers, catalog)
+    modified_code, regions = apply_edits(source.text, edits)
+    if verify:
+        verify_fix(source.text, modified_code, regions)
+    # a cache hit skips verification, so only verified results are stored
+    if cache_key is not None and verify:
+        try:
+            cache.put(cache_key, regions, catalog)
+        except (IOError, OSError) as exp:
+            logger.debug("Could not cache the result for %s: %s", source_file, exp)
+    return source, modified_code, regions, catalog, False
+
+
+def write_fixed_source(source_file, source, modified_code, regions, append_suffix):
+    if append_suffix:
+        with open(get_full_file_name(source_file, append_suffix), 'wb') as target_file:
+            target_file.write(source.encode(modified_code))
+    else:
+        write_source(source_file, source, regions)
+
+
+def is_plugin_root(directory):
+    return any(os.path.exists(os.path.join(directory, marker)) for marker in PLUGIN_MARKERS)
+
+
+def find_plugin_root(source_file, roots=None, default=None):
+    """The nearest directory above source_file holding a plugin marker.
+
+    The search ends at the top of the repository. Outside of any plugin,
+    default, or else the directory of the file itself. Answers are kept in
+    the roots dict, when given, for every directory walked through.
+    """
+    roots = {} if roots is None else roots
+    directory = os.path.dirname(os.path.abspath(source_file))
+    walked = []
+    while directory not in roots:
+        walked.append(directory)
+        if is_plugin_root(directory):
+            roots[directory] = directory
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory or os.path.exists(os.path.join(directory, ".git")):
+            roots[directory] = None
+            break
+        directory = parent
+    plugin_root = roots[directory]
+    for walked_directory in walked:
+        roots[walked_directory] = plugin_root
+    return plugin_root or default or os.path.dirname(os.path.abspath(source_file))
+
+
+def expand_plugin_series(source_files, plugin_dirs):
+    """Return every python file of the plugins of source_files, in path order per plugin.
+
+    Also returns the plugin of each file and whether it is one of
+    source_files, so a series can be counted over whole plugins while only
+    the files given are fixed. Plugins nested in a plugin count on their
+    own, files outside of any plugin are not expanded.
+    """
+    given = dict((os.path.abspath(source_file), source_file) for source_file in source_files)
+    all_files = []
+    all_dirs = []
+    selected = []
+    walked = set()
+    for plugin_dir in plugin_dirs:
+        if plugin_dir in walked or not is_plugin_root(plugin_dir):
+            continue
+        walked.add(plugin_dir)
+        plugin_files = []
+        for (dir_path, dir_names, file_names) in os.walk(plugin_dir):
+            dir_names[:] = [dir_name for dir_name in dir_names
+                            if not is_plugin_root(os.path.join(dir_path, dir_name))]
+            for file_name in fnmatch.filter(file_names, '*.py'):
+                plugin_files.append(os.path.relpath(os.path.join(dir_path, file_name), plugin_dir))
+        for plugin_file in sorted(plugin_files):
+            file_path = os.path.join(plugin_dir, plugin_file)
+            source_file = given.pop(file_path, None)
+            all_files.append(source_file or file_path)
+            all_dirs.append(plugin_dir)
+            selected.append(source_file is not None)
+    # files no walk found, outside of any plugin or without a .py suffix, are still fixed
+    for source_file, plugin_dir in zip(source_files, plugin_dirs):
+        if given.pop(os.path.abspath(source_file), None) is not None:
+            all_files.append(source_file)
+            all_dirs.append(plugin_dir)
+            selected.append(True)
+    return all_files, all_dirs, selected
+
+
+def collect_source_files(input_args, sort_files=False):
+    """Return the python files under the input paths and the plugin each belongs to.
+
+    The plugin of a file is found with find_plugin_root, for the files of
+    a directory outside of any plugin it is the directory itself.
+    """
+    source_files = []
+    plugin_dirs = []
+    roots = {}
+    for input_arg in input_args:
+        if os.path.isfile(input_arg):
+            source_files.append(input_arg)
+            plugin_dirs.append(find_plugin_root(input_arg, roots))
+        elif os.path.isdir(input_arg):
+            dir_files = []
+            for (dir_path, dir_names, file_names) in os.walk(input_arg):
+                for file_name in fnmatch.filter(file_names, '*.py'):
+                    file_name = os.path.join(dir_path, file_name)
+                    dir_files.append(file_name)
+            if sort_files:
+                dir_files.sort()
+            source_files.extend(dir_files)
+            plugin_dirs.extend(find_plugin_root(dir_file, roots, os.path.abspath(input_arg))
+                               for dir_file in dir_files)
+        else:
+            raise Exception(
+                "Invalid file or directory path specified.\nPlease verify if the path exists")
+    return source_files, plugin_dirs
+
+
+def get_file_size(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except os.error:
+        return 0
+
+
+def is_fully_staged(source_file, index):
+    entry = index.get(os.path.realpath(source_file))
+    if entry is None:
+        return False
+    with open(source_file, 'rb') as source:
+        return blob_id(source.read()) == entry[1]
+
+
+def stage_files(source_files, index):
+    object_ids = hash_objects(*source_files)
+    entries = []
+    for source_file, object_id in zip(source_files, object_ids):
+        mode, _, repo_path = index[os.path.realpath(source_file)]
+        entries.append((mode, object_id, repo_path))
+    update_index(entries)
+
+
+def report_failures(failures):
+    print("\033[91mFailed to fix %d files:\033[0m" % len(failures))
+    for source_file, message in sorted(failures):
+        logger.debug("Failure in %s:\n%s", source_file, message)
+        print("  %s: %s" % (source_file, message.strip().splitlines()[-1]))
+
+
 def check_positive(value):
     int_value = int(value)
     if int_value <= 0:
@@ -146,6 +593,8 @@ def check_positive(value):
 
 def main(argv=None):
     """Command line options."""
+    metrics = RunMetrics("error_number_fixer")
+    metrics_path = None
     try:
         # Setup argument parser
         parser = ArgumentParser(description="FSO Plugin Error Number Fixer",
@@ -176,10 +625,89 @@ def main(argv=None):
         parser.add_argument("-v", "--verbose", dest="verbose",
                             action="count", help="set verbosity level",
                             default=0)
+        parser.add_argument("-j", "--jobs", dest="jobs", type=check_positive,
+                            help="Number of files to fix in parallel. [default: %(default)s]",
+                            metavar="jobs", default=1)
+        parser.add_argument("--max-memory", dest="max_memory", type=parse_size,
+                            help="Peak memory budget for files being fixed (e.g. 512M, 2G). "
+                                 "Limits concurrent workers and reports the heaviest files.",
+                            metavar="size")
+        parser.add_argument("--staged-hunks", dest="staged_hunks", action="store_true",
+                            help="Only number calls on lines changed in the staged diff, "
+                                 "leaving the rest of each file alone.",
+                            default=False)
+        parser.add_argument("--allocator", dest="allocator",
+                            help="State file of a number allocator shared by concurrent runs; "
+                                 "calls without a number get one leased from it, numbered "
+                                 "calls keep theirs.",
+                            metavar="state_file")
+        parser.add_argument("--plugin-series", dest="plugin_series", action="store_true",
+                            help="Number all files of each plugin as one contiguous series, "
+                                 "counting calls in parallel first. A plugin is an input "
+                                 "directory, or for a single file the nearest directory above "
+                                 "it with a setup.py, setup.cfg, pyproject.toml, plugin.json "
+                                 "or .git.",
+                            default=False)
+        parser.add_argument("--timeout", dest="timeout", type=check_positive,
+                            help="Give up on a file after this many seconds and carry on "
+                                 "with the rest.",
+                            metavar="seconds")
+        parser.add_argument("--candidate-regions", dest="candidate_regions", action="store_true",
+                            help="Only parse the statements around candidate calls instead of "
+                                 "whole modules. Used for oversized files under --max-memory.",
+                            default=False)
+        parser.add_argument("--stage", dest="stage", action="store_true",
+                            help="Also write fixed files into the git index when they "
+                                 "have no unstaged changes, so the commit can go ahead.",
+                            default=False)
+        parser.add_argument("--cache-dir", dest="cache_dir",
+                            help="Directory of a result cache keyed by file content, which "
+                                 "can be shared by worktrees and CI agents. "
+                                 "[default: $ERROR_NUMBER_FIXER_CACHE]",
+                            metavar="cache_dir", default=os.environ.get("ERROR_NUMBER_FIXER_CACHE"))
+        parser.add_argument("--cache-size", dest="cache_size", type=parse_size,
+                            help="Size the result cache is pruned to, least recently used "
+                                 "entries first. [default: 256M]",
+                            metavar="size", default=DEFAULT_CACHE_SIZE)
+        parser.add_argument("--output", dest="output", choices=OUTPUT_MODES,
+                            help="Per file output: one summary line, the diff, or nothing. "
+                                 "[default: %(default)s]",
+                            default="summary")
+        parser.add_argument("--max-diff-lines", dest="max_diff_lines", type=check_positive,
+                            help="Cut the diff of each file after this many lines "
+                                 "with --output diff.",
+                            metavar="lines")
+        parser.add_argument("--diff-file", dest="diff_file",
+                            help="Write the full diff of every fixed file to this file.",
+                            metavar="diff_file")
+        parser.add_argument("--no-progress", dest="progress", action="store_false",
+                            help="Don't report throughput and the slowest file while running: "
+                                 "a status line on a terminal, a log line every 10s otherwise.",
+                            default=True)
+        parser.add_argument("--no-verify", dest="verify", action="store_false",
+                            help="Skip checking that only error numbers changed in the "
+                                 "token stream of each fixed file.",
+                            default=True)
+        parser.add_argument("--catalog", dest="catalog",
+                            help="JSON catalog of error numbers and messages; the entries of "
+                                 "the processed files are updated in place.",
+                            metavar="catalog_file")
+        parser.add_argument("--catalog-csv", dest="catalog_csv",
+                            help="Also export the whole catalog as CSV to this file.",
+                            metavar="csv_file")
+        parser.add_argument("--metrics", dest="metrics",
+                            help="Append the phase durations and counts of this run to a "
+                                 "metrics file, see hook_stats. [default: $HOOK_METRICS]",
+                            metavar="metrics_file", default=os.environ.get("HOOK_METRICS"))
 
         # Process arguments
 
         args = parser.parse_args(argv)
+        if args.plugin_series and (args.staged_hunks or args.allocator):
+            parser.error("--plugin-series can't be combined with --staged-hunks or --allocator")
+        if args.catalog_csv and not args.catalog:
+            parser.error("--catalog-csv needs a --catalog to export")
+        metrics_path = args.metrics
         input_args = args.input_dir
         output_dir = args.output_dir
         append_suffix = args.append_suffix
@@ -187,6 +715,11 @@ def main(argv=None):
         backup_file = args.backup
         error_series = args.error_series
         verbose = args.verbose
+        jobs = args.jobs
+        budget = MemoryBudget(args.max_memory) if args.max_memory else None
+        cache = None
+        if args.cache_dir and not args.allocator:
+            cache = ResultCache(args.cache_dir, args.cache_size)
 
         if isinstance(verbose, int):
             if verbose > 0:
@@ -199,67 +732,169 @@ def main(argv=None):
         logger.debug("Output Directory: %s", output_dir)
         logger.debug("verbosity level: %d", verbose)
 
-        source_files = []
-        for input_arg in input_args:
-            if os.path.isfile(input_arg):
-                source_files.append(input_arg)
-            elif os.path.isdir(input_arg):
-                for (dir_path, dir_names, file_names) in os.walk(input_arg):
-                    for file_name in fnmatch.filter(file_names, '*.py'):
-                        file_name = os.path.join(dir_path, file_name)
-                        source_files.append(file_name)
-            else:
-                raise Exception(
-                    "Invalid file or directory path specified.\nPlease verify if the path exists")
+        metrics.begin("collect")
+        source_files, plugin_dirs = collect_source_files(input_args, args.plugin_series)
+        metrics.count("files_scanned", len(source_files))
 
         if source_files:
-            code_diff = None
-            for source_file in source_files:
+            changed_files = []
+            failures = []
 
-                # check backup
-                if backup_file:
+            # check backup
+            if backup_file:
+                for source_file in source_files:
                     backup(source_file)
 
-                source_code = get_source_code(source_file)
-
-                # generate error series
-                if not error_series:
-                    file_name = os.path.basename(source_file).rstrip('.py')
-                    ascii_sum = sum(ord(char) - 64 for char in file_name)
-                    if ascii_sum < 0:
-                        ascii_sum = ascii_sum + 64
-                    error_number = int(str(ascii_sum)[:3].ljust(5, '0'))
-                else:
-                    error_number = error_series
-
-                modified_code = generate_fixed_code(source_code, error_number)
-
-                # generate code diff
-                diffed_lines = []
-                for line in difflib.context_diff(
-                        source_code.splitlines(),
-                        modified_code.splitlines(),
-                        fromfile='Before Fix',
-                        tofile='After Fix',
-                        n=0):
-                    line = ' '.join(line.split()) + '\n'
-                    diffed_lines.append(line)
-
-                code_diff = "".join(diffed_lines)
-
-                if code_diff:
-                    print("\033[93mFixing error numbers: [%s]\033[0m" % source_file)
-                    print(code_diff)
-                    if write:
-                        write_to_file(
-                            source_file, modified_code, append_suffix)
-                    elif output_dir:
-                        write_to_file(output_dir, modified_code, append_suffix)
-
-            if code_diff:
+            # restrict fixes to staged hunks
+            if args.staged_hunks:
+                hunks = staged_hunks(*source_files)
+                staged = [hunks.get(os.path.realpath(source_file)) for source_file in source_files]
+                source_files = [source_file for source_file, lines in zip(source_files, staged) if lines]
+                plugin_dirs = [plugin_dir for plugin_dir, lines in zip(plugin_dirs, staged) if lines]
+
+            if args.plugin_series:
+                # series are counted over whole plugins, whichever of their files were given
+                source_files, plugin_dirs, selected = expand_plugin_series(source_files,
+                                                                           plugin_dirs)
+
+            sizes = [get_file_size(source_file) for source_file in source_files]
+            candidate_regions = [
+                args.candidate_regions or (budget is not None and budget.is_oversized(size))
+                for size in sizes]
+
+            # generate error series
+            if args.plugin_series:
+                metrics.begin("count")
+                counts = [None] * len(source_files)
+                count_failures = []
+                progress = None
+                if args.progress:
+                    progress = ProgressReporter("Counting", source_files, sizes).start()
+                try:
+                    for index, count in run_tasks(
+                            count_file, list(zip(source_files, candidate_regions)),
+                            jobs=jobs, sizes=sizes, budget=budget,
+                            failures=count_failures, timeout=args.timeout, progress=progress):
+                        counts[index] = count
+                finally:
+                    if progress is not None:
+                        progress.close()
+                for index, message in count_failures:
+                    failures.append((source_files[index], message))
+                counted = [count is not None for count in counts]
+                source_files = [source_file for source_file, ok in zip(source_files, counted) if ok]
+                plugin_dirs = [plugin_dir for plugin_dir, ok in zip(plugin_dirs, counted) if ok]
+                sizes = [size for size, ok in zip(sizes, counted) if ok]
+                candidate_regions = [regions for regions, ok in zip(candidate_regions, counted) if ok]
+                counts = [count for count in counts if count is not None]
+                error_numbers = get_plugin_series(source_files, plugin_dirs, error_series, counts)
+                selected = [flag for flag, ok in zip(selected, counted) if ok]
+                source_files = [source_file for source_file, flag in zip(source_files, selected)
+                                if flag]
+                sizes = [size for size, flag in zip(sizes, selected) if flag]
+                candidate_regions = [regions for regions, flag in zip(candidate_regions, selected)
+                                     if flag]
+                error_numbers = [number for number, flag in zip(error_numbers, selected) if flag]
+            else:
+                error_numbers = [get_error_number(source_file, error_series)
+                                 for source_file in source_files]
+
+            tasks = []
+            for source_file, error_number, regions in zip(source_files, error_numbers, candidate_regions):
+                changed_lines = None
+                if args.staged_hunks:
+                    changed_lines = hunks[os.path.realpath(source_file)]
+                tasks.append((source_file, error_number, changed_lines, args.allocator, regions,
+                              cache, args.verify))
+
+            git_index = None
+            if args.stage and not output_dir and not append_suffix:
+                git_index = index_entries(*source_files)
+            staged_files = []
+
+            mirror = None
+            if output_dir:
+                mirror = MirrorWriter(input_args, output_dir, append_suffix, jobs)
+
+            metrics.begin("fix")
+            progress = None
+            stream = sys.stdout
+            if args.progress:
+                progress = ProgressReporter("Fixing", source_files, sizes).start()
+                stream = progress.wrap(stream)
+            reporter = FixReporter(args.output, args.max_diff_lines, args.diff_file, stream)
+            task_failures = []
+            file_entries = {}
+            try:
+                for index, (source, modified_code, regions, entries, cached) in run_tasks(
+                        fix_file, tasks, jobs=jobs, sizes=sizes, budget=budget,
+                        failures=task_failures, timeout=args.timeout, progress=progress):
+                    source_file = source_files[index]
+                    source_code = source.text
+                    file_entries[source_file] = entries
+                    metrics.count("cache_hits", int(cached))
+
+                    if modified_code != source_code:
+                        reporter.report(source_file, source_code, modified_code, regions)
+                        try:
+                            if mirror is not None:
+                                mirror.write_fixed(source_file, source.encode(modified_code))
+                            elif write:
+                                if git_index is not None and \
+                                        is_fully_staged(source_file, git_index):
+                                    staged_files.append(source_file)
+                                write_fixed_source(
+                                    source_file, source, modified_code, regions, append_suffix)
+                        except Exception:
+                            failures.append((source_file, traceback.format_exc()))
+                        else:
+                            changed_files.append(source_file)
+            finally:
+                if progress is not None:
+                    progress.close()
+                reporter.close()
+
+            for index, message in task_failures:
+                failures.append((source_files[index], message))
+
+            metrics.begin("finish")
+            release_number_leases()
+            if mirror is not None:
+                mirror_failures = mirror.finish()
+                failures.extend(mirror_failures)
+                unwritten = set(source_file for source_file, _ in mirror_failures)
+                changed_files = [source_file for source_file in changed_files
+                                 if source_file not in unwritten]
+            if cache is not None:
+                cache.prune()
+
+            if args.catalog:
+                error_catalog = ErrorCatalog(args.catalog)
+                catalog = error_catalog.update(file_entries)
+                if args.catalog_csv:
+                    error_catalog.export_csv(catalog, args.catalog_csv)
+
+            metrics.count("files_changed", len(changed_files))
+            if staged_files:
+                stage_files(staged_files, git_index)
+                print("\033[93mAdded %d fixed files to the index.\033[0m" % len(staged_files))
+                changed_files = [source_file for source_file in changed_files
+                                 if source_file not in staged_files]
+
+            if budget is not None:
+                print("\033[93mHeaviest files by peak memory:\033[0m")
+                for peak, source_file in budget.heaviest():
+                    print("  %10s  %s" % (format_size(peak), source_file))
+
+            if changed_files:
                 print("\n\033[93mPlease verify modified files and add files by running "
                       "`git add .` to approve modified files.\033[0m\n")
 
+            metrics.count("failures", len(failures))
+            if failures:
+                report_failures(failures)
+                return 3
+
         else:
             logger.debug("No file found in the input directory")
             return 1
@@ -271,7 +906,7 @@ def main(argv=None):
 
     except Exception as exp:
         program_name = "error_number_fixer"
-        tb = traceback.format_exc(exp)
+        tb = traceback.format_exc()
         logger.debug('Caught Exception: %s', exp)
         sys.stderr.write('Caught exception {}'.format(tb))
         indent = len(program_name) * " "
@@ -279,6 +914,10 @@ def main(argv=None):
         sys.stderr.write(indent + "  for help use --help\n")
         return 3
 
+    finally:
+        if metrics_path:
+            record_run(metrics_path, metrics)
+
 
 if __name__ == "__main__":
     exit(main())
@@ -0,0 +1,126 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import re
+from lib2to3 import pygram
+from lib2to3.pgen2 import token
+from lib2to3.pgen2.tokenize import TokenError
+from lib2to3.pgen2.tokenize import generate_tokens
+
+# print and exec statements, the grammar of python 2 modules
+PRINT_STATEMENT_GRAMMAR = pygram.python_grammar
+# print as a function but exec as a statement, what the fixer always used
+DEFAULT_GRAMMAR = pygram.python_grammar_no_print_statement
+# print and exec as functions, needed when exec is used as a name
+EXEC_FUNCTION_GRAMMAR = getattr(pygram, "python_grammar_no_print_and_exec_statement", None)
+if EXEC_FUNCTION_GRAMMAR is None:
+    # the lib2to3 of python 2 has no such grammar
+    EXEC_FUNCTION_GRAMMAR = DEFAULT_GRAMMAR.copy()
+    del EXEC_FUNCTION_GRAMMAR.keywords["exec"]
+
+# every file without a match parses with the default grammar, no scan needed
+PY2_NAME_RE = re.compile(r"\bprint\b(?!\s*\()|\bexec\b")
+
+# tokens that can follow a print or exec keyword but not a function name
+STATEMENT_ARGUMENTS = (">>", "-", "+", "~", "[", "{", "`")
+
+MAX_CACHED_GRAMMARS = 4096
+
+GRAMMAR_CACHE = {}
+
+
+def scan_statements(source_code):
+    """Return (print statements, exec statements, exec used as a name) of a module."""
+    print_statement = exec_statement = exec_name = False
+    depth = 0
+    previous = None
+    pending = None
+    readline = io.StringIO(source_code).readline
+    for tok_type, value, _, _, _ in generate_tokens(readline):
+        if tok_type in (token.NL, token.COMMENT, token.INDENT, token.DEDENT):
+            continue
+        if pending is not None:
+            if tok_type in (token.NAME, token.NUMBER, token.STRING) or value in STATEMENT_ARGUMENTS:
+                if pending == "print":
+                    print_statement = True
+                else:
+                    exec_statement = True
+            elif pending == "exec" and value not in ("(", ";") and \
+                    tok_type not in (token.NEWLINE, token.ENDMARKER):
+                exec_name = True
+            pending = None
+        if tok_type == token.NAME and value in ("print", "exec"):
+            if previous in (None, token.NEWLINE, ";") or (previous == ":" and depth == 0):
+                pending = value
+            elif value == "exec":
+                exec_name = True
+        elif tok_type == token.OP and value in ("(", "[", "{"):
+            depth += 1
+        elif tok_type == token.OP and value in (")", "]", "}"):
+            depth -= 1
+        previous = tok_type if tok_type == token.NEWLINE else value
+    return print_statement, exec_statement, exec_name
+
+
+def future_features(source_code):
+    """The names a module imports from __future__ in its leading statements."""
+    features = set()
+    tokens = ((tok_type, value) for tok_type, value, _, _, _
+              in generate_tokens(io.StringIO(source_code).readline)
+              if tok_type not in (token.NL, token.NEWLINE, token.COMMENT) and value != ";")
+    try:
+        tok_type, value = next(tokens)
+        while True:
+            if tok_type == token.STRING:
+                # the docstring
+                tok_type, value = next(tokens)
+                continue
+            if value != "from" or next(tokens)[1] != "__future__" or next(tokens)[1] != "import":
+                break
+            tok_type, value = next(tokens)
+            if value == "(":
+                tok_type, value = next(tokens)
+            while tok_type == token.NAME:
+                features.add(value)
+                tok_type, value = next(tokens)
+                if value == "as":
+                    next(tokens)
+                    tok_type, value = next(tokens)
+                if value != ",":
+                    break
+                tok_type, value = next(tokens)
+            if value == ")":
+                tok_type, value = next(tokens)
+    except StopIteration:
+        pass
+    return features
+
+
+def detect_grammar(source_code):
+    try:
+        print_statement, exec_statement, exec_name = scan_statements(source_code)
+    except (TokenError, IndentationError):
+        # let the parser report what is wrong with the module
+        return DEFAULT_GRAMMAR
+    if print_statement and "print_function" not in future_features(source_code):
+        return PRINT_STATEMENT_GRAMMAR
+    if exec_name and not exec_statement:
+        return EXEC_FUNCTION_GRAMMAR
+    return DEFAULT_GRAMMAR
+
+
+def select_grammar(source_code):
+    """Pick the grammar a module parses with, scanning each distinct content once."""
+    if not PY2_NAME_RE.search(source_code):
+        return DEFAULT_GRAMMAR
+    key = hashlib.sha1(source_code.encode('utf-8', 'surrogatepass')).hexdigest()
+    grammar = GRAMMAR_CACHE.get(key)
+    if grammar is None:
+        if len(GRAMMAR_CACHE) >= MAX_CACHED_GRAMMARS:
+            GRAMMAR_CACHE.clear()
+        grammar = GRAMMAR_CACHE[key] = detect_grammar(source_code)
+    return grammar
@@ -0,0 +1,365 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import bisect
+import json
+import logging
+import re
+import sys
+
+from error_number_fixer.src.error_number_fixer import check_positive
+from error_number_fixer.src.error_number_fixer import generate_fixed_edits
+from error_number_fixer.src.error_number_fixer import get_error_number
+from error_number_fixer.src.regions import find_candidate_lines
+from error_number_fixer.src.regions import has_candidate
+from error_number_fixer.src.regions import make_fragment
+from error_number_fixer.src.regions import scan_logical_lines
+from error_number_fixer.src.source_io import line_offsets
+
+try:
+    from urllib.parse import unquote
+    from urllib.parse import urlparse
+except ImportError:  # pragma: no cover (python 2)
+    from urllib import unquote
+    from urlparse import urlparse
+
+logger = logging.getLogger("error_number_fixer")
+
+ASSIGN_COMMAND = "errorNumbers.assign"
+ASSIGN_TITLE = "Assign error numbers"
+
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+NON_ASCII_RE = re.compile(r"[^\x00-\x7f]")
+
+
+def uri_to_path(uri):
+    return unquote(urlparse(uri).path)
+
+
+def utf16_column(line_text, column):
+    # LSP positions count UTF-16 code units
+    prefix = line_text[:column]
+    if not NON_ASCII_RE.search(prefix):
+        return column
+    return len(prefix.encode('utf-16-le')) // 2
+
+
+def character_column(line_text, character):
+    if not NON_ASCII_RE.search(line_text):
+        return character
+    units = 0
+    for column, char in enumerate(line_text):
+        if units >= character:
+            return column
+        units += 2 if ord(char) > 0xFFFF else 1
+    return len(line_text)
+
+
+class Buffer(object):
+    """An open document and the fragments found by its last analysis.
+
+    Edits only dirty the lines they touch: the next analysis keeps the
+    fragments above the first changed line, tokenizes from the logical line
+    holding it and stops as soon as it is back on a logical line boundary
+    of the unchanged tail. Fragments are parsed again only when their text
+    changed; numbers are then handed out over all fragments in order.
+    """
+
+    def __init__(self, uri, text, version=None):
+        self.uri = uri
+        self.text = text
+        self.version = version
+        self.fragment_edits = {}
+        self.reset()
+
+    def reset(self):
+        self.fragments = None
+        self.boundaries = []
+        self.line_count = 0
+        self.dirty_line = 1
+        self.tail_lines = 0
+
+    def line_text(self, line, offsets=None):
+        offsets = offsets or line_offsets(self.text)
+        end = offsets[line + 2] if line + 2 < len(offsets) else len(self.text)
+        return self.text[offsets[line + 1]:end]
+
+    def offset(self, position, offsets):
+        line = position["line"]
+        if line + 1 >= len(offsets):
+            return len(self.text)
+        column = character_column(self.line_text(line, offsets), position["character"])
+        return offsets[line + 1] + column
+
+    def apply_change(self, change):
+        if "range" not in change:
+            self.text = change["text"]
+            self.reset()
+            return
+        offsets = line_offsets(self.text)
+        start = self.offset(change["range"]["start"], offsets)
+        end = self.offset(change["range"]["end"], offsets)
+        self.text = self.text[:start] + change["text"] + self.text[end:]
+        start_line = change["range"]["start"]["line"] + 1
+        end_line = start_line + change["text"].count("\n")
+        self.dirty_line = min(self.dirty_line, start_line)
+        self.tail_lines = min(self.tail_lines, self.text.count("\n") + 1 - end_line)
+
+    def find_fragments(self):
+        candidate_lines = find_candidate_lines(self.text)
+        line_count = self.text.count("\n") + 1
+        fragments = []
+        boundaries = []
+        start_line = 1
+        if self.fragments is not None:
+            position = bisect.bisect_right(self.boundaries, self.dirty_line) - 1
+            if position >= 0:
+                start_line = self.boundaries[position]
+                boundaries = self.boundaries[:position]
+                fragments = [f for f in self.fragments if f.start_line < start_line]
+        line_delta = line_count - self.line_count
+        first_tail_line = line_count - self.tail_lines + 1
+
+        if candidate_lines:
+            offsets = line_offsets(self.text)
+            for first_row, first_column, last_row, is_header in scan_logical_lines(
+                    self.text, offsets, start_line):
+                if first_row > candidate_lines[-1]:
+                    break
+                if first_row >= first_tail_line:
+                    # back in step with the last analysis, the rest only moved
+                    position = bisect.bisect_left(self.boundaries, first_row - line_delta)
+                    if position < len(self.boundaries) and \
+                            self.boundaries[position] == first_row - line_delta:
+                        boundaries.extend(b + line_delta for b in self.boundaries[position:])
+                        fragments.extend(f.shifted(line_delta) for f in self.fragments
+                                         if f.start_line >= first_row - line_delta)
+                        break
+                boundaries.append(first_row)
+                if has_candidate(candidate_lines, first_row, last_row):
+                    fragments.append(make_fragment(
+                        self.text, offsets, first_row, first_column, last_row, is_header))
+
+        self.fragments = fragments
+        self.boundaries = boundaries
+        self.line_count = line_count
+        self.dirty_line = line_count + 1
+        self.tail_lines = line_count
+        return fragments
+
+    def compute_edits(self, error_series):
+        fragment_edits = {}
+        edits = []
+        count = error_series
+        try:
+            fragments = self.find_fragments()
+        except Exception as exp:
+            logger.debug("Analysing the whole buffer, tokenizing failed: %s", exp)
+            self.reset()
+            return generate_fixed_edits(self.text, error_series)
+        for fragment in fragments:
+            templates = self.fragment_edits.get(fragment.text)
+            if templates is None:
+                try:
+                    templates = generate_fixed_edits(fragment.text, 0)
+                except Exception as exp:
+                    logger.debug("Analysing the whole buffer, a fragment failed: %s", exp)
+                    self.fragment_edits = {}
+                    return generate_fixed_edits(self.text, error_series)
+            fragment_edits[fragment.text] = templates
+            for template in templates:
+                count += 1
+                number = "%d, " % count if template.new_text.endswith(", ") else str(count)
+                edits.append(fragment.translate(template._replace(new_text=number)))
+        self.fragment_edits = fragment_edits
+        return edits
+
+    def text_edits(self, error_series):
+        offsets = line_offsets(self.text)
+        text_edits = []
+        for edit in self.compute_edits(error_series):
+            start_line = self.line_text(edit.start_line - 1, offsets)
+            end_line = self.line_text(edit.end_line - 1, offsets)
+            text_edits.append({
+                "range": {
+                    "start": {"line": edit.start_line - 1,
+                              "character": utf16_column(start_line, edit.start_column)},
+                    "end": {"line": edit.end_line - 1,
+                            "character": utf16_column(end_line, edit.end_column)},
+                },
+                "newText": edit.new_text,
+            })
+        return text_edits
+
+
+class LanguageServer(object):
+    """Minimal language server speaking JSON-RPC over a pair of byte streams."""
+
+    def __init__(self, reader, writer, error_series=None):
+        self.reader = reader
+        self.writer = writer
+        self.error_series = error_series
+        self.buffers = {}
+        self.running = True
+        self.handlers = {
+            "initialize": self.initialize,
+            "shutdown": lambda params: None,
+            "exit": self.exit,
+            "textDocument/didOpen": self.did_open,
+            "textDocument/didChange": self.did_change,
+            "textDocument/didClose": self.did_close,
+            "textDocument/codeAction": self.code_action,
+            "textDocument/formatting": self.formatting,
+            "textDocument/willSaveWaitUntil": self.formatting,
+            "workspace/executeCommand": self.execute_command,
+        }
+
+    def read_message(self):
+        content_length = None
+        while True:
+            line = self.reader.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.decode('ascii').partition(":")
+            if name.lower() == "content-length":
+                content_length = int(value.strip())
+        return json.loads(self.reader.read(content_length).decode('utf-8'))
+
+    def send(self, message):
+        message["jsonrpc"] = "2.0"
+        body = json.dumps(message, separators=(",", ":")).encode('utf-8')
+        self.writer.write(("Content-Length: %d\r\n\r\n" % len(body)).encode('ascii'))
+        self.writer.write(body)
+        self.writer.flush()
+
+    def serve(self):
+        while self.running:
+            message = self.read_message()
+            if message is None:
+                break
+            self.dispatch(message)
+
+    def dispatch(self, message):
+        method = message.get("method")
+        if method is None:
+            # a client response to a request of ours
+            return
+        handler = self.handlers.get(method)
+        is_request = "id" in message
+        if handler is None:
+            if is_request:
+                self.send({"id": message["id"], "error": {
+                    "code": METHOD_NOT_FOUND, "message": "Unknown method %s" % method}})
+            return
+        try:
+            result = handler(message.get("params") or {})
+        except Exception as exp:
+            logger.debug("Failed to handle %s", method, exc_info=True)
+            if is_request:
+                self.send({"id": message["id"], "error": {
+                    "code": INTERNAL_ERROR, "message": repr(exp)}})
+            return
+        if is_request:
+            self.send({"id": message["id"], "result": result})
+
+    def get_error_series(self, uri):
+        return get_error_number(uri_to_path(uri), self.error_series)
+
+    def initialize(self, params):
+        options = params.get("initializationOptions") or {}
+        if options.get("errorSeries"):
+            self.error_series = int(options["errorSeries"])
+        return {
+            "capabilities": {
+                "textDocumentSync": {
+                    "openClose": True,
+                    "change": 2,
+                    "willSaveWaitUntil": True,
+                },
+                "codeActionProvider": {"codeActionKinds": ["source.fixAll"]},
+                "documentFormattingProvider": True,
+                "executeCommandProvider": {"commands": [ASSIGN_COMMAND]},
+            },
+            "serverInfo": {"name": "error_number_fixer"},
+        }
+
+    def exit(self, params):
+        self.running = False
+
+    def did_open(self, params):
+        document = params["textDocument"]
+        self.buffers[document["uri"]] = Buffer(
+            document["uri"], document["text"], document.get("version"))
+
+    def did_change(self, params):
+        document = params["textDocument"]
+        buffer = self.buffers[document["uri"]]
+        for change in params["contentChanges"]:
+            buffer.apply_change(change)
+        buffer.version = document.get("version")
+
+    def did_close(self, params):
+        self.buffers.pop(params["textDocument"]["uri"], None)
+
+    def workspace_edit(self, uri):
+        buffer = self.buffers[uri]
+        text_edits = buffer.text_edits(self.get_error_series(uri))
+        if not text_edits:
+            return None
+        return {"documentChanges": [{
+            "textDocument": {"uri": uri, "version": buffer.version},
+            "edits": text_edits,
+        }]}
+
+    def code_action(self, params):
+        uri = params["textDocument"]["uri"]
+        edit = self.workspace_edit(uri)
+        if edit is None:
+            return []
+        return [{"title": ASSIGN_TITLE, "kind": "source.fixAll", "edit": edit}]
+
+    def formatting(self, params):
+        uri = params["textDocument"]["uri"]
+        return self.buffers[uri].text_edits(self.get_error_series(uri))
+
+    def execute_command(self, params):
+        if params.get("command") != ASSIGN_COMMAND:
+            return None
+        uri = (params.get("arguments") or [{}])[0].get("uri")
+        edit = self.workspace_edit(uri)
+        if edit is not None:
+            self.send({"id": "%s:%s" % (ASSIGN_COMMAND, uri), "method": "workspace/applyEdit",
+                       "params": {"label": ASSIGN_TITLE, "edit": edit}})
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Error number fixer language server (stdio)")
+    parser.add_argument('-e', "--error_series", dest="error_series",
+                        help="Error series number", type=check_positive,
+                        metavar="error_series")
+    parser.add_argument("-v", "--verbose", dest="verbose",
+                        action="count", help="set verbosity level",
+                        default=0)
+    args = parser.parse_args(argv)
+    if args.verbose > 0:
+        logger.setLevel(logging.DEBUG)
+
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    # anything printed by accident must not corrupt the protocol stream
+    sys.stdout = sys.stderr
+    LanguageServer(stdin, stdout, args.error_series).serve()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,132 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import heapq
+import logging
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover (python 2)
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:  # pragma: no cover (windows)
+    resource = None
+
+logger = logging.getLogger("error_number_fixer")
+
+# Observed peak allocation of a lib2to3 refactor is roughly 75x the size of
+# the source; start slightly above that until real measurements come in.
+DEFAULT_BYTES_RATIO = 80
+
+SIZE_UNITS = {
+    "": 1,
+    "k": 1024,
+    "m": 1024 ** 2,
+    "g": 1024 ** 3,
+}
+
+
+def parse_size(value):
+    text = str(value).strip().lower().rstrip("ib").rstrip("b")
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ""
+    number = text[:len(text) - len(unit)]
+    try:
+        size = int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s is an invalid memory size" % value)
+    if size <= 0:
+        raise argparse.ArgumentTypeError("%s is an invalid memory size" % value)
+    return size
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return "%.1f %s" % (size, unit)
+        size /= 1024
+    return "%.1f GiB" % size
+
+
+def measure_peak(func, *args):
+    """Run func(*args) and return (result, peak bytes allocated during the call).
+
+    Tracing is only on for the duration of the call, unless something else
+    had already turned it on.
+    """
+    if tracemalloc is not None:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        else:  # pragma: no cover (python < 3.9)
+            tracemalloc.clear_traces()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            result = func(*args)
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+    elif resource is not None:  # pragma: no cover (python 2)
+        # ru_maxrss is a high-water mark, so only growth beyond it is visible
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result = func(*args)
+        peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024
+    else:  # pragma: no cover
+        result, peak = func(*args), 0
+    return result, max(peak, 0)
+
+
+class MemoryBudget(object):
+    """Admission control for concurrently processed files.
+
+    Each file is charged an estimated peak (its size times the heaviest
+    bytes-per-source-byte ratio seen so far) while it is in flight.
+    """
+
+    def __init__(self, max_memory, ratio=DEFAULT_BYTES_RATIO, report_size=5):
+        self.max_memory = max_memory
+        self.ratio = ratio
+        self.report_size = report_size
+        self.in_flight = {}
+        self.heaviest_files = []
+
+    @property
+    def charged(self):
+        return sum(self.in_flight.values())
+
+    def estimate(self, file_size):
+        return int(file_size * self.ratio)
+
+    def is_oversized(self, file_size):
+        return self.estimate(file_size) > self.max_memory
+
+    def admit(self, file_size):
+        if not self.in_flight:
+            return True
+        return self.charged + self.estimate(file_size) <= self.max_memory
+
+    def acquire(self, key, file_size):
+        self.in_flight[key] = self.estimate(file_size)
+
+    def release(self, key):
+        self.in_flight.pop(key, None)
+
+    def record(self, file_name, file_size, peak):
+        if file_size:
+            self.ratio = max(self.ratio, peak / file_size)
+        entry = (peak, file_name)
+        if len(self.heaviest_files) < self.report_size:
+            heapq.heappush(self.heaviest_files, entry)
+        else:
+            heapq.heappushpop(self.heaviest_files, entry)
+
+    def heaviest(self):
+        return sorted(self.heaviest_files, reverse=True)
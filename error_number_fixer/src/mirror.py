@@ -0,0 +1,126 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import os
+import shutil
+import traceback
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger("error_number_fixer")
+
+SKIPPED_DIRS = {".git", ".hg", ".svn"}
+
+
+def link_or_copy(source_path, target_path):
+    try:
+        os.link(source_path, target_path)
+    except (OSError, AttributeError):
+        # cross-device links and file systems without hard links
+        shutil.copy2(source_path, target_path)
+
+
+def replace_path(target_path):
+    # never write through an existing hard link into the input tree
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+    target_dir = os.path.dirname(target_path)
+    if target_dir and not os.path.isdir(target_dir):
+        try:
+            os.makedirs(target_dir)
+        except OSError:
+            if not os.path.isdir(target_dir):
+                raise
+
+
+class MirrorWriter(object):
+    """Recreates the input tree under an output directory.
+
+    Fixed files are written by a thread pool while the run goes on; every
+    other file in the input tree is hard linked once the run is finished.
+    A file that can't be written fails on its own, finish returns them all.
+    """
+
+    def __init__(self, input_paths, output_dir, append_suffix=None, jobs=1):
+        self.input_paths = input_paths
+        self.output_dir = os.path.abspath(output_dir)
+        self.append_suffix = append_suffix
+        self.pool = ThreadPool(max(jobs, 1))
+        self.pending = []
+        self.fixed_files = set()
+
+    def target_path(self, source_file, append_suffix=None):
+        source_path = os.path.abspath(source_file)
+        relative_path = None
+        for input_path in self.input_paths:
+            input_path = os.path.abspath(input_path)
+            if os.path.isdir(input_path) and source_path.startswith(input_path + os.sep):
+                relative_path = os.path.relpath(source_path, input_path)
+                break
+        if relative_path is None:
+            relative_path = os.path.relpath(source_path)
+            if relative_path.startswith(os.pardir):
+                relative_path = os.path.basename(source_path)
+        if append_suffix:
+            root, extension = os.path.splitext(relative_path)
+            relative_path = root + "_" + append_suffix + extension
+        return os.path.join(self.output_dir, relative_path)
+
+    def write_fixed(self, source_file, modified_data):
+        self.fixed_files.add(os.path.abspath(source_file))
+        self.pending.append(self.pool.apply_async(
+            self._write, (source_file, modified_data)))
+
+    def _write(self, source_file, modified_data):
+        try:
+            target_path = self.target_path(source_file, self.append_suffix)
+            replace_path(target_path)
+            with open(target_path, 'wb') as target_file:
+                target_file.write(modified_data)
+            shutil.copymode(source_file, target_path)
+        except Exception:
+            return source_file, traceback.format_exc()
+        return None
+
+    def _link(self, source_file):
+        try:
+            target_path = self.target_path(source_file)
+            replace_path(target_path)
+            link_or_copy(source_file, target_path)
+        except Exception:
+            return source_file, traceback.format_exc()
+        return None
+
+    def iter_unchanged(self):
+        for input_path in self.input_paths:
+            if os.path.isfile(input_path):
+                if os.path.abspath(input_path) not in self.fixed_files:
+                    yield input_path
+                continue
+            for dir_path, dir_names, file_names in os.walk(input_path):
+                dir_names[:] = [
+                    dir_name for dir_name in dir_names
+                    if dir_name not in SKIPPED_DIRS and
+                    os.path.abspath(os.path.join(dir_path, dir_name)) != self.output_dir]
+                for file_name in file_names:
+                    file_path = os.path.join(dir_path, file_name)
+                    if os.path.abspath(file_path) not in self.fixed_files:
+                        yield file_path
+
+    def finish(self):
+        """Wait for every write, returning (source file, traceback) of each that failed."""
+        failures = []
+        try:
+            for source_file in self.iter_unchanged():
+                self.pending.append(self.pool.apply_async(self._link, (source_file,)))
+            for result in self.pending:
+                failure = result.get()
+                if failure is not None:
+                    failures.append(failure)
+        finally:
+            self.pool.close()
+            self.pool.join()
+        logger.debug("Mirrored %d fixed files into %s", len(self.fixed_files), self.output_dir)
+        return failures
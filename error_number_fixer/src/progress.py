@@ -0,0 +1,134 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import sys
+import threading
+import time
+
+from error_number_fixer.src.memory import format_size
+
+logger = logging.getLogger("error_number_fixer")
+
+# seconds between redraws of the status line, and between log lines without a terminal
+DRAW_INTERVAL = 0.25
+LOG_INTERVAL = 10.0
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "%dh%02dm" % (seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return "%dm%02ds" % (seconds // 60, seconds % 60)
+    return "%ds" % seconds
+
+
+class ProgressStream(object):
+    """Writes to the stream the status line is on, without tearing the status line."""
+
+    def __init__(self, progress, stream):
+        self.progress = progress
+        self.stream = stream
+
+    def write(self, text):
+        with self.progress.lock:
+            self.progress.clear()
+            self.stream.write(text)
+            self.progress.draw()
+
+    def flush(self):
+        self.stream.flush()
+
+
+class ProgressReporter(object):
+    """Tracks files in flight and reports throughput from a background thread.
+
+    On a terminal a status line is redrawn every DRAW_INTERVAL seconds;
+    otherwise a log line is written every LOG_INTERVAL seconds. Redraws
+    happen on the thread's own schedule, so finishing thousands of small
+    files doesn't cost thousands of redraws, and a hung file keeps showing
+    up as the slowest one with its time growing.
+    """
+
+    def __init__(self, label, names, sizes, stream=None):
+        self.label = label
+        self.names = names
+        self.sizes = sizes
+        self.stream = stream or sys.stdout
+        self.is_tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.in_flight = {}
+        self.done_files = 0
+        self.done_bytes = 0
+        self.total_bytes = sum(sizes)
+        self.start_time = None
+        self.drawn = False
+
+    def start(self):
+        self.start_time = time.time()
+        self.thread = threading.Thread(target=self.run, name="progress")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def started(self, index):
+        with self.lock:
+            self.in_flight[index] = time.time()
+
+    def finished(self, index):
+        with self.lock:
+            self.in_flight.pop(index, None)
+            self.done_files += 1
+            self.done_bytes += self.sizes[index]
+
+    def status(self):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        remaining = len(self.names) - self.done_files
+        parts = ["%s %d/%d files (%d left)" % (self.label, self.done_files, len(self.names),
+                                               remaining),
+                 "%.1f files/s" % (self.done_files / elapsed),
+                 "%s/s" % format_size(self.done_bytes / elapsed)]
+        if self.done_bytes and remaining:
+            eta = (self.total_bytes - self.done_bytes) * elapsed / self.done_bytes
+            parts.append("ETA %s" % format_duration(eta))
+        if self.in_flight:
+            index, started = min(self.in_flight.items(), key=lambda item: item[1])
+            parts.append("slowest %s (%s)" % (self.names[index],
+                                              format_duration(time.time() - started)))
+        return ", ".join(parts)
+
+    def clear(self):
+        if self.is_tty and self.drawn:
+            self.stream.write("\r\033[K")
+            self.drawn = False
+
+    def draw(self):
+        if self.is_tty and self.start_time is not None and not self.stopped.is_set():
+            self.stream.write("\r\033[K" + self.status())
+            self.stream.flush()
+            self.drawn = True
+
+    def run(self):
+        interval = DRAW_INTERVAL if self.is_tty else LOG_INTERVAL
+        while not self.stopped.wait(interval):
+            with self.lock:
+                if self.is_tty:
+                    self.draw()
+                else:
+                    logger.info(self.status())
+
+    def wrap(self, stream):
+        return ProgressStream(self, stream) if stream is self.stream else stream
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self.clear()
@@ -0,0 +1,138 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import re
+from lib2to3.pgen2 import token
+from lib2to3.pgen2.tokenize import TokenError
+from lib2to3.pgen2.tokenize import generate_tokens
+
+from error_number_fixer.src.source_io import line_offsets
+
+# a cheap superset of the calls matched by the fixer pattern
+CANDIDATE_RE = re.compile(
+    r"\b(?:result\s*\.\s*error|self\s*\.\s*logger\s*\.\s*(?:user_)?error)\s*\(")
+
+NON_CODE_TOKENS = (token.NL, token.COMMENT, token.INDENT, token.DEDENT,
+                   token.NEWLINE, token.ENDMARKER)
+
+OPENING_BRACKETS = ("(", "[", "{")
+BRACKETS = OPENING_BRACKETS + (")", "]", "}")
+
+
+class Fragment(object):
+    """One logical line holding candidate calls, parsed on its own."""
+
+    def __init__(self, start_line, start_column, text, end_line=None):
+        self.start_line = start_line
+        self.start_column = start_column
+        self.text = text
+        self.end_line = end_line if end_line is not None else start_line + text.count("\n") - 1
+
+    def shifted(self, line_delta):
+        return Fragment(self.start_line + line_delta, self.start_column, self.text,
+                        self.end_line + line_delta)
+
+    def translate(self, edit):
+        # only the first line of a fragment lost its indentation
+        start_column = edit.start_column
+        end_column = edit.end_column
+        if edit.start_line == 1:
+            start_column += self.start_column
+        if edit.end_line == 1:
+            end_column += self.start_column
+        return edit._replace(start_line=edit.start_line + self.start_line - 1,
+                             start_column=start_column,
+                             end_line=edit.end_line + self.start_line - 1,
+                             end_column=end_column)
+
+
+def find_candidate_lines(source_code):
+    lines = []
+    newlines = 0
+    position = 0
+    for match in CANDIDATE_RE.finditer(source_code):
+        newlines += source_code.count("\n", position, match.start())
+        position = match.start()
+        if not lines or lines[-1] != newlines + 1:
+            lines.append(newlines + 1)
+    return lines
+
+
+def has_candidate(candidate_lines, first_row, last_row):
+    position = bisect.bisect_left(candidate_lines, first_row)
+    return position < len(candidate_lines) and candidate_lines[position] <= last_row
+
+
+def scan_logical_lines(source_code, offsets, start_line=1):
+    """Yield (first row, first column, last row, is block header) per logical line.
+
+    Scanning may start at any logical line boundary. Lines are fed to the
+    tokenizer without their indentation, so a scan starting inside an
+    indented block doesn't trip over the indentation stack. A stray closing
+    bracket is rejected: the tokenizer would carry it on as hidden state.
+    """
+    indents = {}
+
+    def readline_from(row):
+        while row < len(offsets):
+            end = offsets[row + 1] if row + 1 < len(offsets) else len(source_code)
+            line = source_code[offsets[row]:end]
+            stripped = line.lstrip(" \t\f")
+            indents[row] = len(line) - len(stripped)
+            yield stripped
+            row += 1
+
+    lines = readline_from(start_line)
+    first_row = None
+    last_value = None
+    row_delta = start_line - 1
+    depth = 0
+    for tok_type, value, (row, column), _, _ in generate_tokens(lambda: next(lines, "")):
+        row += row_delta
+        if tok_type == token.OP and value in BRACKETS:
+            depth += 1 if value in OPENING_BRACKETS else -1
+            if depth < 0:
+                raise TokenError("unmatched closing bracket", (row, column))
+        if first_row is None:
+            if tok_type in NON_CODE_TOKENS:
+                continue
+            first_row = row
+        if tok_type == token.NEWLINE or tok_type == token.ENDMARKER:
+            yield first_row, indents[first_row], row, last_value == ":"
+            first_row = None
+        elif tok_type not in NON_CODE_TOKENS:
+            last_value = value
+
+
+def make_fragment(source_code, offsets, first_row, first_column, last_row, is_header):
+    end_offset = offsets[last_row + 1] if last_row + 1 < len(offsets) else len(source_code)
+    text = source_code[offsets[first_row] + first_column:end_offset]
+    if not text.endswith("\n"):
+        text += "\n"
+    if is_header:
+        # a block header on its own needs a body to parse
+        text += "    pass\n"
+    return Fragment(first_row, first_column, text, last_row)
+
+
+def find_fragments(source_code):
+    """Expand each candidate line to its enclosing logical line.
+
+    Tokenizing stops after the last candidate, so the work done here is
+    bounded by the position of the last call rather than the module size.
+    """
+    candidate_lines = find_candidate_lines(source_code)
+    if not candidate_lines:
+        return []
+    offsets = line_offsets(source_code)
+    fragments = []
+    for first_row, first_column, last_row, is_header in scan_logical_lines(source_code, offsets):
+        if first_row > candidate_lines[-1]:
+            break
+        if has_candidate(candidate_lines, first_row, last_row):
+            fragments.append(make_fragment(
+                source_code, offsets, first_row, first_column, last_row, is_header))
+    return fragments
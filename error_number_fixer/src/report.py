@@ -0,0 +1,91 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import difflib
+import io
+import os
+import sys
+
+from utils.util import repository_root
+
+OUTPUT_MODES = ("summary", "diff", "none")
+
+BUFFER_SIZE = 64 * 1024
+
+
+def patch_path(source_file, root):
+    """The path of source_file as a patch names it, relative to root and with slashes."""
+    return os.path.relpath(os.path.realpath(source_file), os.path.realpath(root)).replace(
+        os.sep, "/")
+
+
+def count_edits(source_code, regions):
+    # regions that rewrite a number with itself don't count
+    return sum(1 for region in regions if source_code[region.start:region.end] != region.new_text)
+
+
+class FixReporter(object):
+    """Reports fixed files through a buffer, so the terminal only sees large writes.
+
+    "summary" prints one line per file with its edit count, "diff" adds the
+    context diff cut after max_diff_lines lines, and "none" prints nothing.
+    A diff file, when given, receives the full unified diff of every file
+    whatever the mode, as a patch that git apply understands.
+    """
+
+    def __init__(self, mode="summary", max_diff_lines=None, diff_path=None, stream=None):
+        self.mode = mode
+        self.max_diff_lines = max_diff_lines
+        self.stream = stream or sys.stdout
+        self.diff_file = None
+        if diff_path:
+            self.diff_file = io.open(diff_path, 'w', encoding='utf-8')
+            # git apply takes the paths of a patch from the top of the repository
+            self.root = repository_root()
+        self.pending = []
+        self.pending_size = 0
+
+    def write(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.stream.write("".join(self.pending))
+            self.stream.flush()
+            self.pending = []
+            self.pending_size = 0
+
+    def report(self, source_file, source_code, modified_code, regions):
+        if self.mode == "summary":
+            self.write("\033[93mFixing error numbers: [%s]\033[0m %d edits\n"
+                       % (source_file, count_edits(source_code, regions)))
+        elif self.mode == "diff":
+            self.write("\033[93mFixing error numbers: [%s]\033[0m\n" % source_file)
+            diffed_lines = difflib.context_diff(
+                source_code.splitlines(), modified_code.splitlines(),
+                fromfile='Before Fix', tofile='After Fix', n=0)
+            for number, line in enumerate(diffed_lines):
+                if self.max_diff_lines is not None and number >= self.max_diff_lines:
+                    self.write("... %d more lines\n" % (sum(1 for _ in diffed_lines) + 1))
+                    break
+                self.write(' '.join(line.split()) + '\n')
+            self.write("\n")
+        if self.diff_file is not None:
+            path = patch_path(source_file, self.root)
+            for line in difflib.unified_diff(
+                    source_code.splitlines(True), modified_code.splitlines(True),
+                    fromfile="a/" + path, tofile="b/" + path):
+                self.diff_file.write(line)
+                if not line.endswith("\n"):
+                    self.diff_file.write("\n\\ No newline at end of file\n")
+
+    def close(self):
+        self.flush()
+        if self.diff_file is not None:
+            self.diff_file.close()
+            self.diff_file = None
@@ -0,0 +1,133 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+import uuid
+
+from error_number_fixer.src.catalog import CatalogEntry
+from error_number_fixer.src.source_io import Region
+from utils.file_lock import FileLock
+
+logger = logging.getLogger("error_number_fixer")
+
+CACHE_FORMAT = "2"
+DEFAULT_CACHE_SIZE = 256 * 1024 ** 2
+
+# temporary files left behind by writers that died before renaming them
+STALE_TEMP_SECONDS = 3600
+
+TOOL_VERSION = None
+
+
+def get_tool_version():
+    # any change to the fixer sources invalidates every cached result
+    global TOOL_VERSION
+    if TOOL_VERSION is None:
+        digest = hashlib.sha256(CACHE_FORMAT.encode('ascii'))
+        for module_path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))):
+            with open(module_path, 'rb') as module_file:
+                digest.update(module_file.read())
+        TOOL_VERSION = digest.hexdigest()
+    return TOOL_VERSION
+
+
+def make_dirs(dir_path):
+    try:
+        os.makedirs(dir_path)
+    except OSError:
+        if not os.path.isdir(dir_path):
+            raise
+
+
+class ResultCache(object):
+    """Fix results stored by the hash of everything they were computed from.
+
+    Entries hold the replaced regions of the decoded source, an empty list
+    meaning "no change", and the catalog entries of the file. Every entry
+    is written to a temporary file and renamed into place, so concurrent
+    runs sharing the directory only ever see complete entries. Reads touch
+    the entry, and pruning removes the least recently used entries once
+    the directory outgrows max_size.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+
+    def key(self, source_digest, *parts):
+        digest = hashlib.sha256(get_tool_version().encode('ascii'))
+        for part in (source_digest,) + parts:
+            digest.update(b"\0")
+            digest.update(("%s" % (part,)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key[2:] + ".json")
+
+    def get(self, key):
+        entry_path = self.entry_path(key)
+        try:
+            with io.open(entry_path, encoding='utf-8') as entry_file:
+                entry = json.load(entry_file)
+            os.utime(entry_path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return ([Region(*region) for region in entry["regions"]],
+                [CatalogEntry(*catalog_entry) for catalog_entry in entry["catalog"]])
+
+    def put(self, key, regions, catalog):
+        entry_path = self.entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+        temp_path = "%s.%s.tmp" % (entry_path, uuid.uuid4().hex)
+        if not os.path.isdir(entry_dir):
+            make_dirs(entry_dir)
+        with io.open(temp_path, 'w', encoding='utf-8') as entry_file:
+            entry_file.write(json.dumps({
+                "regions": [list(region) for region in regions],
+                "catalog": [list(catalog_entry) for catalog_entry in catalog],
+            }, ensure_ascii=False))
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, entry_path)
+        else:  # pragma: no cover (python 2)
+            os.rename(temp_path, entry_path)
+
+    def prune(self):
+        if not os.path.isdir(self.cache_dir):
+            make_dirs(self.cache_dir)
+        with FileLock(os.path.join(self.cache_dir, ".lock")):
+            entries = []
+            total_size = 0
+            for entry_path in glob.glob(os.path.join(self.cache_dir, "??", "*.json")):
+                try:
+                    stat = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+                total_size += stat.st_size
+            for temp_path in glob.glob(os.path.join(self.cache_dir, "??", "*.tmp")):
+                try:
+                    if os.path.getmtime(temp_path) < time.time() - STALE_TEMP_SECONDS:
+                        os.remove(temp_path)
+                except OSError:
+                    continue
+            entries.sort()
+            removed = 0
+            for _, size, entry_path in entries:
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    continue
+                total_size -= size
+                removed += 1
+        logger.debug("Pruned %d cache entries, %d bytes left in %s",
+                     removed, total_size, self.cache_dir)
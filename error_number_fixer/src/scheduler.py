@@ -0,0 +1,215 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import traceback
+from collections import deque
+
+from error_number_fixer.src.allocator import process_alive
+from error_number_fixer.src.memory import measure_peak
+
+try:
+    import queue
+except ImportError:  # pragma: no cover (python 2)
+    import Queue as queue
+
+logger = logging.getLogger("error_number_fixer")
+
+# how often the pool is checked for tasks whose worker died or whose result was lost
+POLL_SECONDS = 1.0
+
+STARTED_TASKS = None
+
+
+class TaskError(Exception):
+    pass
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+def raise_timeout(signum, frame):
+    raise TaskTimeout("Timed out")
+
+
+def run_task(func, args, measure, timeout=None):
+    use_alarm = timeout and hasattr(signal, 'setitimer')
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if measure:
+            result, peak = measure_peak(func, *args)
+        else:
+            result, peak = func(*args), 0
+        return True, result, peak
+    except Exception as exp:
+        if isinstance(exp, TaskTimeout):
+            return False, "TaskTimeout: no result after %s seconds\n" % timeout, 0
+        return False, traceback.format_exc(), 0
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+
+def init_worker(started_tasks):
+    global STARTED_TASKS
+    STARTED_TASKS = started_tasks
+
+
+def run_pool_task(index, func, args, measure, timeout):
+    # the parent learns which worker runs the task, to notice when it is killed
+    STARTED_TASKS.put((index, os.getpid()))
+    return run_task(func, args, measure, timeout)
+
+
+def simple_queue():
+    if hasattr(multiprocessing, 'SimpleQueue'):
+        return multiprocessing.SimpleQueue()
+    from multiprocessing.queues import SimpleQueue  # pragma: no cover (python 2)
+    return SimpleQueue()
+
+
+def error_outcome(exp):
+    return False, "".join(traceback.format_exception_only(type(exp), exp)), 0
+
+
+def lost_task(async_results, started_tasks, workers):
+    """Find an in flight task that will never call back, as (index, outcome)."""
+    while not started_tasks.empty():
+        index, pid = started_tasks.get()
+        if index in async_results:
+            workers[index] = pid
+    for index, result in sorted(async_results.items()):
+        if result.ready() and not result.successful():
+            # python 2 has no error_callback, such as for a result that can't be pickled
+            try:
+                result.get()
+            except Exception as exp:
+                return index, error_outcome(exp)
+        if index in workers and not process_alive(workers[index]):
+            # its result may still be on the way from a worker that died after sending it
+            result.wait(POLL_SECONDS)
+            if not result.ready():
+                return index, (False, "WorkerLost: the worker process running it died\n", 0)
+    return None
+
+
+def run_tasks(func, tasks, jobs=1, sizes=None, budget=None, failures=None, timeout=None,
+              progress=None):
+    """Yield (index, result) for func(*task) over tasks, in task order.
+
+    When a failures list is given, tasks that raise (or run past the timeout)
+    are appended to it as (index, traceback) instead of aborting the run.
+    So are tasks whose worker process is killed, such as when out of memory.
+
+    With a memory budget, workers only pick up a file while the estimated
+    peak of everything in flight fits the budget; files too large to fit
+    at all are deferred until the pool is gone and run one at a time.
+
+    A progress reporter is told when each task is handed out and when it finishes.
+    """
+    sizes = sizes or [0] * len(tasks)
+    measure = budget is not None
+    pending = deque()
+    deferred = []
+    for index, task in enumerate(tasks):
+        if budget is not None and budget.is_oversized(sizes[index]):
+            deferred.append(index)
+        else:
+            pending.append(index)
+
+    def start(index):
+        if budget is not None:
+            budget.acquire(index, sizes[index])
+        if progress is not None:
+            progress.started(index)
+
+    def finish(index, outcome):
+        ok, value, peak = outcome
+        if progress is not None:
+            progress.finished(index)
+        if budget is not None:
+            budget.release(index)
+            budget.record(tasks[index][0], sizes[index], peak)
+        if not ok and failures is None:
+            raise TaskError(value)
+        if not ok:
+            failures.append((index, value))
+        return ok, value
+
+    if jobs <= 1 or len(pending) <= 1:
+        for index in pending:
+            start(index)
+            ok, value = finish(index, run_task(func, tasks[index], measure, timeout))
+            if ok:
+                yield index, value
+    else:
+        done = queue.Queue()
+        started_tasks = simple_queue()
+        pool = multiprocessing.Pool(min(jobs, len(pending)), init_worker, (started_tasks,))
+        try:
+            results = {}
+            order = list(pending)
+            next_position = 0
+            async_results = {}
+            workers = {}
+            lost_any = False
+            while pending or async_results:
+                while pending and len(async_results) < jobs and (
+                        budget is None or budget.admit(sizes[pending[0]])):
+                    index = pending.popleft()
+                    start(index)
+                    callbacks = {}
+                    if sys.version_info[0] >= 3:
+                        callbacks['error_callback'] = \
+                            lambda exp, i=index: done.put((i, error_outcome(exp)))
+                    async_results[index] = pool.apply_async(
+                        run_pool_task, (index, func, tasks[index], measure, timeout),
+                        callback=lambda outcome, i=index: done.put((i, outcome)), **callbacks)
+                try:
+                    index, outcome = done.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    lost = lost_task(async_results, started_tasks, workers)
+                    if lost is None:
+                        continue
+                    index, outcome = lost
+                    lost_any = True
+                if async_results.pop(index, None) is None:
+                    # already reported as lost
+                    continue
+                workers.pop(index, None)
+                results[index] = finish(index, outcome)
+                while next_position < len(order) and order[next_position] in results:
+                    index = order[next_position]
+                    next_position += 1
+                    ok, value = results.pop(index)
+                    if ok:
+                        yield index, value
+            if lost_any:
+                # the pool still waits for the lost tasks and would never finish closing
+                pool.terminate()
+            else:
+                pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    for index in deferred:
+        logger.debug("Processing oversized file alone: %s", tasks[index][0])
+        gc.collect()
+        start(index)
+        ok, value = finish(index, run_task(func, tasks[index], measure, timeout))
+        if ok:
+            yield index, value
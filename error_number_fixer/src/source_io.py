@@ -0,0 +1,134 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import codecs
+import hashlib
+import io
+import mmap
+import os
+from collections import namedtuple
+from lib2to3.pgen2.tokenize import detect_encoding
+
+# files from this size on are decoded straight out of a memory map
+MMAP_THRESHOLD = 256 * 1024
+
+# a replacement of the text between two (line, column) positions, lines start at 1
+Edit = namedtuple('Edit', 'start_line start_column end_line end_column new_text')
+
+# the same replacement as character offsets into the source text
+Region = namedtuple('Region', 'start end new_text')
+
+
+class SourceText(object):
+    """Decoded source plus what is needed to encode it back to identical bytes."""
+
+    def __init__(self, text, encoding, bom, digest=None):
+        self.text = text
+        self.encoding = encoding
+        self.bom = bom
+        self.digest = digest
+
+    def encode(self, text):
+        data = text.encode(self.encoding)
+        return codecs.BOM_UTF8 + data if self.bom else data
+
+
+def decode_source(data):
+    """Decode bytes (or a buffer) honouring the PEP 263 cookie, keeping line endings."""
+    lines = io.BytesIO(bytes(data[:4096])).readline
+    encoding = detect_encoding(lines)[0]
+    bom = encoding == 'utf-8-sig'
+    if bom:
+        encoding = 'utf-8'
+    view = memoryview(data)
+    body = view[len(codecs.BOM_UTF8):] if bom else view
+    try:
+        text = codecs.decode(body, encoding)
+    except TypeError:  # pragma: no cover (python 2 codecs want str)
+        text = codecs.decode(body.tobytes(), encoding)
+    finally:
+        # a memory map can't be closed while views on it are alive
+        if hasattr(view, 'release'):
+            body.release()
+            view.release()
+    return SourceText(text, encoding, bom)
+
+
+def read_source(file_path, hash_name=None):
+    """Read and decode a source file, with the hash of its bytes when hash_name is given."""
+    with open(file_path, 'rb') as source_file:
+        size = os.fstat(source_file.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            data = source_file.read()
+        else:
+            data = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            source = decode_source(data)
+            if hash_name:
+                source.digest = hashlib.new(hash_name, data).hexdigest()
+            return source
+        finally:
+            if size >= MMAP_THRESHOLD:
+                data.close()
+
+
+def line_offsets(text):
+    offsets = [0, 0]
+    position = text.find('\n')
+    while position != -1:
+        offsets.append(position + 1)
+        position = text.find('\n', position + 1)
+    return offsets
+
+
+def splice(text, regions, position=0):
+    parts = []
+    for region in regions:
+        parts.append(text[position:region.start])
+        parts.append(region.new_text)
+        position = region.end
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def apply_edits(text, edits):
+    """Splice edits into text, returning the new text and the changed regions."""
+    if not edits:
+        return text, []
+    offsets = line_offsets(text)
+    regions = sorted(
+        Region(offsets[edit.start_line] + edit.start_column,
+               offsets[edit.end_line] + edit.end_column,
+               edit.new_text)
+        for edit in edits)
+    return splice(text, regions), regions
+
+
+def write_source(file_path, source, regions):
+    """Write back only the bytes that changed.
+
+    When every region keeps its encoded length the regions are written in
+    place; otherwise everything from the first region on is rewritten.
+    """
+    text = source.text
+    encoded_regions = []
+    byte_offset = len(codecs.BOM_UTF8) if source.bom else 0
+    position = 0
+    for region in regions:
+        byte_offset += len(text[position:region.start].encode(source.encoding))
+        old_size = len(text[region.start:region.end].encode(source.encoding))
+        encoded_regions.append((byte_offset, old_size, region.new_text.encode(source.encoding)))
+        byte_offset += old_size
+        position = region.end
+
+    with open(file_path, 'r+b') as target_file:
+        if all(old_size == len(data) for _, old_size, data in encoded_regions):
+            for offset, _, data in encoded_regions:
+                target_file.seek(offset)
+                target_file.write(data)
+            return
+        target_file.seek(encoded_regions[0][0])
+        target_file.write(splice(text, regions, regions[0].start).encode(source.encoding))
+        target_file.truncate()
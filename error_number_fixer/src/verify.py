@@ -0,0 +1,105 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import io
+import re
+from collections import deque
+from lib2to3.pgen2 import token
+from lib2to3.pgen2.tokenize import generate_tokens
+
+from error_number_fixer.src.source_io import line_offsets
+
+# what a region may replace: a single integer literal, or the blank space before the message
+INTEGER_RE = re.compile(r"\s*(?:0[xX][0-9a-fA-F]+|0[oO]?[0-7]+|0[bB][01]+|[0-9]+)[lL]?\Z")
+BLANK_RE = re.compile(r"\s*\Z")
+
+# what a region may insert: the new number, followed by a comma when the number is new
+NUMBER_RE = re.compile(r"([0-9]+)(, )?\Z")
+
+CALL_PREFIXES = (
+    ("result", ".", "error", "("),
+    ("self", ".", "logger", ".", "error", "("),
+    ("self", ".", "logger", ".", "user_error", "("),
+)
+
+NON_CODE_TOKENS = (token.NL, token.COMMENT, token.INDENT, token.DEDENT, token.NEWLINE)
+
+
+class VerificationError(Exception):
+    pass
+
+
+def check_text(source_code, modified_code, regions):
+    """Check the text around and inside the regions, returning the sites of the new numbers."""
+    sites = []
+    position = 0
+    shift = 0
+    for region in regions:
+        old_text = source_code[region.start:region.end]
+        match = NUMBER_RE.match(region.new_text)
+        if match is None or not (BLANK_RE if match.group(2) else INTEGER_RE).match(old_text):
+            raise VerificationError("%r was replaced by %r at offset %d"
+                                    % (old_text, region.new_text, region.start))
+        start = region.start + shift
+        if modified_code[position + shift:start] != source_code[position:region.start]:
+            raise VerificationError("Text before offset %d changed" % region.start)
+        sites.append((start, start + len(region.new_text), match.group(1), bool(match.group(2))))
+        shift += len(region.new_text) - (region.end - region.start)
+        position = region.end
+    if modified_code[position + shift:] != source_code[position:]:
+        raise VerificationError("Text after offset %d changed" % position)
+    return sites
+
+
+def check_tokens(modified_code, sites):
+    """Check that every site holds just a number (and comma) right inside a matched call."""
+    offsets = line_offsets(modified_code)
+    sites = deque(sites)
+    significant = deque(maxlen=max(len(call) for call in CALL_PREFIXES))
+    prefix = ()
+    inside = []
+    readline = io.StringIO(modified_code).readline
+    for tok_type, value, (row, column), (end_row, end_column), _ in generate_tokens(readline):
+        start = offsets[row] + column
+        end = offsets[end_row] + end_column
+        while sites and start >= sites[0][1]:
+            check_site(sites.popleft(), inside, prefix, offsets)
+            inside = []
+        if not sites:
+            break
+        if start >= sites[0][0]:
+            if not inside:
+                prefix = tuple(significant)
+            inside.append((tok_type, value, start, end))
+        elif end > sites[0][0]:
+            raise VerificationError("Line %d: a number was put inside a token" % row)
+        if tok_type not in NON_CODE_TOKENS:
+            significant.append(value)
+    if sites:
+        raise VerificationError("%d numbers were put past the end of the code" % len(sites))
+
+
+def check_site(site, inside, prefix, offsets):
+    site_start, site_end, number, comma = site
+    expected = [(token.NUMBER, number)] + ([(token.OP, ",")] if comma else [])
+    row = bisect.bisect_right(offsets, site_start) - 1
+    if [(tok_type, value) for tok_type, value, _, _ in inside] != expected or \
+            inside[0][2] != site_start or inside[-1][3] > site_end:
+        raise VerificationError("Line %d: %r doesn't tokenize as the error number"
+                                % (row, [value for _, value, _, _ in inside]))
+    if not any(prefix[-len(call):] == call for call in CALL_PREFIXES):
+        raise VerificationError("Line %d: error number outside of an error call" % row)
+
+
+def verify_fix(source_code, modified_code, regions):
+    """Raise VerificationError unless modified_code only numbers error calls of source_code.
+
+    Text outside the regions is compared directly; only the modified code is
+    tokenized, and only up to the last region.
+    """
+    sites = check_text(source_code, modified_code, regions)
+    if sites:
+        check_tokens(modified_code, sites)
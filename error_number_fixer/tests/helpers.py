@@ -0,0 +1,12 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# three calls without a number and two with one
+TEST_FILE_CONTENT = """
+    self.logger.user_error("This is 1234")
+    self.logger.error("This is 1234")
+    result.error("This is 1234")
+    result.error(234, "This is 234")
+    result.error(456, "This is 456")
+    """.rstrip() + '\n'
@@ -0,0 +1,48 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import multiprocessing
+
+from error_number_fixer.src.allocator import NumberAllocator
+
+
+def take_numbers(state_path, count):
+    lease = NumberAllocator(state_path, batch_size=7).reserve(1000)
+    numbers = [next(lease) for _ in range(count)]
+    lease.release()
+    return numbers
+
+
+def take_numbers_args(args):
+    return take_numbers(*args)
+
+
+def test_concurrent_leases_are_unique(tmpdir):
+    state_path = tmpdir.join("numbers.json").strpath
+    pool = multiprocessing.Pool(4)
+    try:
+        results = pool.map(take_numbers_args, [(state_path, 30)] * 8)
+    finally:
+        pool.close()
+        pool.join()
+    numbers = [number for result in results for number in result]
+    assert len(numbers) == len(set(numbers)) == 240
+    assert min(numbers) == 1001
+
+
+def test_released_numbers_are_reused_and_dead_leases_are_not(tmpdir):
+    state_path = tmpdir.join("numbers.json").strpath
+    allocator = NumberAllocator(state_path, batch_size=10)
+
+    lease = allocator.reserve(100)
+    assert [next(lease) for _ in range(3)] == [101, 102, 103]
+    lease.release()
+    assert next(allocator.reserve(100)) == 104
+
+    state = json.loads(tmpdir.join("numbers.json").read())
+    for lease_state in state["pools"]["100"]["leases"].values():
+        lease_state["pid"] = 2 ** 22 + 1
+    tmpdir.join("numbers.json").write(json.dumps(state))
+    assert next(allocator.reserve(100)) == 111
@@ -0,0 +1,29 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+
+from error_number_fixer.src.batch import main
+from error_number_fixer.tests.helpers import TEST_FILE_CONTENT
+
+
+def test_batch_fixes_every_repository(tmpdir, capsys):
+    for name in ("first", "second"):
+        tmpdir.join(name, "plugin.py").write(TEST_FILE_CONTENT, ensure=True)
+    tmpdir.join("second", "fixed.py").write("print('nothing to number')\n")
+    tmpdir.join("repositories.json").write(json.dumps({"repositories": [
+        {"path": "first", "error_series": 100},
+        {"path": "second", "error_series": 5000},
+        "missing",
+    ]}))
+
+    assert main([str(tmpdir.join("repositories.json")), '-j', '2', '--no-progress',
+                 '--report', str(tmpdir.join("report.json"))]) == 3
+    assert "self.logger.user_error(101, " in tmpdir.join("first", "plugin.py").read()
+    assert "self.logger.user_error(5001, " in tmpdir.join("second", "plugin.py").read()
+
+    report = json.loads(tmpdir.join("report.json").read())
+    assert [(entry["files"], entry["changed"], entry["edits"], len(entry["failures"]))
+            for entry in report] == [(1, 1, 5, 0), (2, 1, 5, 0), (0, 0, 0, 1)]
+    assert "Failed to fix 1 files:" in capsys.readouterr().out
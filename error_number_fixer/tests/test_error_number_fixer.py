@@ -2,17 +2,18 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import os
+import signal
+
+import pytest
+
+from error_number_fixer.src import error_number_fixer
 from error_number_fixer.src.error_number_fixer import main
+from error_number_fixer.src.memory import measure_peak
+from error_number_fixer.src.scheduler import run_tasks
+from error_number_fixer.tests.helpers import TEST_FILE_CONTENT
 from utils.util import cmd_output
 
-TEST_FILE_CONTENT = """
-    self.logger.user_error("This is 1234")
-    self.logger.error("This is 1234")
-    result.error("This is 1234")
-    result.error(234, "This is 234")
-    result.error(456, "This is 456")
-    """.rstrip() + '\n'
-
 
 def test_nothing_added(temp_git_dir):
     with temp_git_dir.as_cwd():
@@ -38,3 +39,359 @@ def test_added_file_not_in_pre_commits_list(temp_git_dir):
 
         # File not present
         assert main(['-i', 'g.py']) == 3
+
+
+def test_memory_budget_with_parallel_jobs(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        test_files = []
+        for test_file in range(4):
+            test_file_name = str(test_file) + ".py"
+            temp_git_dir.join(test_file_name).write(TEST_FILE_CONTENT)
+            test_files.append(test_file_name)
+
+        assert main(argv=['-i'] + test_files + ['-e', '100', '-j', '2', '--max-memory', '64M']) == 0
+        for test_file_name in test_files:
+            assert 'result.error(104, "This is 234")' in temp_git_dir.join(test_file_name).read()
+
+
+def test_measure_peak_stops_tracing():
+    tracemalloc = pytest.importorskip("tracemalloc")
+    result, peak = measure_peak(lambda size: len(bytearray(size)), 1024 ** 2)
+    assert result == 1024 ** 2
+    assert peak >= 1024 ** 2
+    assert not tracemalloc.is_tracing()
+
+    tracemalloc.start()
+    try:
+        measure_peak(len, "text")
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def killed_or_lost(number):
+    if number == 1:
+        # as the kernel does when a worker runs out of memory
+        os.kill(os.getpid(), signal.SIGKILL)
+    if number == 2:
+        # a result that can't be sent back
+        return lambda: number
+    return number
+
+
+def test_killed_workers_fail_their_task():
+    failures = []
+    results = list(run_tasks(killed_or_lost, [(number,) for number in range(4)], jobs=2,
+                             failures=failures))
+    assert results == [(0, 0), (3, 3)]
+    assert sorted(index for index, _ in failures) == [1, 2]
+    assert "WorkerLost" in dict(failures)[1]
+
+
+def test_allocator_keeps_existing_numbers(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("1.py").write(TEST_FILE_CONTENT)
+        allocator = temp_git_dir.join("numbers.json").strpath
+
+        assert main(['-i', '1.py', '-e', '100', '--allocator', allocator]) == 0
+        fixed = temp_git_dir.join("1.py").read()
+        assert 'result.error(234, "This is 234")' in fixed
+        assert 'result.error(456, "This is 456")' in fixed
+        assert 'result.error(103, "This is 1234")' in fixed
+
+        state = temp_git_dir.join("numbers.json").read()
+        assert main(['-i', '1.py', '-e', '100', '--allocator', allocator]) == 0
+        assert temp_git_dir.join("1.py").read() == fixed
+        # nothing needed a number, so no block was reserved
+        assert temp_git_dir.join("numbers.json").read() == state
+
+
+@pytest.mark.parametrize("options", [[], ['--candidate-regions']], ids=["module", "regions"])
+def test_allocator_skips_numbers_in_use(temp_git_dir, options):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("1.py").write(
+            'result.error(101, "one")\n'
+            'result.error("new")\n'
+            'result.error(102, "two")\n')
+        allocator = temp_git_dir.join("numbers.json").strpath
+
+        assert main(['-i', '1.py', '-e', '100', '--allocator', allocator] + options) == 0
+        assert temp_git_dir.join("1.py").read() == (
+            'result.error(101, "one")\n'
+            'result.error(103, "new")\n'
+            'result.error(102, "two")\n')
+
+
+def test_staged_hunks_only(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("1.py").write(
+            'result.error(101, "one")\n'
+            'result.error(102, "two")\n'
+            'result.error("three")\n')
+        cmd_output('git', 'add', "1.py")
+        cmd_output('git', '-c', 'user.name=test', '-c', 'user.email=test@test',
+                   'commit', '--no-gpg-sign', '-m', 'legacy')
+        temp_git_dir.join("1.py").write(
+            'result.error(101, "one")\n'
+            'result.error("new")\n'
+            'result.error(102, "two")\n'
+            'result.error("three")\n')
+        cmd_output('git', 'add', "1.py")
+
+        assert main(['-i', '1.py', '-e', '100', '--staged-hunks']) == 0
+        assert temp_git_dir.join("1.py").read() == (
+            'result.error(101, "one")\n'
+            'result.error(103, "new")\n'
+            'result.error(102, "two")\n'
+            'result.error("three")\n')
+
+
+def test_staged_hunks_keep_numbers_of_edited_calls(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("1.py").write(
+            'result.error(101, "one")\n'
+            'result.error(102, "two")\n')
+        cmd_output('git', 'add', "1.py")
+        cmd_output('git', '-c', 'user.name=test', '-c', 'user.email=test@test',
+                   'commit', '--no-gpg-sign', '-m', 'legacy')
+        temp_git_dir.join("1.py").write(
+            'result.error(101, "one edited")\n'
+            'result.error("new")\n'
+            'result.error(102, "two")\n')
+        cmd_output('git', 'add', "1.py")
+
+        assert main(['-i', '1.py', '-e', '100', '--staged-hunks']) == 0
+        assert temp_git_dir.join("1.py").read() == (
+            'result.error(101, "one edited")\n'
+            'result.error(103, "new")\n'
+            'result.error(102, "two")\n')
+
+
+def test_output_directory_mirrors_tree(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("plugin", "src", "fixed.py").write(TEST_FILE_CONTENT, ensure=True)
+        temp_git_dir.join("plugin", "src", "clean.py").write("import os\n")
+        temp_git_dir.join("plugin", "README.md").write("readme\n")
+
+        assert main(['-i', 'plugin', '-o', 'out', '-e', '100']) == 0
+
+        assert temp_git_dir.join("plugin", "src", "fixed.py").read() == TEST_FILE_CONTENT
+        assert 'result.error(104, "This is 234")' in temp_git_dir.join("out", "src", "fixed.py").read()
+        for unchanged in (("src", "clean.py"), ("README.md",)):
+            source = temp_git_dir.join("plugin", *unchanged)
+            assert source.samefile(temp_git_dir.join("out", *unchanged))
+
+
+def test_stage_fixed_files(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("staged.py").write(TEST_FILE_CONTENT)
+        temp_git_dir.join("partly_staged.py").write(TEST_FILE_CONTENT)
+        cmd_output('git', 'add', "staged.py", "partly_staged.py")
+        temp_git_dir.join("partly_staged.py").write(TEST_FILE_CONTENT + '    result.error("new")\n')
+
+        assert main(['-i', 'staged.py', 'partly_staged.py', '-e', '100', '--stage']) == 0
+
+        assert cmd_output('git', 'show', ':staged.py') == temp_git_dir.join("staged.py").read()
+        assert cmd_output('git', 'show', ':partly_staged.py') == TEST_FILE_CONTENT
+
+
+def test_stage_from_a_subdirectory(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("sub", "a.py").write(TEST_FILE_CONTENT, ensure=True)
+        cmd_output('git', 'add', "sub/a.py")
+    with temp_git_dir.join("sub").as_cwd():
+        assert main(['-i', 'a.py', '-e', '100', '--stage']) == 0
+        assert cmd_output('git', 'show', ':sub/a.py') == temp_git_dir.join("sub", "a.py").read()
+        assert cmd_output('git', 'show', ':sub/a.py') != TEST_FILE_CONTENT
+
+
+def test_plugin_series_matches_serial_run(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        for plugin_dir in ("serial", "parallel"):
+            for test_file in range(3):
+                temp_git_dir.join(plugin_dir, "src", "%d.py" % test_file).write(TEST_FILE_CONTENT, ensure=True)
+
+        assert main(['-i', 'serial', '-e', '100', '--plugin-series']) == 0
+        assert main(['-i', 'parallel', '-e', '100', '--plugin-series', '-j', '3']) == 0
+
+        assert 'result.error(115, "This is 456")' in temp_git_dir.join("serial", "src", "2.py").read()
+        for test_file in range(3):
+            assert (temp_git_dir.join("serial", "src", "%d.py" % test_file).read() ==
+                    temp_git_dir.join("parallel", "src", "%d.py" % test_file).read())
+
+
+def test_plugin_series_of_one_file_matches_whole_plugin(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        for plugin_dir in ("whole", "single"):
+            temp_git_dir.join(plugin_dir, "setup.py").write("import os\n", ensure=True)
+            for test_file in range(3):
+                temp_git_dir.join(plugin_dir, "src", "%d.py" % test_file).write(TEST_FILE_CONTENT, ensure=True)
+
+        assert main(['-i', 'whole', '-e', '100', '--plugin-series']) == 0
+        # pre-commit passes single files, in any order
+        assert main(['-i', 'single/src/2.py', 'single/src/1.py', '-e', '100',
+                     '--plugin-series']) == 0
+
+        assert temp_git_dir.join("single", "src", "0.py").read() == TEST_FILE_CONTENT
+        for test_file in (1, 2):
+            assert (temp_git_dir.join("single", "src", "%d.py" % test_file).read() ==
+                    temp_git_dir.join("whole", "src", "%d.py" % test_file).read())
+        assert 'result.error(115, "This is 456")' in temp_git_dir.join("single", "src", "2.py").read()
+
+
+def test_plugin_series_of_a_directory_matches_one_file(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        for parent in ("dir", "file"):
+            temp_git_dir.join(parent, "plugin", "setup.py").write("import os\n", ensure=True)
+            for test_file in range(2):
+                temp_git_dir.join(parent, "plugin", "src", "%d.py" % test_file).write(
+                    TEST_FILE_CONTENT, ensure=True)
+
+        assert main(['-i', 'dir/plugin/src', '--plugin-series']) == 0
+        assert main(['-i', 'file/plugin/src/1.py', '--plugin-series']) == 0
+
+        assert (temp_git_dir.join("file", "plugin", "src", "1.py").read() ==
+                temp_git_dir.join("dir", "plugin", "src", "1.py").read())
+
+
+def test_plugin_series_stops_at_nested_plugins(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("outer", "setup.py").write("import os\n", ensure=True)
+        temp_git_dir.join("outer", "inner", "setup.py").write("import os\n", ensure=True)
+        for path in (("outer", "src", "0.py"), ("outer", "inner", "1.py"), ("2.py",), ("3.py",)):
+            temp_git_dir.join(*path).write(TEST_FILE_CONTENT, ensure=True)
+
+        assert main(['-i', 'outer/src/0.py', 'outer/inner/1.py', '3.py', '-e', '100',
+                     '--plugin-series']) == 0
+
+        # each file starts its own series: the nested plugin, and files outside of any
+        # plugin, are counted apart
+        for path in (("outer", "src", "0.py"), ("outer", "inner", "1.py"), ("3.py",)):
+            assert 'user_error(101, "This is 1234")' in temp_git_dir.join(*path).read()
+        assert temp_git_dir.join("2.py").read() == TEST_FILE_CONTENT
+
+
+def test_bad_file_does_not_abort_run(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("0.py").write(TEST_FILE_CONTENT)
+        temp_git_dir.join("1.py").write("def broken(:\n")
+        temp_git_dir.join("2.py").write(TEST_FILE_CONTENT)
+
+        assert main(['-i', '0.py', '1.py', '2.py', '-e', '100', '-j', '2']) == 3
+
+        assert 'result.error(104, "This is 234")' in temp_git_dir.join("0.py").read()
+        assert 'result.error(104, "This is 234")' in temp_git_dir.join("2.py").read()
+        assert "1.py: lib2to3.pgen2.parse.ParseError" in capsys.readouterr().out
+
+
+def test_unwritable_mirror_target_does_not_abort_run(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("plugin", "0.py").write(TEST_FILE_CONTENT, ensure=True)
+        temp_git_dir.join("plugin", "sub", "1.py").write(TEST_FILE_CONTENT, ensure=True)
+        # a file where the mirror needs a directory
+        temp_git_dir.join("out", "sub").write("", ensure=True)
+
+        assert main(['-i', 'plugin', '-o', 'out', '-e', '100']) == 3
+
+        assert 'result.error(104, "This is 234")' in temp_git_dir.join("out", "0.py").read()
+        assert "1.py: " in capsys.readouterr().out
+
+
+def test_line_endings_and_encoding_are_preserved(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        source = (b'\xef\xbb\xbf# -*- coding: utf-8 -*-\r\n'
+                  b'def run(self):\r\n'
+                  b'    self.logger.error("caf\xc3\xa9")\r\n'
+                  b'    result.error(7, "na\xc3\xafve")\r\n')
+        temp_git_dir.join("1.py").write_binary(source)
+
+        assert main(['-i', '1.py', '-e', '100']) == 0
+
+        assert temp_git_dir.join("1.py").read_binary() == (
+            b'\xef\xbb\xbf# -*- coding: utf-8 -*-\r\n'
+            b'def run(self):\r\n'
+            b'    self.logger.error(101, "caf\xc3\xa9")\r\n'
+            b'    result.error(102, "na\xc3\xafve")\r\n')
+
+
+def test_result_cache_skips_parsing(temp_git_dir, monkeypatch):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("0.py").write(TEST_FILE_CONTENT)
+        temp_git_dir.join("1.py").write("result.error(101, 'fixed already')\n")
+        assert main(['-i', '0.py', '1.py', '-e', '100', '--cache-dir', 'cache']) == 0
+        fixed_content = temp_git_dir.join("0.py").read()
+
+        def fail(*args):
+            raise AssertionError("parsed despite a cached result")
+
+        monkeypatch.setattr(error_number_fixer, "generate_fixed_edits", fail)
+        temp_git_dir.join("2.py").write(TEST_FILE_CONTENT)
+        assert main(['-i', '1.py', '2.py', '-e', '100', '--cache-dir', 'cache']) == 0
+        assert temp_git_dir.join("2.py").read() == fixed_content
+        assert temp_git_dir.join("1.py").read() == "result.error(101, 'fixed already')\n"
+
+
+def test_unverified_results_are_not_cached(temp_git_dir, monkeypatch):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("0.py").write(TEST_FILE_CONTENT)
+        temp_git_dir.join("1.py").write(TEST_FILE_CONTENT)
+        assert main(['-i', '0.py', '-e', '100', '--cache-dir', 'cache', '--no-verify']) == 0
+
+        verified = []
+        monkeypatch.setattr(error_number_fixer, "verify_fix",
+                            lambda *args: verified.append(args))
+        assert main(['-i', '1.py', '-e', '100', '--cache-dir', 'cache']) == 0
+        assert len(verified) == 1
+        assert temp_git_dir.join("1.py").read() == temp_git_dir.join("0.py").read()
+
+
+def test_catalog_is_updated_per_file(temp_git_dir):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("0.py").write(TEST_FILE_CONTENT)
+        temp_git_dir.join("1.py").write('self.logger.user_error("[Error 404] Resource not found")\n')
+        assert main(['-i', '0.py', '1.py', '-e', '9000', '--catalog', 'catalog.json']) == 0
+
+        temp_git_dir.join("1.py").write('result.error(9001, "moved")\n\nresult.error("added")\n')
+        assert main(['-i', '1.py', '-e', '9000', '--catalog', 'catalog.json',
+                     '--catalog-csv', 'catalog.csv']) == 0
+
+        assert temp_git_dir.join("catalog.csv").read().splitlines() == [
+            "number,file,line,kind,message",
+            "9001,0.py,2,self.logger.user_error,This is 1234",
+            "9001,1.py,1,result.error,moved",
+            "9002,0.py,3,self.logger.error,This is 1234",
+            "9002,1.py,3,result.error,added",
+            "9003,0.py,4,result.error,This is 1234",
+            "9004,0.py,5,result.error,This is 234",
+            "9005,0.py,6,result.error,This is 456",
+        ]
+
+
+def test_unverified_fix_is_not_written(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("1.py").write('result.error(ERROR_CODE, "named")\n')
+
+        assert main(['-i', '1.py', '-e', '100']) == 3
+
+        assert temp_git_dir.join("1.py").read() == 'result.error(ERROR_CODE, "named")\n'
+        assert "VerificationError: 'ERROR_CODE' was replaced" in capsys.readouterr().out
+
+
+def test_output_modes_and_diff_file(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("0.py").write(TEST_FILE_CONTENT)
+        temp_git_dir.join("1.py").write(TEST_FILE_CONTENT)
+
+        assert main(['-i', '0.py', '-e', '100']) == 0
+        assert "Fixing error numbers: [0.py]\033[0m 5 edits\n" in capsys.readouterr().out
+
+        # absolute paths are named relative to the repository in the patch
+        assert main(['-i', temp_git_dir.join("1.py").strpath, '-e', '100', '--output', 'diff',
+                     '--max-diff-lines', '4', '--diff-file', 'fix.diff']) == 0
+        output = capsys.readouterr().out
+        assert "--- a/1.py\n+++ b/1.py\n" in temp_git_dir.join("fix.diff").read()
+        assert "*** Before Fix\n--- After Fix\n***************\n*** 2,6 ****\n... 11 more lines\n" in output
+
+        temp_git_dir.join("1.py").write(TEST_FILE_CONTENT)
+        cmd_output('git', 'apply', 'fix.diff')
+        assert temp_git_dir.join("1.py").read() == temp_git_dir.join("0.py").read()
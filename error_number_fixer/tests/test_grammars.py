@@ -0,0 +1,66 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import pytest
+
+from error_number_fixer.src.error_number_fixer import generate_fixed_code
+from error_number_fixer.src.grammars import DEFAULT_GRAMMAR
+from error_number_fixer.src.grammars import EXEC_FUNCTION_GRAMMAR
+from error_number_fixer.src.grammars import future_features
+from error_number_fixer.src.grammars import PRINT_STATEMENT_GRAMMAR
+from error_number_fixer.src.grammars import select_grammar
+
+PRINT_STATEMENTS = """
+def run(self):
+    print "starting"
+    print >>sys.stderr, "to stderr"
+    if self.verbose: print
+    exec "x = 1" in namespace
+    self.logger.error("failed")
+"""
+
+PRINT_FUNCTIONS = """
+from __future__ import print_function
+
+def run(self):
+    print("starting", file=sys.stderr)
+    self.logger.error("failed")
+"""
+
+EXEC_NAMES = """
+def run(self):
+    self.runner.exec("query")
+    options = dict(exec=True)
+    self.logger.error("failed")
+"""
+
+IN_STRINGS = '''
+def run(self):
+    """print this, exec that"""
+    self.logger.error("failed")  # print it, exec it
+'''
+
+
+@pytest.mark.parametrize("source_code, grammar", [
+    (PRINT_STATEMENTS, PRINT_STATEMENT_GRAMMAR),
+    (PRINT_FUNCTIONS, DEFAULT_GRAMMAR),
+    (EXEC_NAMES, EXEC_FUNCTION_GRAMMAR),
+    (IN_STRINGS, DEFAULT_GRAMMAR),
+], ids=["print_statements", "print_functions", "exec_names", "in_strings"])
+def test_grammar_is_selected_per_file(source_code, grammar):
+    assert select_grammar(source_code) is grammar
+    fixed_code = generate_fixed_code(source_code, 100)
+    assert fixed_code == source_code.replace('error("failed")', 'error(101, "failed")')
+
+
+@pytest.mark.parametrize("source_code, features", [
+    ('"""doc"""\nfrom __future__ import (absolute_import,\n    print_function as p)\n',
+     {"absolute_import", "print_function"}),
+    ("# comment\nfrom __future__ import division; from __future__ import print_function\n",
+     {"division", "print_function"}),
+    ("import os\nfrom __future__ import print_function\n", set()),
+    ("", set()),
+], ids=["docstring_and_parentheses", "semicolon", "not_leading", "empty"])
+def test_future_features(source_code, features):
+    assert future_features(source_code) == features
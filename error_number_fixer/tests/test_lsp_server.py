@@ -0,0 +1,92 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+
+from error_number_fixer.src.lsp_server import Buffer
+from error_number_fixer.src.lsp_server import LanguageServer
+from error_number_fixer.src.regions import find_fragments
+
+CYMON_FILE = os.path.join(os.path.dirname(__file__), "files", "cymon.py")
+
+URI = "file:///plugin/src/cymon.py"
+
+SOURCE = (
+    "class Cymon(object):\n"
+    "    def run(self):\n"
+    "        self.logger.error(\"café \U0001F600\")\n"
+    "        result.error(7, \"second\")\n"
+)
+
+
+def frame(message):
+    body = json.dumps(message).encode('utf-8')
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+def run_server(*messages):
+    reader = io.BytesIO(b"".join(frame(message) for message in messages))
+    writer = io.BytesIO()
+    LanguageServer(reader, writer).serve()
+    responses = []
+    output = writer.getvalue()
+    while output:
+        header, _, output = output.partition(b"\r\n\r\n")
+        length = int(header.split(b":")[1])
+        responses.append(json.loads(output[:length].decode('utf-8')))
+        output = output[length:]
+    return dict((response["id"], response) for response in responses)
+
+
+def test_code_action_after_incremental_change():
+    responses = run_server(
+        {"id": 1, "method": "initialize", "params": {"initializationOptions": {"errorSeries": 9000}}},
+        {"method": "textDocument/didOpen", "params": {"textDocument": {
+            "uri": URI, "version": 1, "languageId": "python", "text": SOURCE}}},
+        {"method": "textDocument/didChange", "params": {
+            "textDocument": {"uri": URI, "version": 2},
+            "contentChanges": [{"range": {"start": {"line": 3, "character": 25},
+                                          "end": {"line": 3, "character": 31}},
+                                "text": "renamed"}]}},
+        {"id": 2, "method": "textDocument/codeAction", "params": {
+            "textDocument": {"uri": URI}, "range": {}, "context": {"diagnostics": []}}},
+        {"id": 3, "method": "shutdown"},
+        {"method": "exit"},
+    )
+
+    assert responses[1]["result"]["capabilities"]["codeActionProvider"]
+    action, = responses[2]["result"]
+    document_change, = action["edit"]["documentChanges"]
+    assert document_change["textDocument"]["version"] == 2
+    assert document_change["edits"] == [
+        {"range": {"start": {"line": 2, "character": 26}, "end": {"line": 2, "character": 26}},
+         "newText": "9001, "},
+        {"range": {"start": {"line": 3, "character": 21}, "end": {"line": 3, "character": 22}},
+         "newText": "9002"},
+    ]
+
+
+def test_buffer_rescans_only_around_changes():
+    with io.open(CYMON_FILE, encoding='utf-8') as cymon_file:
+        buffer = Buffer(URI, cymon_file.read() * 3)
+    buffer.find_fragments()
+
+    def as_tuples(fragments):
+        return [(f.start_line, f.start_column, f.end_line, f.text) for f in fragments]
+
+    batches = [
+        [((10, 0), (10, 0), "    x = (1,\n         2)\n")],
+        [((40, 4), (41, 0), "")],
+        # a bracket left open until a later change closes it
+        [((300, 0), (300, 0), "(\n"), ((1200, 0), (1200, 0), ")\n")],
+        [((1000, 0), (1000, 0), "        self.logger.error('added')\n")],
+    ]
+    for changes in batches:
+        for start, end, text in changes:
+            buffer.apply_change({"range": {"start": {"line": start[0], "character": start[1]},
+                                           "end": {"line": end[0], "character": end[1]}},
+                                 "text": text})
+        assert as_tuples(buffer.find_fragments()) == as_tuples(find_fragments(buffer.text))
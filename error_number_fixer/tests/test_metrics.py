@@ -0,0 +1,62 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from error_number_fixer.src.error_number_fixer import main
+from error_number_fixer.tests.helpers import TEST_FILE_CONTENT
+from utils import metrics
+from utils.metrics import MetricsStore
+from utils.util import cmd_output
+
+
+def test_runs_are_recorded(temp_git_dir, capsys):
+    with temp_git_dir.as_cwd():
+        temp_git_dir.join("0.py").write(TEST_FILE_CONTENT)
+        cmd_output('git', 'add', '0.py')
+        for _ in range(3):
+            assert main(['-i', '0.py', '-e', '100', '--stage', '--cache-dir', 'cache',
+                         '--metrics', 'runs.jsonl']) == 0
+        temp_git_dir.join("runs.jsonl").write("{broken\n", mode='a')
+
+        records = MetricsStore('runs.jsonl').load()
+        assert [record["command"] for record in records] == ["error_number_fixer"] * 3
+        assert set(records[0]["phases"]) == {"collect", "fix", "finish"}
+        assert records[0]["counts"] == {"files_scanned": 1, "cache_hits": 0, "files_changed": 1,
+                                        "failures": 0, "git_processes": 2}
+        # the second run caches the fixed file, the third finds it
+        assert records[2]["counts"]["cache_hits"] == 1
+
+        capsys.readouterr()
+        assert metrics.main(['runs.jsonl']) == 0
+        assert "error_number_fixer\033[0m: 3 runs" in capsys.readouterr().out
+
+
+def test_percentiles_and_openmetrics():
+    records = [{"command": "check", "duration": float(seconds), "phases": {"check": 1.0},
+                "counts": {"files_scanned": seconds}} for seconds in range(1, 11)]
+    assert metrics.percentile([1, 2, 3, 4], 0.5) == 2.5
+    assert metrics.trend([1.0] * 20 + [1.5] * 20) == 0.5
+
+    text = metrics.format_openmetrics(records)
+    assert text.endswith("# EOF\n")
+    assert '# TYPE hook_run_duration_seconds summary\n' \
+           'hook_run_duration_seconds{command="check",quantile="0.5"} 5.5\n' in text
+    assert 'hook_phase_duration_seconds_count{command="check",phase="check"} 10\n' in text
+    assert 'hook_files_scanned_sum{command="check"} 55.0\n' in text
+
+
+def test_store_compacts_by_record_count(tmpdir, monkeypatch):
+    store_path = tmpdir.join("runs.jsonl").strpath
+    store = MetricsStore(store_path, max_runs=10)
+    loads = []
+    load = store.load
+    monkeypatch.setattr(store, "load", lambda *args: loads.append(args) or load(*args))
+
+    for number in range(25):
+        store.append({"command": "check", "run": number, "padding": "x" * 500})
+
+    # the count kept next to the store spares reading it except to compact
+    assert len(loads) == 4
+    runs = [record["run"] for record in load()]
+    assert runs == list(range(18, 25))
+    assert tmpdir.join("runs.jsonl.lock").read() == "7\n"
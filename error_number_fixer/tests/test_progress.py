@@ -0,0 +1,32 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import time
+
+from error_number_fixer.src.progress import ProgressReporter
+
+
+class Terminal(io.StringIO):
+
+    def isatty(self):
+        return True
+
+
+def test_status_line_is_kept_below_other_output():
+    terminal = Terminal()
+    progress = ProgressReporter("Fixing", ["0.py", "1.py", "2.py"], [100, 200, 300], terminal)
+    progress.start_time = time.time() - 10
+    for index in range(3):
+        progress.started(index)
+    progress.finished(1)
+
+    status = progress.status()
+    assert status.startswith("Fixing 1/3 files (2 left), 0.1 files/s, 20.0 B/s, ETA 20s, ")
+    assert ", slowest 0.py (" in status
+
+    progress.draw()
+    progress.wrap(terminal).write("fixed 1.py\n")
+    progress.close()
+    assert terminal.getvalue().split("\r\033[K") == ["", status, "fixed 1.py\n", status, ""]
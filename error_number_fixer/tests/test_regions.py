@@ -0,0 +1,48 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import os
+
+import pytest
+
+from error_number_fixer.src.error_number_fixer import generate_fixed_edits
+from error_number_fixer.src.error_number_fixer import generate_region_edits
+from error_number_fixer.src.regions import find_fragments
+from error_number_fixer.src.source_io import apply_edits
+
+CYMON_FILE = os.path.join(os.path.dirname(__file__), "files", "cymon.py")
+
+NESTED_CODE = """
+class Plugin(object):
+    def run(self):
+        if result.error("in header"):
+            pass
+        values = [1,
+    2]; self.logger.error(
+"continued")
+        try:
+            pass
+        except Exception:
+            pass
+        else: self.logger.user_error("needs the whole module")
+"""
+
+
+def read_cymon():
+    with io.open(CYMON_FILE, encoding="utf-8") as cymon_file:
+        return cymon_file.read()
+
+
+@pytest.mark.parametrize("source_code", [read_cymon(), NESTED_CODE], ids=["cymon", "nested"])
+def test_region_edits_match_whole_module(source_code):
+    whole_module = apply_edits(source_code, generate_fixed_edits(source_code, 9000))[0]
+    regions = apply_edits(source_code, generate_region_edits(source_code, 9000))[0]
+    assert regions == whole_module
+
+
+def test_fragments_are_logical_lines():
+    fragments = find_fragments(NESTED_CODE)
+    assert [fragment.start_line for fragment in fragments] == [4, 6, 13]
+    assert fragments[0].text == 'if result.error("in header"):\n    pass\n'
@@ -0,0 +1,42 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import os
+
+import pytest
+
+from error_number_fixer.src.error_number_fixer import generate_fixed_edits
+from error_number_fixer.src.source_io import Region
+from error_number_fixer.src.source_io import apply_edits
+from error_number_fixer.src.source_io import splice
+from error_number_fixer.src.verify import VerificationError
+from error_number_fixer.src.verify import verify_fix
+
+CYMON_FILE = os.path.join(os.path.dirname(__file__), "files", "cymon.py")
+
+
+def test_fixed_file_verifies():
+    with io.open(CYMON_FILE, encoding='utf-8') as cymon_file:
+        source_code = cymon_file.read()
+    modified_code, regions = apply_edits(source_code, generate_fixed_edits(source_code, 9000))
+
+    verify_fix(source_code, modified_code, regions)
+
+
+@pytest.mark.parametrize("source_code, region", [
+    # a comment would be dropped along with the old number
+    ('result.error(  # why\n 5, "a")\n', Region(13, 23, "101")),
+    # only integer literals are replaced
+    ('result.error(CODE, "a")\n', Region(13, 17, "101")),
+    # the number would land inside a string
+    ('x = "result.error( a"\n', Region(18, 19, "101, ")),
+    # not an error call
+    ('print(  "a")\n', Region(6, 8, "101, ")),
+    # the comma is missing
+    ('result.error("a")\n', Region(13, 13, "101")),
+], ids=["comment", "name", "string", "other_call", "no_comma"])
+def test_unsafe_changes_fail(source_code, region):
+    with pytest.raises(VerificationError):
+        verify_fix(source_code, splice(source_code, [region]), [region])
@@ -23,13 +23,17 @@ setup(
     ],
 
     packages=find_packages(exclude=('tests*', 'testing*')),
+    package_data={'check_added_plugin_files.src': ['default_rules.json']},
     install_requires=[
         'pre-commit'
     ],
     entry_points={
         'console_scripts': [
             'error_number_fixer = error_number_fixer.src.error_number_fixer:main',
-            'check_added_plugin_files = check_added_plugin_files.src.check_added_plugin_files:main'
+            'error_number_fixer_lsp = error_number_fixer.src.lsp_server:main',
+            'error_number_fixer_batch = error_number_fixer.src.batch:main',
+            'check_added_plugin_files = check_added_plugin_files.src.check_added_plugin_files:main',
+            'hook_stats = utils.metrics:main'
         ],
     },
 )
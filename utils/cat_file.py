@@ -0,0 +1,190 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import itertools
+import subprocess
+
+from utils import util
+
+# requests written ahead of the answers read back, bounded in count and in
+# bytes so the names always fit in the pipe to git and writing never blocks
+WINDOW = 128
+WINDOW_BYTES = 32 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+# unread content up to this size is skipped, past it restarting git is cheaper
+DRAIN_LIMIT = 1024 * 1024
+
+ObjectInfo = collections.namedtuple("ObjectInfo", "object_id type size")
+
+
+class CatFileError(Exception):
+    pass
+
+
+class BlobStream(object):
+    """Read only access to the content of one object as git cat-file writes it."""
+
+    def __init__(self, stream, size):
+        self.stream = stream
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if not size:
+            return b""
+        data = self.stream.read(size)
+        if len(data) < size:
+            raise CatFileError("git cat-file stopped in the middle of an object")
+        self.remaining -= len(data)
+        return data
+
+    def drain(self):
+        while self.remaining:
+            self.read(min(CHUNK_SIZE, self.remaining))
+
+
+class CatFile(object):
+    """Long running git cat-file --batch and --batch-check processes.
+
+    Each process is started on first use and answers every request of
+    the run, so looking up thousands of objects costs one process spawn.
+    Requests are pipelined: up to a window of object names is written
+    ahead of the answers being read. Names are anything git rev-parse
+    takes, such as object ids or ":path" for the staged blob of a path.
+    A CatFile must not be shared between threads.
+    """
+
+    def __init__(self, cwd=None, window=WINDOW):
+        self.cwd = cwd
+        self.window = window
+        self.processes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def process(self, option):
+        if option not in self.processes:
+            util.process_count += 1
+            self.processes[option] = subprocess.Popen(
+                ['git', 'cat-file', option], cwd=self.cwd,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return self.processes[option]
+
+    def stop(self, option):
+        process = self.processes.pop(option, None)
+        if process is None:
+            return
+        process.stdin.close()
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.stderr.close()
+        process.wait()
+
+    def close(self):
+        for option in list(self.processes):
+            self.stop(option)
+
+    def answers(self, option, names, pending=None):
+        """Yield (name, ObjectInfo or None when git can't find it) as git answers.
+
+        The names written but not answered yet are kept in the pending deque.
+        """
+        process = self.process(option)
+        names = iter(names)
+        if pending is None:
+            pending = collections.deque()
+        pending_bytes = sum(length for _, length in pending)
+        while True:
+            while len(pending) < self.window and pending_bytes < WINDOW_BYTES:
+                name = next(names, None)
+                if name is None:
+                    break
+                if "\n" in name:
+                    raise CatFileError("Object names can't hold newlines: %r" % name)
+                request = name.encode('utf-8') + b"\n"
+                process.stdin.write(request)
+                pending.append((name, len(request)))
+                pending_bytes += len(request)
+            if not pending:
+                return
+            # without --buffer, git flushes each answer before reading the next name
+            process.stdin.flush()
+            name, length = pending.popleft()
+            pending_bytes -= length
+            header = process.stdout.readline()
+            if not header:
+                raise CatFileError("git cat-file exited: %s"
+                                   % process.stderr.read().decode('utf-8').strip())
+            fields = header.split()
+            if len(fields) != 3 or fields[-1] in (b"missing", b"ambiguous"):
+                yield name, None
+            else:
+                yield name, ObjectInfo(fields[0].decode('ascii'), fields[1].decode('ascii'),
+                                       int(fields[2]))
+
+    def info(self, names):
+        """Yield (name, ObjectInfo or None) for each name, without reading any content."""
+        completed = False
+        try:
+            for answer in self.answers('--batch-check', names):
+                yield answer
+            completed = True
+        finally:
+            if not completed:
+                # the answers to the names still in flight would be read as the next ones
+                self.stop('--batch-check')
+
+    def contents(self, names):
+        """Yield (name, ObjectInfo, BlobStream) for each name, both None when git can't find it.
+
+        A stream is only readable until the next item is asked for. What is
+        left of it is then skipped, or when more than DRAIN_LIMIT is left,
+        git is stopped and the names still in flight are asked again of a
+        new process, so giving up early on a large object costs nothing.
+        """
+        names = iter(names)
+        pending = collections.deque()
+        answers = self.answers('--batch', names, pending)
+        completed = False
+        try:
+            while True:
+                answer = next(answers, None)
+                if answer is None:
+                    break
+                name, object_info = answer
+                if object_info is None:
+                    yield name, None, None
+                    continue
+                stream = BlobStream(self.processes['--batch'].stdout, object_info.size)
+                yield name, object_info, stream
+                if stream.remaining > DRAIN_LIMIT:
+                    answers.close()
+                    self.stop('--batch')
+                    names = itertools.chain([pending_name for pending_name, _ in pending], names)
+                    pending = collections.deque()
+                    answers = self.answers('--batch', names, pending)
+                    continue
+                stream.drain()
+                self.processes['--batch'].stdout.read(1)
+            completed = True
+        finally:
+            if not completed:
+                self.stop('--batch')
+
+    def read(self, name):
+        """The content of one object, or None when git can't find it."""
+        data = None
+        for _, object_info, stream in self.contents([name]):
+            if object_info is not None:
+                data = stream.read()
+        return data
@@ -0,0 +1,549 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import binascii
+import glob
+import mmap
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+# one stage of a path in the index; mode is an int, object_id a hex string
+IndexEntry = namedtuple('IndexEntry', 'path mode object_id stage')
+
+# mode, object id and flags of an entry, skipping its stat data
+ENTRY_HEADER = struct.Struct(">24xI12x20sH")
+EXTENDED_FLAGS = struct.Struct(">H")
+
+FLAG_EXTENDED = 0x4000
+FLAG_STAGE_SHIFT = 12
+# extended flag of entries added with git add --intent-to-add, not really staged yet
+FLAG_INTENT_TO_ADD = 0x2000
+
+PACK_COMMIT, PACK_TREE, PACK_BLOB, PACK_TAG = 1, 2, 3, 4
+PACK_OFS_DELTA, PACK_REF_DELTA = 6, 7
+PACK_TYPES = {PACK_COMMIT: b"commit", PACK_TREE: b"tree", PACK_BLOB: b"blob", PACK_TAG: b"tag"}
+
+TREE_MODE = "40000"
+
+# longer chains are corrupt or loop; git itself never writes chains over 4095
+MAX_DELTA_DEPTH = 10000
+
+# larger indexes (roughly 2500 entries) are read faster by git itself, process startup included
+MAX_INDEX_SIZE = 256 * 1024
+
+# environment that points git somewhere this reader wouldn't look
+GIT_ENVIRONMENT = ("GIT_DIR", "GIT_WORK_TREE", "GIT_COMMON_DIR", "GIT_OBJECT_DIRECTORY",
+                   "GIT_ALTERNATE_OBJECT_DIRECTORIES")
+
+
+class GitIndexError(Exception):
+    """The repository uses something this reader doesn't handle; ask git instead."""
+
+
+def read_file(path):
+    with open(path, 'rb') as data_file:
+        return data_file.read()
+
+
+def read_offset_varint(data, position):
+    """The variable length integer of index v4 paths and pack offsets."""
+    byte = bytearray(data[position:position + 1])[0]
+    position += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = bytearray(data[position:position + 1])[0]
+        position += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, position
+
+
+def read_size_varint(data, position):
+    """The little endian variable length integer of delta headers."""
+    value = 0
+    shift = 0
+    while True:
+        byte = bytearray(data[position:position + 1])[0]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def parse_index(data):
+    """Return the entries and the cache tree of index file data."""
+    if data[:4] != b"DIRC":
+        raise GitIndexError("Not an index file")
+    version, count = struct.unpack_from(">II", data, 4)
+    if version not in (2, 3, 4):
+        raise GitIndexError("Unsupported index version %d" % version)
+    entries = []
+    append = entries.append
+    unpack_header = ENTRY_HEADER.unpack_from
+    find = data.index
+    position = 12
+    previous_path = b""
+    for _ in range(count):
+        mode, object_id, flags = unpack_header(data, position)
+        entry_start = position
+        position += 62
+        extended = 0
+        if flags & FLAG_EXTENDED:
+            extended = EXTENDED_FLAGS.unpack_from(data, position)[0] & FLAG_INTENT_TO_ADD
+            position += 2
+        if version == 4:
+            strip, position = read_offset_varint(data, position)
+            end = find(b"\0", position)
+            path = previous_path[:len(previous_path) - strip] + data[position:end]
+            position = end + 1
+            previous_path = path
+        else:
+            end = find(b"\0", position)
+            path = data[position:end]
+            # entries are NUL padded to a multiple of eight bytes
+            position = entry_start + ((end - entry_start) // 8 + 1) * 8
+        append((path, mode, object_id, (flags >> FLAG_STAGE_SHIFT) & 3, extended))
+    cache_tree = None
+    while position < len(data) - 20:
+        signature = data[position:position + 4]
+        size = struct.unpack_from(">I", data, position + 4)[0]
+        extension = data[position + 8:position + 8 + size]
+        if signature == b"TREE":
+            cache_tree = parse_cache_tree(extension)
+        elif signature == b"link":
+            # only worth it on indexes far larger than this reader takes
+            raise GitIndexError("Split indexes aren't supported")
+        elif signature == b"sdir":
+            raise GitIndexError("Sparse indexes aren't supported")
+        elif signature[:1].isupper():
+            pass  # optional extensions
+        else:
+            raise GitIndexError("Unknown required index extension %r" % signature)
+        position += 8 + size
+    return entries, cache_tree
+
+
+def parse_cache_tree(data):
+    """Map each directory with a valid cached tree to the hex id of that tree.
+
+    Directories are given by their path without a trailing slash, the root
+    by an empty path.
+    """
+    trees = {}
+    position = 0
+    # (path of the directory, subtrees still to read)
+    parents = []
+    while position < len(data):
+        end = data.index(b"\0", position)
+        name = data[position:end]
+        line_end = data.index(b"\n", end)
+        entry_count, subtree_count = [int(value) for value in data[end + 1:line_end].split()]
+        position = line_end + 1
+        while parents and not parents[-1][1]:
+            parents.pop()
+        if parents:
+            parents[-1][1] -= 1
+            path = parents[-1][0] + b"/" + name if parents[-1][0] else name
+        else:
+            path = b""
+        if entry_count >= 0:
+            trees[path] = binascii.hexlify(data[position:position + 20]).decode('ascii')
+            position += 20
+        parents.append([path, subtree_count])
+    return trees
+
+
+def parse_tree(data):
+    """Map the names of a tree object to their (mode, hex id)."""
+    entries = {}
+    position = 0
+    while position < len(data):
+        space = data.index(b" ", position)
+        end = data.index(b"\0", space)
+        mode = data[position:space].decode('ascii')
+        entries[data[space + 1:end]] = (
+            canonical_mode(mode), binascii.hexlify(data[end + 1:end + 21]).decode('ascii'))
+        position = end + 21
+    return entries
+
+
+def canonical_mode(mode):
+    # git normalizes old group writable file modes the same way
+    if mode.startswith("100"):
+        return "100755" if int(mode, 8) & 0o111 else "100644"
+    return mode
+
+
+def apply_delta(base, delta):
+    source_size, position = read_size_varint(delta, 0)
+    target_size, position = read_size_varint(delta, position)
+    if source_size != len(base):
+        raise GitIndexError("Delta doesn't apply to its base")
+    target = []
+    delta = bytearray(delta)
+    while position < len(delta):
+        opcode = delta[position]
+        position += 1
+        if opcode & 0x80:
+            offset = 0
+            size = 0
+            for shift in range(4):
+                if opcode & (1 << shift):
+                    offset |= delta[position] << (8 * shift)
+                    position += 1
+            for shift in range(3):
+                if opcode & (0x10 << shift):
+                    size |= delta[position] << (8 * shift)
+                    position += 1
+            target.append(base[offset:offset + (size or 0x10000)])
+        elif opcode:
+            target.append(bytes(delta[position:position + opcode]))
+            position += opcode
+        else:
+            raise GitIndexError("Invalid delta opcode")
+    target = b"".join(target)
+    if len(target) != target_size:
+        raise GitIndexError("Delta produced the wrong size")
+    return target
+
+
+class PackFile(object):
+    """A packfile and its version 2 index, both memory mapped."""
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.pack_path = index_path[:-len(".idx")] + ".pack"
+        with open(index_path, 'rb') as index_file:
+            self.index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.pack_path, 'rb') as pack_file:
+            self.pack = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.index[:8] != b"\377tOc\0\0\0\2":
+            raise GitIndexError("Unsupported pack index %s" % index_path)
+        self.fanout = struct.unpack_from(">256I", self.index, 8)
+        self.count = self.fanout[255]
+        self.names_offset = 8 + 256 * 4
+        self.offsets_offset = self.names_offset + self.count * 24
+        self.large_offsets_offset = self.offsets_offset + self.count * 4
+
+    def find(self, raw_id):
+        """Return the offset of the object in the pack, or None."""
+        first_byte = bytearray(raw_id[:1])[0]
+        low = self.fanout[first_byte - 1] if first_byte else 0
+        high = self.fanout[first_byte]
+        while low < high:
+            middle = (low + high) // 2
+            name_offset = self.names_offset + middle * 20
+            name = self.index[name_offset:name_offset + 20]
+            if name < raw_id:
+                low = middle + 1
+            elif name > raw_id:
+                high = middle
+            else:
+                offset = struct.unpack_from(">I", self.index, self.offsets_offset + middle * 4)[0]
+                if offset & 0x80000000:
+                    offset = struct.unpack_from(
+                        ">Q", self.index,
+                        self.large_offsets_offset + (offset & 0x7fffffff) * 8)[0]
+                return offset
+        return None
+
+    def inflate(self, position, size):
+        decompressor = zlib.decompressobj()
+        chunks = []
+        while not decompressor.eof:
+            if position >= len(self.pack):
+                raise GitIndexError("Truncated object in %s" % self.pack_path)
+            chunks.append(decompressor.decompress(self.pack[position:position + 65536]))
+            position += 65536
+        data = b"".join(chunks)
+        if len(data) != size:
+            raise GitIndexError("Object of the wrong size in %s" % self.pack_path)
+        return data
+
+    def header(self, offset):
+        """Return the type, the inflated size and the data offset of the object at offset."""
+        byte = bytearray(self.pack[offset:offset + 1])[0]
+        position = offset + 1
+        pack_type = (byte >> 4) & 7
+        size = byte & 0x0f
+        shift = 4
+        while byte & 0x80:
+            byte = bytearray(self.pack[position:position + 1])[0]
+            position += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+        return pack_type, size, position
+
+    def close(self):
+        self.index.close()
+        self.pack.close()
+
+
+class GitRepository(object):
+    """Reads the index, refs and objects of a repository without running git.
+
+    Only what the hooks need is supported: index versions 2 to 4, loose
+    and packed refs, loose objects and version 2 pack indexes. Anything else, or an index over max_index_size, raises
+    GitIndexError so callers can ask git.
+    """
+
+    def __init__(self, start_dir=None):
+        if any(os.environ.get(name) for name in GIT_ENVIRONMENT):
+            raise GitIndexError("Repository set through the environment")
+        self.root, self.git_dir = self.find(os.path.realpath(start_dir or os.getcwd()))
+        common_dir_file = os.path.join(self.git_dir, "commondir")
+        self.common_dir = self.git_dir
+        if os.path.isfile(common_dir_file):
+            common_dir = read_file(common_dir_file).decode('utf-8').strip()
+            self.common_dir = os.path.normpath(os.path.join(self.git_dir, common_dir))
+        self.objects_dir = os.path.join(self.common_dir, "objects")
+        if os.path.exists(os.path.join(self.objects_dir, "info", "alternates")):
+            raise GitIndexError("Alternate object directories aren't supported")
+        if os.path.isdir(os.path.join(self.common_dir, "reftable")):
+            raise GitIndexError("Reftable refs aren't supported")
+        config_path = os.path.join(self.common_dir, "config")
+        if os.path.isfile(config_path) and b"objectformat" in read_file(config_path).lower():
+            raise GitIndexError("Only SHA-1 repositories are supported")
+        self.index_path = os.environ.get("GIT_INDEX_FILE") or os.path.join(self.git_dir, "index")
+        self.max_index_size = MAX_INDEX_SIZE
+        self.packs = None
+        self.trees = {}
+
+    @staticmethod
+    def find(directory):
+        while True:
+            dot_git = os.path.join(directory, ".git")
+            if os.path.isdir(dot_git):
+                return directory, dot_git
+            if os.path.isfile(dot_git):
+                content = read_file(dot_git).decode('utf-8').strip()
+                if not content.startswith("gitdir: "):
+                    raise GitIndexError("Invalid .git file in %s" % directory)
+                return directory, os.path.normpath(os.path.join(directory, content[8:]))
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                raise GitIndexError("Not in a git repository")
+            directory = parent
+
+    def read_index(self):
+        """Return the index entries as (path, mode, raw id, stage) and the cache tree.
+
+        Entries added with --intent-to-add are left out, as git diff --staged
+        leaves them out.
+        """
+        try:
+            data = read_file(self.index_path)
+        except (IOError, OSError):
+            return [], {}
+        if self.max_index_size is not None and len(data) > self.max_index_size:
+            raise GitIndexError("Index larger than %d bytes" % self.max_index_size)
+        try:
+            entries, cache_tree = parse_index(data)
+        except (struct.error, ValueError, IndexError) as exp:
+            raise GitIndexError("Unreadable index %s: %s" % (self.index_path, exp))
+        return [entry[:4] for entry in entries if not entry[4]], cache_tree or {}
+
+    def index_entries(self):
+        entries, _ = self.read_index()
+        return [self.make_entry(entry) for entry in entries]
+
+    @staticmethod
+    def make_entry(entry):
+        path, mode, object_id, stage = entry
+        return IndexEntry(path.decode('utf-8'), mode,
+                          binascii.hexlify(object_id).decode('ascii'), stage)
+
+    def resolve_ref(self, name):
+        for _ in range(10):
+            for base_dir in (self.git_dir, self.common_dir):
+                ref_path = os.path.join(base_dir, *name.split("/"))
+                if os.path.isfile(ref_path):
+                    value = read_file(ref_path).decode('utf-8').strip()
+                    break
+            else:
+                value = self.packed_refs().get(name)
+                if value is None:
+                    return None  # unborn branch
+            if not value.startswith("ref: "):
+                return value
+            name = value[5:]
+        raise GitIndexError("Symbolic ref loop at %s" % name)
+
+    def packed_refs(self):
+        refs = {}
+        try:
+            lines = read_file(os.path.join(self.common_dir, "packed-refs")).decode('utf-8')
+        except (IOError, OSError):
+            return refs
+        for line in lines.splitlines():
+            if line and line[0] not in "#^":
+                object_id, name = line.split(" ", 1)
+                refs[name] = object_id
+        return refs
+
+    def load_packs(self):
+        if self.packs is None:
+            self.packs = [PackFile(index_path) for index_path in sorted(
+                glob.glob(os.path.join(self.objects_dir, "pack", "pack-*.idx")))]
+        return self.packs
+
+    def loose_object(self, object_id):
+        """Return the type and content of a loose object, or None when it isn't loose."""
+        loose_path = os.path.join(self.objects_dir, object_id[:2], object_id[2:])
+        try:
+            data = zlib.decompress(read_file(loose_path))
+        except (IOError, OSError):
+            return None
+        header, _, content = data.partition(b"\0")
+        return header.split(b" ")[0], content
+
+    def find_packed(self, object_id):
+        """Return the pack holding an object and its offset there."""
+        raw_id = binascii.unhexlify(object_id)
+        for pack in self.load_packs():
+            offset = pack.find(raw_id)
+            if offset is not None:
+                return pack, offset
+        raise GitIndexError("Object %s not found" % object_id)
+
+    def read_object(self, object_id):
+        """Return the type and content of an object, as bytes.
+
+        Delta chains are followed in a loop down to their base, then the
+        deltas are applied back up, so deep chains don't exhaust the stack.
+        """
+        try:
+            loose = self.loose_object(object_id)
+            if loose is not None:
+                return loose
+            deltas = []
+            pack, offset = self.find_packed(object_id)
+            while True:
+                if len(deltas) > MAX_DELTA_DEPTH:
+                    raise GitIndexError("Delta chain of %s too deep" % object_id)
+                pack_type, size, position = pack.header(offset)
+                if pack_type == PACK_OFS_DELTA:
+                    distance, position = read_offset_varint(pack.pack, position)
+                    deltas.append(pack.inflate(position, size))
+                    offset -= distance
+                elif pack_type == PACK_REF_DELTA:
+                    base_id = binascii.hexlify(pack.pack[position:position + 20]).decode('ascii')
+                    deltas.append(pack.inflate(position + 20, size))
+                    loose = self.loose_object(base_id)
+                    if loose is not None:
+                        object_type, data = loose
+                        break
+                    pack, offset = self.find_packed(base_id)
+                elif pack_type in PACK_TYPES:
+                    object_type, data = PACK_TYPES[pack_type], pack.inflate(position, size)
+                    break
+                else:
+                    raise GitIndexError("Unknown object type %d in %s"
+                                        % (pack_type, pack.pack_path))
+            for delta in reversed(deltas):
+                data = apply_delta(data, delta)
+            return object_type, data
+        except (struct.error, ValueError, IndexError, TypeError, zlib.error) as exp:
+            raise GitIndexError("Unreadable object %s: %s" % (object_id, exp))
+
+    def head_tree(self):
+        """The hex id of the tree of HEAD, or None on an unborn branch."""
+        object_id = self.resolve_ref("HEAD")
+        while object_id is not None:
+            object_type, content = self.read_object(object_id)
+            if object_type == b"commit":
+                return content[5:content.index(b"\n")].decode('ascii')
+            if object_type != b"tag":
+                raise GitIndexError("HEAD points to a %s" % object_type)
+            object_id = content[7:content.index(b"\n")].decode('ascii')
+        return None
+
+    def read_tree(self, tree_id):
+        if tree_id not in self.trees:
+            object_type, content = self.read_object(tree_id)
+            if object_type != b"tree":
+                raise GitIndexError("%s is not a tree" % tree_id)
+            self.trees[tree_id] = parse_tree(content)
+        return self.trees[tree_id]
+
+    def tree_files(self, tree_id, directory):
+        for name, (mode, object_id) in self.read_tree(tree_id).items():
+            path = directory + b"/" + name
+            if mode == TREE_MODE:
+                for file_path in self.tree_files(object_id, path):
+                    yield file_path
+            else:
+                yield path
+
+    def staged_changes(self):
+        """Return (status, path) of every path the index changes relative to HEAD.
+
+        The status is A, M, D or U for unmerged paths, as git diff --staged
+        --no-renames reports them. Directories whose cached tree in the
+        index matches HEAD are skipped without reading their trees.
+        """
+        entries, cache_tree = self.read_index()
+        # files and subdirectories of each directory in the index
+        files = {}
+        subdirs = {}
+        known = set([b""])
+        unmerged = set()
+        for path, mode, object_id, stage in entries:
+            if stage:
+                unmerged.add(path)
+                continue
+            directory, _, name = path.rpartition(b"/")
+            files.setdefault(directory, {})[name] = ("%o" % mode, object_id)
+            while directory not in known:
+                known.add(directory)
+                parent, _, name = directory.rpartition(b"/")
+                subdirs.setdefault(parent, set()).add(name)
+                directory = parent
+        changes = []
+        try:
+            self.compare_tree(b"", self.head_tree(), files, subdirs, cache_tree, changes)
+            changes = [(status, path) for status, path in changes if path not in unmerged]
+            changes.extend(("U", path) for path in unmerged)
+            changes.sort(key=lambda change: change[1])
+            return [(status, path.decode('utf-8')) for status, path in changes]
+        except (ValueError, IndexError, struct.error, zlib.error) as exp:
+            raise GitIndexError("Unreadable objects: %s" % exp)
+
+    def compare_tree(self, directory, tree_id, files, subdirs, cache_tree, changes):
+        if tree_id is not None and cache_tree.get(directory) == tree_id:
+            return
+        head = self.read_tree(tree_id) if tree_id is not None else {}
+        index_files = files.get(directory, {})
+        index_dirs = subdirs.get(directory, ())
+        for name in set(head) | set(index_files) | set(index_dirs):
+            path = directory + b"/" + name if directory else name
+            head_mode, head_id = head.get(name, (None, None))
+            head_is_tree = head_mode == TREE_MODE
+            if name in index_dirs:
+                self.compare_tree(path, head_id if head_is_tree else None,
+                                  files, subdirs, cache_tree, changes)
+            elif head_is_tree:
+                changes.extend(("D", deleted) for deleted in self.tree_files(head_id, path))
+            if name in index_files:
+                mode, object_id = index_files[name]
+                if head_mode is None or head_is_tree:
+                    changes.append(("A", path))
+                elif (mode, binascii.hexlify(object_id).decode('ascii')) != (head_mode, head_id):
+                    changes.append(("M", path))
+            elif head_mode is not None and not head_is_tree:
+                changes.append(("D", path))
+
+    def close(self):
+        for pack in self.packs or ():
+            pack.close()
+        self.packs = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
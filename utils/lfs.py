@@ -0,0 +1,193 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import re
+
+# what git-lfs writes in place of the content of a tracked file
+POINTER_PREFIXES = (b"version https://git-lfs.github.com/spec/v1\n",
+                    b"version https://hawser.github.com/spec/v1\n")
+
+# macros git itself defines
+BUILTIN_MACROS = {"binary": [("diff", False), ("merge", False), ("text", False)]}
+
+
+def translate_pattern(pattern):
+    """Regular expression source of a gitattributes pattern, matched with slashes significant."""
+    parts = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index) and (index == 0 or pattern[index - 1] == "/"):
+            parts.append("(?:.*/)?")
+            index += 3
+        elif pattern.startswith("**", index) and index + 2 == len(pattern) and \
+                (index == 0 or pattern[index - 1] == "/"):
+            parts.append(".*")
+            index += 2
+        elif char == "*":
+            parts.append("[^/]*")
+            index += 1
+            while index < len(pattern) and pattern[index] == "*":
+                index += 1
+        elif char == "?":
+            parts.append("[^/]")
+            index += 1
+        elif char == "[":
+            end = index + 1
+            if end < len(pattern) and pattern[end] in "!^":
+                end += 1
+            if end < len(pattern) and pattern[end] == "]":
+                end += 1
+            end = pattern.find("]", end)
+            if end < 0:
+                parts.append(re.escape(char))
+                index += 1
+                continue
+            content = pattern[index + 1:end]
+            negate = content[:1] in ("!", "^")
+            if negate:
+                content = content[1:]
+            parts.append("[%s%s]" % ("^" if negate else "", content.replace("\\", "\\\\")))
+            index = end + 1
+        elif char == "\\" and index + 1 < len(pattern):
+            parts.append(re.escape(pattern[index + 1]))
+            index += 2
+        else:
+            parts.append(re.escape(char))
+            index += 1
+    return "".join(parts)
+
+
+def split_pattern(line):
+    """Split a line into its pattern, unquoted if needed, and the rest."""
+    if not line.startswith('"'):
+        parts = line.split(None, 1)
+        return parts[0], parts[1] if len(parts) > 1 else ""
+    chars = []
+    index = 1
+    while index < len(line) and line[index] != '"':
+        if line[index] == "\\" and index + 1 < len(line):
+            index += 1
+        chars.append(line[index])
+        index += 1
+    return "".join(chars), line[index + 1:]
+
+
+def parse_attributes(text):
+    """Return the (name, state) pairs of an attribute list.
+
+    The state is True when set, False when unset, None when unspecified
+    and the value otherwise.
+    """
+    attributes = []
+    for word in text.split():
+        if word.startswith("-"):
+            attributes.append((word[1:], False))
+        elif word.startswith("!"):
+            attributes.append((word[1:], None))
+        elif "=" in word:
+            name, _, value = word.partition("=")
+            attributes.append((name, value))
+        else:
+            attributes.append((word, True))
+    return attributes
+
+
+class AttributeRule(object):
+    """One pattern line of an attributes file, reduced to its filter attribute."""
+
+    def __init__(self, pattern, filter_state):
+        self.filter_state = filter_state
+        self.basename_only = "/" not in pattern
+        self.regex = re.compile(translate_pattern(pattern.lstrip("/")) + r"\Z")
+
+    def matches(self, relative_path):
+        if self.basename_only:
+            relative_path = relative_path.rpartition("/")[2]
+        return self.regex.match(relative_path) is not None
+
+
+class LfsClassifier(object):
+    """Tells which paths git-lfs tracks, from the filter=lfs patterns of the attributes files.
+
+    As for git, .git/info/attributes comes first, then the .gitattributes
+    of the directory of a path and of every directory above it up to the
+    root, and in each file the last matching line wins. Every attributes
+    file is read and compiled once, whatever the number of paths.
+    """
+
+    def __init__(self, root, git_dir=None):
+        self.root = root
+        self.git_dir = git_dir or os.path.join(root, ".git")
+        self.macros = dict(BUILTIN_MACROS)
+        self.rules = {}
+        # macros may only be defined at the top, so the top files are read first
+        self.info_rules = self.read_rules(os.path.join(self.git_dir, "info", "attributes"), True)
+        self.rules[""] = self.read_rules(os.path.join(self.root, ".gitattributes"), True)
+
+    def read_rules(self, attributes_path, allow_macros):
+        rules = []
+        try:
+            with io.open(attributes_path, encoding='utf-8') as attributes_file:
+                lines = attributes_file.read().splitlines()
+        except (IOError, OSError):
+            return rules
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            pattern, rest = split_pattern(line)
+            attributes = parse_attributes(rest)
+            if pattern.startswith("[attr]"):
+                if allow_macros:
+                    self.macros[pattern[6:]] = attributes
+                continue
+            if pattern.endswith("/") or pattern.startswith("!"):
+                continue  # never matches a file
+            filter_state = self.filter_state(attributes)
+            if filter_state is not Ellipsis:
+                rules.append(AttributeRule(pattern, filter_state))
+        return rules
+
+    def filter_state(self, attributes, depth=0):
+        """The state the attributes give the filter, or Ellipsis when they leave it alone."""
+        state = Ellipsis
+        for name, value in attributes:
+            if name == "filter":
+                state = value
+            elif name in self.macros and value is True and depth < 8:
+                macro_state = self.filter_state(self.macros[name], depth + 1)
+                if macro_state is not Ellipsis:
+                    state = macro_state
+        return state
+
+    def directory_rules(self, directory):
+        if directory not in self.rules:
+            self.rules[directory] = self.read_rules(
+                os.path.join(self.root, directory, ".gitattributes"), False)
+        return self.rules[directory]
+
+    def filter_of(self, path):
+        """The filter attribute of a path relative to the root, with slashes."""
+        for rule in reversed(self.info_rules):
+            if rule.matches(path):
+                return rule.filter_state
+        directory = path
+        while directory:
+            directory = directory.rpartition("/")[0]
+            relative_path = path[len(directory) + 1:] if directory else path
+            for rule in reversed(self.directory_rules(directory)):
+                if rule.matches(relative_path):
+                    return rule.filter_state
+        return None
+
+    def tracked(self, paths):
+        return set(path for path in paths if self.filter_of(path) == "lfs")
+
+
+def is_lfs_pointer(data):
+    return data.startswith(POINTER_PREFIXES)
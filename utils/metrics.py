@@ -0,0 +1,267 @@
+# coding=utf-8
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import io
+import json
+import os
+import time
+
+from utils import util
+from utils.file_lock import FileLock
+
+# the store is compacted to half this many runs once it holds more
+MAX_RUNS = 5000
+
+# runs compared by the trend column: the newest ones against the ones before them
+TREND_WINDOW = 20
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class RunMetrics(object):
+    """Durations and counts of one run of a hook.
+
+    Phases are timed back to back: begin() ends the current phase, if
+    any, and starts the next one.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.started = time.time()
+        self.process_count = util.process_count
+        self.phases = {}
+        self.counts = {}
+        self.current = None
+        self.phase_started = None
+
+    def begin(self, name=None):
+        now = time.time()
+        if self.current is not None:
+            self.phases[self.current] = self.phases.get(self.current, 0.0) + now - self.phase_started
+        self.current = name
+        self.phase_started = now
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def record(self):
+        self.begin()
+        counts = dict(self.counts)
+        counts["git_processes"] = util.process_count - self.process_count
+        return {
+            "command": self.command,
+            "time": round(self.started, 3),
+            "duration": round(time.time() - self.started, 6),
+            "phases": dict((name, round(seconds, 6)) for name, seconds in self.phases.items()),
+            "counts": counts,
+        }
+
+
+class MetricsStore(object):
+    """Run records kept one JSON object per line, newest last.
+
+    Appends and compaction happen under a lock on a side file, which also
+    holds the number of records in the store, so a run can tell when to
+    compact without reading the store. Unreadable lines, such as one cut
+    short by a crash, are skipped when loading.
+    """
+
+    def __init__(self, store_path, max_runs=MAX_RUNS):
+        self.store_path = store_path
+        self.lock_path = store_path + ".lock"
+        self.max_runs = max_runs
+
+    def append(self, record):
+        line = json.dumps(record, sort_keys=True, separators=(",", ":")) + "\n"
+        with FileLock(self.lock_path) as lock:
+            with io.open(self.store_path, 'a', encoding='utf-8') as store_file:
+                store_file.write(line)
+            lock.lock_file.seek(0)
+            count = lock.lock_file.read().strip()
+            # stores written before the count was kept are counted once
+            count = int(count) + 1 if count.isdigit() else len(self.load())
+            if count > self.max_runs:
+                count = self.compact()
+            lock.lock_file.seek(0)
+            lock.lock_file.truncate()
+            lock.lock_file.write("%d\n" % count)
+
+    def load(self, command=None):
+        records = []
+        try:
+            with io.open(self.store_path, encoding='utf-8') as store_file:
+                for line in store_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if command is None or record.get("command") == command:
+                        records.append(record)
+        except (IOError, OSError):
+            pass
+        return records
+
+    def compact(self):
+        """Keep the newest half of max_runs records and return how many are left.
+
+        Only called with the lock held, and the store is replaced by a
+        rename, so readers see either the old or the new store.
+        """
+        records = self.load()
+        if len(records) <= self.max_runs:
+            return len(records)
+        records = records[-(self.max_runs // 2):]
+        temp_path = "%s.%d.tmp" % (self.store_path, os.getpid())
+        with io.open(temp_path, 'w', encoding='utf-8') as store_file:
+            for record in records:
+                store_file.write(json.dumps(record, sort_keys=True, separators=(",", ":")) + "\n")
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, self.store_path)
+        else:  # pragma: no cover (python 2)
+            os.rename(temp_path, self.store_path)
+        return len(records)
+
+
+def record_run(store_path, metrics):
+    """Append the run to the store, never failing the hook over it."""
+    try:
+        MetricsStore(store_path).append(metrics.record())
+    except (IOError, OSError) as exp:
+        print("\033[93mCould not record run metrics in %s: %s\033[0m" % (store_path, exp))
+
+
+def percentile(values, fraction):
+    """Linear interpolation between the closest ranks of the sorted values."""
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def series(records):
+    """Map each command to its metrics, each metric to its values in run order."""
+    commands = {}
+    for record in records:
+        metrics = commands.setdefault(record.get("command", "unknown"), {})
+        metrics.setdefault(("duration", None), []).append(record.get("duration", 0.0))
+        for name, seconds in record.get("phases", {}).items():
+            metrics.setdefault(("phase", name), []).append(seconds)
+        for name, value in record.get("counts", {}).items():
+            metrics.setdefault(("count", name), []).append(value)
+    return commands
+
+
+def trend(values, window=TREND_WINDOW):
+    """Relative change of the median of the newest window against the window before it."""
+    if len(values) < 2 * window:
+        window = len(values) // 2
+    if not window:
+        return None
+    before = percentile(values[-2 * window:-window], 0.5)
+    after = percentile(values[-window:], 0.5)
+    if not before:
+        return None
+    return (after - before) / before
+
+
+def metric_label(kind, name):
+    if kind == "duration":
+        return "duration (s)"
+    if kind == "phase":
+        return "phase %s (s)" % name
+    return name
+
+
+def format_table(records, window=TREND_WINDOW):
+    lines = []
+    for command, metrics in sorted(series(records).items()):
+        runs = len(metrics[("duration", None)])
+        lines.append("\033[93m%s\033[0m: %d runs" % (command, runs))
+        lines.append("  %-28s %10s %10s %10s %10s %8s"
+                     % ("metric", "p50", "p90", "p99", "max", "trend"))
+        for (kind, name), values in sorted(metrics.items(), key=lambda item: (
+                item[0][0] != "duration", item[0][0], item[0][1])):
+            change = trend(values, window)
+            lines.append("  %-28s %10.3f %10.3f %10.3f %10.3f %8s" % (
+                metric_label(kind, name),
+                percentile(values, 0.5), percentile(values, 0.9), percentile(values, 0.99),
+                max(values), "-" if change is None else "%+.0f%%" % (change * 100)))
+    return "\n".join(lines)
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_openmetrics(records):
+    """Summaries per command in the OpenMetrics text format."""
+    families = {}
+    for command, metrics in series(records).items():
+        for (kind, name), values in metrics.items():
+            labels = 'command="%s"' % escape_label(command)
+            if kind == "duration":
+                family = "hook_run_duration_seconds"
+            elif kind == "phase":
+                family = "hook_phase_duration_seconds"
+                labels += ',phase="%s"' % escape_label(name)
+            else:
+                family = "hook_%s" % "".join(
+                    char if char.isalnum() else "_" for char in name)
+            families.setdefault(family, []).append((labels, values))
+    lines = []
+    for family, samples in sorted(families.items()):
+        lines.append("# TYPE %s summary" % family)
+        for labels, values in sorted(samples, key=lambda sample: sample[0]):
+            for quantile in QUANTILES:
+                lines.append('%s{%s,quantile="%s"} %r' % (
+                    family, labels, quantile, float(percentile(values, quantile))))
+            lines.append("%s_count{%s} %d" % (family, labels, len(values)))
+            lines.append("%s_sum{%s} %r" % (family, labels, float(sum(values))))
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    """Show how the runs recorded with --metrics evolve."""
+    parser = argparse.ArgumentParser(description="Percentiles and trends of recorded hook runs")
+    parser.add_argument("store", nargs="?", help="Metrics file written by the hooks. "
+                                                 "[default: $HOOK_METRICS]",
+                        default=os.environ.get("HOOK_METRICS"))
+    parser.add_argument("--command", dest="command",
+                        help="Only show runs of this console script.",
+                        metavar="command")
+    parser.add_argument("--last", dest="last", type=int,
+                        help="Only use the newest runs.",
+                        metavar="runs")
+    parser.add_argument("--window", dest="window", type=int,
+                        help="Runs on each side of the trend comparison. [default: %(default)s]",
+                        metavar="runs", default=TREND_WINDOW)
+    parser.add_argument("--openmetrics", dest="openmetrics", action="store_true",
+                        help="Print OpenMetrics text instead of the table.",
+                        default=False)
+    args = parser.parse_args(argv)
+    if not args.store:
+        parser.error("No metrics file given and $HOOK_METRICS is not set")
+
+    records = MetricsStore(args.store).load(args.command)
+    if args.last:
+        records = records[-args.last:]
+    if args.openmetrics:
+        print(format_openmetrics(records), end="")
+    elif records:
+        print(format_table(records, args.window))
+    else:
+        print("No runs recorded in %s" % args.store)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -3,28 +3,166 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import hashlib
+import os
 import subprocess
 
+from utils.git_index import GitIndexError
+from utils.git_index import GitRepository
+
+
+# processes started through cmd_output, for run metrics
+process_count = 0
+
 
 class CalledProcessError(RuntimeError):
     pass
 
 
 def added_files():
-    return set(cmd_output(
-        'git', 'diff', '--staged', '--name-only', '--diff-filter=A',
-    ).splitlines())
+    """Paths, relative to the repository, that the index adds to HEAD."""
+    return staged_files('A')
+
+
+def staged_files(statuses='AM'):
+    """Paths, relative to the repository, whose staged change has one of the statuses."""
+    repository = None
+    try:
+        repository = GitRepository()
+        changes = repository.staged_changes()
+    except GitIndexError:
+        return set(cmd_output(
+            'git', 'diff', '--staged', '--name-only', '--diff-filter=' + statuses, '--no-renames',
+        ).splitlines())
+    finally:
+        if repository is not None:
+            repository.close()
+    return set(path for status, path in changes if status in statuses)
 
 
 def cmd_output(*cmd, **kwargs):
+    global process_count
+    process_count += 1
     retcode = kwargs.pop('retcode', 0)
+    stdin = kwargs.pop('input', None)
     popen_kwargs = {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE}
+    if stdin is not None:
+        popen_kwargs['stdin'] = subprocess.PIPE
+        stdin = stdin.encode('UTF-8')
     popen_kwargs.update(kwargs)
     proc = subprocess.Popen(cmd, **popen_kwargs)
-    stdout, stderr = proc.communicate()
+    stdout, stderr = proc.communicate(stdin)
     stdout = stdout.decode('UTF-8')
     if stderr is not None:
         stderr = stderr.decode('UTF-8')
     if retcode is not None and proc.returncode != retcode:
         raise CalledProcessError(cmd, retcode, proc.returncode, stdout, stderr)
     return stdout
+
+
+def git_root():
+    return cmd_output('git', 'rev-parse', '--show-toplevel').strip()
+
+
+def repository_root():
+    """The top of the repository, or the current directory outside of any."""
+    try:
+        with GitRepository() as repository:
+            return repository.root
+    except GitIndexError:
+        try:
+            return git_root()
+        except (CalledProcessError, OSError):
+            return os.getcwd()
+
+
+def staged_hunks(*file_names):
+    """Map the absolute path of each staged file to the (first, last) line
+    ranges that were added or changed in the index."""
+    root = git_root()
+    diff = cmd_output(
+        'git', 'diff', '--staged', '--no-color', '--no-ext-diff', '-U0',
+        '--src-prefix=a/', '--dst-prefix=b/', '--',
+        *file_names
+    )
+    hunks = {}
+    ranges = None
+    for line in diff.splitlines():
+        if line.startswith('+++ '):
+            path = line[4:]
+            if path.startswith('"') and path.endswith('"'):
+                path = path[1:-1]
+            if path == '/dev/null':
+                ranges = None
+                continue
+            path = os.path.normpath(os.path.join(root, path[2:]))
+            ranges = hunks.setdefault(path, [])
+        elif line.startswith('@@ ') and ranges is not None:
+            new_range = line.split(' ')[2][1:]
+            first, _, length = new_range.partition(',')
+            length = int(length) if length else 1
+            if length:
+                ranges.append((int(first), int(first) + length - 1))
+    return hunks
+
+
+def blob_id(data):
+    """The object id git assigns to a blob with these bytes."""
+    header = ('blob %d\0' % len(data)).encode('ascii')
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def index_entries(*file_names):
+    """Map the absolute path of each staged file to its (mode, object id, path in repo)."""
+    try:
+        repository = GitRepository()
+        entries = repository.index_entries()
+    except GitIndexError:
+        return ls_files_entries(*file_names)
+    entries_by_path = {}
+    for entry in entries:
+        if entry.stage == 0:
+            path = os.path.normpath(os.path.join(repository.root, entry.path))
+            entries_by_path[path] = ('%06o' % entry.mode, entry.object_id, entry.path)
+    if not file_names:
+        return entries_by_path
+    wanted = [os.path.realpath(file_name) for file_name in file_names]
+    selected = dict((path, entries_by_path[path]) for path in wanted if path in entries_by_path)
+    # directories match everything below them, as pathspecs do
+    directories = tuple(path + os.sep for path in wanted if os.path.isdir(path))
+    if directories:
+        selected.update((path, value) for path, value in entries_by_path.items()
+                        if path.startswith(directories))
+    return selected
+
+
+def ls_files_entries(*file_names):
+    root = git_root()
+    entries = {}
+    output = cmd_output('git', 'ls-files', '--stage', '--full-name', '-z', '--', *file_names)
+    for record in output.split('\0'):
+        if not record:
+            continue
+        info, repo_path = record.split('\t', 1)
+        mode, object_id, stage = info.split()
+        if stage == '0':
+            path = os.path.normpath(os.path.join(root, repo_path))
+            entries[path] = (mode, object_id, repo_path)
+    return entries
+
+
+def hash_objects(*file_names):
+    """Write the working tree files into the object store with one git process."""
+    if not file_names:
+        return []
+    # git reads --stdin-paths from the top of the repository, not the current directory
+    output = cmd_output('git', 'hash-object', '-w', '--stdin-paths',
+                        input=''.join(os.path.abspath(name) + '\n' for name in file_names))
+    return output.split()
+
+
+def update_index(entries):
+    """Point index entries at new blobs; entries are (mode, object id, path in repo)."""
+    if entries:
+        cmd_output('git', 'update-index', '--index-info',
+                   input=''.join('%s %s\t%s\n' % entry for entry in entries))